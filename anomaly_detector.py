@@ -0,0 +1,568 @@
+"""
+即時樣本的串流異常與漂移偵測。
+
+在擷取流程中作為樣本回呼，每筆樣本只做固定次數的運算、保存固定大小的狀態（O(1) 時間與記憶體）：
+
+    spike     液溫／參考溫度偏離 EWMA 平均超過 spike_z 個 EWMA 標準差（滾動變異數）
+    stuck     同一暫存器讀值連續 stuck_s 秒完全相同（感測器或暫存器卡住）
+    tracking  溫差追蹤誤差 e = 設定值 −（參考 − 液溫）的 EWMA 超過 tracking_threshold_c
+              （閉迴路時以控制器的前饋目標取代暫存器設定值，即控制器未能消除的殘差）
+    drift     e 相對於穩定後基準值的雙邊 CUSUM 超過 cusum_h（液溫感測器緩慢漂移）
+
+所有時間常數與門檻都以樣本時間戳計算（EWMA 的權重依樣本間隔換算），因此 1 Hz 擷取與
+高頻擷取期間的 20 Hz 樣本行為一致；CUSUM 以「°C × 秒」累積。
+設定值改變後 grace_s 秒內為正常暫態，不檢查 tracking／drift，之後以 baseline_s 秒的平均
+重新學習 CUSUM 基準值。操作員或 NC 執行器的設定值變更以 notify_setpoint() 明確通知；
+閉迴路控制啟用時（set_closed_loop(True)）設定值暫存器每幾秒就被控制器微調，這些變化不算步階，
+不會重新進入寬限期。漂移的 CUSUM 仍以暫存器設定值的誤差計算：閉迴路下液溫感測器漂移會被控制器
+「修正」掉，量測溫差照樣貼近目標，但命令 − 量測溫差（即控制器的修正量）會持續增加。
+加工負載使這個誤差週期性擺動（模擬器為 1800 秒週期），基準值的學習時間須涵蓋至少一個負載週期，
+否則基準會偏向學習當時的相位，之後每個負載高峰都被當成漂移。
+同一種異常持續期間只發出一次事件，條件解除後才會再次觸發。
+
+事件寫入 temperature_log.db 的 anomaly_event 資料表，並推送給 socket 訂閱者：
+    [AnomalySubscribe]        → 保持連線，每個事件一行 JSON
+    [AnomalyRecent]: <筆數>   → 最近的事件（JSON 陣列）
+
+    python anomaly_detector.py subscribe
+    python anomaly_detector.py recent --limit 20
+    python anomaly_detector.py simulate --duration 21600     # 注入漂移／卡住／尖峰，檢查偵測結果
+    python anomaly_detector.py simulate --no-faults --duration 86400   # 掃描負載相位，檢查誤報
+    python anomaly_detector.py simulate --closed-loop --duration 21600  # 經 SetpointController 閉迴路控制
+    python anomaly_detector.py bench --devices 200            # 每筆樣本處理耗時
+"""
+import json
+import math
+import time
+import queue
+import random
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+import temperature_store
+from metrics import counter, histogram
+from temperature_store import Sample
+from sample_ring import SERVICE_ADDRESS
+
+SENSOR_CHANNELS = ("sensor_liquid", "sensor_reference")
+
+
+@dataclass
+class AnomalyEvent:
+    timestamp: datetime
+    device: str
+    kind: str
+    channel: str
+    value: float
+    threshold: float
+    detail: str = ""
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["timestamp"] = self.timestamp.isoformat(timespec="seconds")
+        return data
+
+
+def _ewma_weight(dt_s: float, tau_s: float) -> float:
+    """樣本間隔 dt_s 對應的 EWMA 權重；1 Hz、tau_s=20 時約 0.05。"""
+    return 1.0 - math.exp(-dt_s / tau_s) if dt_s > 0 else 0.0
+
+
+class _ChannelState:
+    """單一通道的 EWMA 平均／變異數，以及讀值最後一次改變的時間。"""
+    __slots__ = ("mean", "var", "first", "last", "changed")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.first = None     # 第一筆樣本時間（暖機）
+        self.last = None
+        self.changed = None   # 讀值最後一次改變的時間
+
+    def update(self, x: float, t: datetime, alpha: float):
+        if self.first is None:
+            self.first = t
+            self.mean = x
+        else:
+            delta = x - self.mean
+            increment = alpha * delta
+            self.mean += increment
+            self.var = (1 - alpha) * (self.var + delta * increment)
+        if x != self.last:
+            self.last, self.changed = x, t
+
+    def unchanged_s(self, t: datetime) -> float:
+        return (t - self.changed).total_seconds()
+
+
+class AnomalyDetector:
+    """單台冷卻機的偵測器；on_sample 回傳本筆樣本觸發的事件（通常為空串列）。"""
+
+    def __init__(self, device: str = "cooler", ewma_tau_s: float = 20.0, spike_z: float = 6.0,
+                 min_std_c: float = 0.05, warmup_s: float = 30.0, stuck_s: float = 120.0,
+                 tracking_tau_s: float = 50.0, tracking_threshold_c: float = 1.5, grace_s: float = 300.0,
+                 baseline_s: float = 1800.0, cusum_k_c: float = 0.75, cusum_h_c: float = 100.0,
+                 setpoint_step_c: float = 0.05, max_dt_s: float = 5.0):
+        self.device = device
+        self.ewma_tau_s = ewma_tau_s
+        self.spike_z = spike_z
+        self.min_std_c = min_std_c
+        self.warmup_s = warmup_s
+        self.stuck_s = stuck_s
+        self.tracking_tau_s = tracking_tau_s
+        self.tracking_threshold_c = tracking_threshold_c
+        self.grace_s = grace_s
+        self.baseline_s = baseline_s
+        self.cusum_k_c = cusum_k_c
+        self.cusum_h_c = cusum_h_c            # °C × 秒
+        self.setpoint_step_c = setpoint_step_c
+        self.max_dt_s = max_dt_s              # 擷取中斷後的第一筆樣本最多以此間隔計權
+
+        self.channels = {channel: _ChannelState() for channel in SENSOR_CHANNELS}
+        self.active = set()          # 目前持續中的 (kind, channel)
+        self.samples = 0
+        self._last_time = None
+        self._setpoint = None
+        self._settle_until = None
+        self._grace_pending = False
+        self.closed_loop = False
+        self.target = None           # 閉迴路的前饋目標（°C）
+        self._reset_tracking()
+
+    def _reset_tracking(self):
+        self.tracking_error = None   # e 的 EWMA
+        self._baseline_seconds = 0.0
+        self._baseline_sum = 0.0
+        self.baseline = None         # CUSUM 基準值（穩定後 baseline_s 秒內 e 的時間加權平均）
+        self.drift_level = 0.0       # e − 基準值的慢速 EWMA（時間常數 baseline_s，濾掉負載擺動）
+        self._drift_since = None     # 最近一次漂移事件的時間
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+
+    # ───────── 設定值事件（由擷取流程以外的寫入端呼叫） ─────────
+    def notify_setpoint(self, target: float = None):
+        """操作員或 NC 執行器變更了設定值（或閉迴路的前饋目標 target）：下一筆樣本起重新進入寬限期。"""
+        if target is not None:
+            self.target = float(target)
+        self._grace_pending = True
+
+    def set_closed_loop(self, enabled: bool, target: float = None):
+        """閉迴路控制啟用時，暫存器設定值的變化視為控制器的微調，不觸發寬限期；切換本身視為步階。"""
+        if target is not None:
+            self.target = float(target)
+        if bool(enabled) != self.closed_loop:
+            self.closed_loop = bool(enabled)
+            self._grace_pending = True
+
+    def _begin_grace(self, setpoint: float, timestamp: datetime):
+        self._setpoint = setpoint
+        self._settle_until = timestamp + timedelta(seconds=self.grace_s)
+        self._grace_pending = False
+        self._reset_tracking()
+        self.active.discard(("tracking", "sensor_liquid"))
+        self.active.discard(("drift", "sensor_liquid"))
+
+    def _edge(self, events, condition: bool, kind: str, channel: str, sample: Sample,
+              value: float, threshold: float, detail: str):
+        """條件成立且尚未觸發時產生事件；條件解除時重新待命。"""
+        key = (kind, channel)
+        if condition:
+            if key not in self.active:
+                self.active.add(key)
+                events.append(AnomalyEvent(sample.timestamp, self.device, kind, channel,
+                                           round(value, 4), threshold, detail))
+        else:
+            self.active.discard(key)
+
+    def on_sample(self, sample: Sample) -> list:
+        events = []
+        self.samples += 1
+        t = sample.timestamp
+        dt = 0.0 if self._last_time is None else min(max((t - self._last_time).total_seconds(), 0.0),
+                                                      self.max_dt_s)
+        self._last_time = t
+
+        # 1. 各感測通道：尖峰（EWMA z 分數）與卡住（讀值持續 stuck_s 秒未變）
+        alpha = _ewma_weight(dt, self.ewma_tau_s)
+        for channel in SENSOR_CHANNELS:
+            x = getattr(sample, channel)
+            state = self.channels[channel]
+            if state.first is not None and (t - state.first).total_seconds() >= self.warmup_s:
+                std = max(math.sqrt(state.var), self.min_std_c)
+                z = abs(x - state.mean) / std
+                self._edge(events, z > self.spike_z, "spike", channel, sample, x, self.spike_z,
+                           f"z={z:.1f}，EWMA {state.mean:.2f} ± {std:.3f} °C")
+            state.update(x, t, alpha)
+            unchanged = state.unchanged_s(t)
+            self._edge(events, unchanged >= self.stuck_s, "stuck", channel, sample, x,
+                       self.stuck_s, f"讀值 {unchanged:.0f} 秒未變")
+
+        # 2. 設定值變更：進入暫態寬限期並重新學習基準
+        #    開迴路時由暫存器的步階判斷；閉迴路時只依 notify_setpoint()（控制器的微調不算）
+        setpoint = sample.set_temperature
+        stepped = (self._setpoint is None or
+                   (not self.closed_loop and abs(setpoint - self._setpoint) >= self.setpoint_step_c))
+        if stepped or self._grace_pending:
+            self._begin_grace(setpoint, t)
+        self._setpoint = setpoint
+        if t < self._settle_until:
+            return self._emit(events)
+
+        # 3. 溫差追蹤誤差（EWMA，遲滯：降到門檻一半以下才解除）；閉迴路時對前饋目標計算
+        diff = sample.sensor_reference - sample.sensor_liquid
+        error = setpoint - diff
+        reference = self.target if self.closed_loop and self.target is not None else setpoint
+        tracking = reference - diff
+        if self.tracking_error is None:
+            self.tracking_error = tracking
+        else:
+            self.tracking_error += _ewma_weight(dt, self.tracking_tau_s) * (tracking - self.tracking_error)
+        magnitude = abs(self.tracking_error)
+        tracking_on = magnitude > (self.tracking_threshold_c / 2
+                                   if ("tracking", "sensor_liquid") in self.active
+                                   else self.tracking_threshold_c)
+        self._edge(events, tracking_on, "tracking", "sensor_liquid", sample, self.tracking_error,
+                   self.tracking_threshold_c, f"設定 {reference:.1f} °C，溫差誤差 EWMA {self.tracking_error:+.2f} °C")
+
+        # 4. CUSUM 漂移偵測：先以至少一個負載週期學習基準值，之後累積超出容許量 k 的偏差（× 秒）
+        if self.baseline is None:
+            self._baseline_sum += error * dt
+            self._baseline_seconds += dt
+            if self._baseline_seconds >= self.baseline_s:
+                self.baseline = self._baseline_sum / self._baseline_seconds
+            return self._emit(events)
+        deviation = error - self.baseline
+        self.drift_level += _ewma_weight(dt, self.baseline_s) * (deviation - self.drift_level)
+        if ("drift", "sensor_liquid") in self.active:
+            # 已通報：至少維持 baseline_s 秒（讓慢速平均追上），且慢速平均的偏差回到 ± k/2 以內
+            # 才解除並重新累積；負載低谷不會被誤判為已恢復
+            if ((t - self._drift_since).total_seconds() >= self.baseline_s
+                    and abs(self.drift_level) < self.cusum_k_c / 2):
+                self.active.discard(("drift", "sensor_liquid"))
+            return self._emit(events)
+        self.cusum_pos = max(0.0, self.cusum_pos + (deviation - self.cusum_k_c) * dt)
+        self.cusum_neg = max(0.0, self.cusum_neg + (-deviation - self.cusum_k_c) * dt)
+        if self.cusum_pos > self.cusum_h_c or self.cusum_neg > self.cusum_h_c:
+            direction = "偏高" if self.cusum_pos > self.cusum_h_c else "偏低"
+            self._edge(events, True, "drift", "sensor_liquid", sample, deviation, self.cusum_h_c,
+                       f"溫差誤差相對基準 {self.baseline:+.2f} °C 持續{direction} {deviation:+.2f} °C"
+                       f"（液溫感測器可能漂移）")
+            self.cusum_pos = self.cusum_neg = 0.0
+            self._drift_since = t
+        return self._emit(events)
+
+    def _emit(self, events):
+        for event in events:
+            counter("cooler_anomaly_events_total", "串流異常偵測事件數", kind=event.kind).inc()
+            logging.warning(f"⚠️ {event.device} {event.kind}/{event.channel}：{event.detail}")
+        return events
+
+    def snapshot(self) -> dict:
+        return {
+            "device": self.device,
+            "samples": self.samples,
+            "closed_loop": self.closed_loop,
+            "target_c": self.target,
+            "in_grace": self._settle_until is not None and self._last_time < self._settle_until,
+            "active": sorted(f"{kind}/{channel}" for kind, channel in self.active),
+            "tracking_error_c": self.tracking_error,
+            "baseline_c": self.baseline,
+            "drift_level_c": self.drift_level,
+            "cusum_pos": self.cusum_pos,
+            "cusum_neg": self.cusum_neg,
+        }
+
+
+class AnomalyMonitor:
+    """
+    多台冷卻機共用的入口：依裝置建立偵測器，事件交給 on_event 回呼（寫入資料庫、推送訂閱者），
+    並保留最近 history 筆事件供 [AnomalyRecent] 查詢。
+    """
+
+    def __init__(self, on_event=None, history: int = 200, **detector_kwargs):
+        self.on_event = on_event
+        self.detector_kwargs = detector_kwargs
+        self.detectors = {}
+        self.recent = deque(maxlen=history)
+        self.subscribers = EventBroadcaster()
+
+    def detector(self, device: str) -> AnomalyDetector:
+        detector = self.detectors.get(device)
+        if detector is None:
+            detector = self.detectors[device] = AnomalyDetector(device, **self.detector_kwargs)
+        return detector
+
+    def notify_setpoint(self, target: float = None, device: str = "cooler"):
+        self.detector(device).notify_setpoint(target)
+
+    def set_closed_loop(self, enabled: bool, target: float = None, device: str = "cooler"):
+        self.detector(device).set_closed_loop(enabled, target)
+
+    def on_sample(self, sample: Sample, device: str = "cooler") -> list:
+        start = time.perf_counter()
+        events = self.detector(device).on_sample(sample)
+        histogram("cooler_anomaly_sample_seconds", "異常偵測每筆樣本耗時",
+                  buckets=(1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3)).observe(time.perf_counter() - start)
+        for event in events:
+            self.recent.append(event)
+            self.subscribers.publish(event)
+            if self.on_event:
+                self.on_event(event)
+        return events
+
+
+# -----------------------------
+# socket 訂閱者：每個事件一行 JSON
+# -----------------------------
+class EventBroadcaster:
+    """每個訂閱者一個有界佇列；publish 不會阻塞擷取流程，佇列滿時丟棄該訂閱者的事件。"""
+
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self._queues = []
+        self._lock = threading.Lock()
+
+    def publish(self, event: AnomalyEvent):
+        line = json.dumps(event.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock:
+            queues = list(self._queues)
+        for q in queues:
+            try:
+                q.put_nowait(line)
+            except queue.Full:
+                counter("cooler_anomaly_dropped_total", "訂閱者佇列已滿而丟棄的事件數").inc()
+
+    def serve(self, client_socket, heartbeat_s: float = 15.0):
+        """在處理該連線的執行緒中持續推送事件，直到連線中斷。"""
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._queues.append(q)
+        try:
+            client_socket.sendall(b'{"subscribed": true}\n')
+            while True:
+                try:
+                    line = q.get(timeout=heartbeat_s)
+                except queue.Empty:
+                    line = "\n"   # 心跳：偵測已斷線的訂閱者
+                client_socket.sendall(line.encode("utf-8"))
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._queues.remove(q)
+
+    def __len__(self):
+        return len(self._queues)
+
+
+# -----------------------------
+# 儲存
+# -----------------------------
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS anomaly_event (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            device TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            channel TEXT,
+            value REAL,
+            threshold REAL,
+            detail TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_anomaly_event_time ON anomaly_event (timestamp)")
+    conn.commit()
+
+
+def save_event(conn, event: AnomalyEvent) -> int:
+    cursor = conn.execute(
+        "INSERT INTO anomaly_event (timestamp, device, kind, channel, value, threshold, detail) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (event.timestamp.strftime(temperature_store.TIMESTAMP_FORMAT), event.device, event.kind,
+         event.channel, event.value, event.threshold, event.detail),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def fetch_events(conn, limit: int = 50, device: str = None) -> list:
+    sql = "SELECT timestamp, device, kind, channel, value, threshold, detail FROM anomaly_event"
+    params = []
+    if device:
+        sql += " WHERE device = ?"
+        params.append(device)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    columns = ("timestamp", "device", "kind", "channel", "value", "threshold", "detail")
+    return [dict(zip(columns, row)) for row in conn.execute(sql, params)]
+
+
+def handle_command(monitor: AnomalyMonitor, message: str):
+    """處理 [AnomalyRecent] 並回傳 JSON 字串；[AnomalySubscribe] 由呼叫端以 monitor.subscribers.serve 處理。"""
+    command, _, argument = message.partition(":")
+    if command.strip() != "[AnomalyRecent]":
+        return None
+    limit = int(argument) if argument.strip() else 20
+    events = list(monitor.recent)[-limit:]
+    return json.dumps([event.to_dict() for event in reversed(events)], ensure_ascii=False)
+
+
+# -----------------------------
+# 模擬與效能量測
+# -----------------------------
+def simulate(duration_s: float = 6 * 3600, seed: int = 1, faults: bool = True, detector: AnomalyDetector = None,
+             phase: float = 0.0, sample_period_s: float = 1.0, closed_loop: bool = False):
+    """
+    以 cooler_simulator.ThermalModel 產生每 sample_period_s 秒一筆的樣本（經暫存器量化），
+    phase 為加工負載的起始相位。熱模型每秒更新一次（其雜訊以每步計），較短的取樣間隔
+    只是更頻繁地讀取同一狀態，與高頻擷取輪詢機台的情況相同。faults=True 時依序注入：
+    1/6 處參考溫度尖峰、2/6 處液溫感測器漂移 0.0005 °C/s（持續到 3/6）、4/6 處液溫暫存器卡住 5 分鐘；
+    faults=False 時只在 1/2 處把設定值由 5.0 改為 6.0 °C（正常操作，不應產生事件）。
+    closed_loop=True 時加上 0.8 °C 的加工負載偏差，由 SetpointController 以前饋 5.0 °C 閉迴路控制
+    （控制器每幾秒寫入一次設定值），設定值變更改為更新前饋並 notify_setpoint()。
+    回傳 (事件串列, 注入的故障時間表)。
+    """
+    from cooler_simulator import ThermalModel
+    from setpoint_controller import SetpointController
+
+    rng = random.Random(seed)
+    thermal = ThermalModel(phase=phase, load_bias=0.8 if closed_loop else 0.0)
+    detector = detector or AnomalyDetector("sim")
+    controller = None
+    if closed_loop:
+        controller = SetpointController(write_fn=lambda value: setattr(thermal, "setpoint", value))
+        controller.enable(thermal.setpoint)
+        detector.set_closed_loop(True, target=controller.feedforward)
+    start = datetime(2025, 1, 1)
+    schedule = {
+        "spike": duration_s / 6,
+        "drift": (2 * duration_s / 6, 3 * duration_s / 6),
+        "stuck": (4 * duration_s / 6, 4 * duration_s / 6 + 300),
+    }
+    events, stuck_value, stepped = [], None, False
+    t = model_t = 0.0
+    while t < duration_s:
+        t += sample_period_s
+        while model_t < t - 1e-9:
+            thermal.advance(model_t, 1.0, rng)
+            model_t += 1.0
+        if not faults and t >= duration_s / 2 and not stepped:
+            stepped = True
+            if controller is not None:
+                controller.set_feedforward(6.0)
+                detector.notify_setpoint(6.0)
+            else:
+                thermal.setpoint = 6.0
+        liquid, reference = thermal.liquid, thermal.reference
+        if faults:
+            if schedule["spike"] <= t < schedule["spike"] + sample_period_s:
+                reference += 3.0
+            drift_start, drift_end = schedule["drift"]
+            if t >= drift_start:
+                liquid += 0.0005 * (min(t, drift_end) - drift_start)
+            stuck_start, stuck_end = schedule["stuck"]
+            if stuck_start <= t < stuck_end:
+                stuck_value = liquid if stuck_value is None else stuck_value
+                liquid = stuck_value
+        registers = [int(round(liquid * 100)), int(round(reference * 100)), int(round(thermal.setpoint * 10))]
+        sample = temperature_store.sample_from_registers(registers, start + timedelta(seconds=t))
+        if controller is not None:
+            controller.on_sample(sample)
+        for event in detector.on_sample(sample):
+            events.append((t, event))
+    return events, schedule
+
+
+def benchmark(n_devices: int = 200, n_samples: int = 600, seed: int = 0) -> dict:
+    """n_devices 台裝置各 n_samples 筆樣本輪流送入 AnomalyMonitor，回傳每筆耗時與吞吐量。"""
+    rng = random.Random(seed)
+    monitor = AnomalyMonitor()
+    start_time = datetime(2025, 1, 1)
+    devices = [f"cooler-{i}" for i in range(n_devices)]
+    batches = []
+    for step in range(n_samples):
+        ts = start_time + timedelta(seconds=step)
+        batches.append([Sample(ts, 20.0 + rng.gauss(0, 0.05), 25.0 + rng.gauss(0, 0.05), 5.0) for _ in devices])
+    start = time.perf_counter()
+    for samples in batches:
+        for device, sample in zip(devices, samples):
+            monitor.on_sample(sample, device)
+    elapsed = time.perf_counter() - start
+    total = n_devices * n_samples
+    return {"devices": n_devices, "samples": total, "seconds": elapsed,
+            "us_per_sample": elapsed / total * 1e6, "samples_per_s": total / elapsed,
+            "poll_budget_used": elapsed / n_samples}   # 1 Hz 擷取下，每秒實際用掉的秒數
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR, format="%(message)s")
+    parser = argparse.ArgumentParser(description="串流異常與漂移偵測")
+    parser.add_argument("--host", default=SERVICE_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=SERVICE_ADDRESS[1])
+    parser.add_argument("--db", default=temperature_store.DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("subscribe", help="訂閱 cooler_app 的即時異常事件")
+    p_recent = sub.add_parser("recent", help="列出資料庫中最近的事件")
+    p_recent.add_argument("--limit", type=int, default=20)
+    p_recent.add_argument("--device")
+    p_sim = sub.add_parser("simulate", help="以熱模型注入故障並列出偵測結果")
+    p_sim.add_argument("--duration", type=float, default=6 * 3600)
+    p_sim.add_argument("--no-faults", action="store_true", help="只跑正常資料（檢查誤報）")
+    p_sim.add_argument("--phase", type=float, help="加工負載起始相位（弧度）；未指定時 --no-faults 掃描 8 個相位")
+    p_sim.add_argument("--sample-period", type=float, default=1.0, help="樣本間隔秒數（0.05 即高頻擷取的 20 Hz）")
+    p_sim.add_argument("--closed-loop", action="store_true", help="以 SetpointController 閉迴路控制模擬機台")
+    p_bench = sub.add_parser("bench", help="量測多裝置下每筆樣本的處理耗時")
+    p_bench.add_argument("--devices", type=int, default=200)
+    p_bench.add_argument("--samples", type=int, default=600)
+    args = parser.parse_args()
+
+    if args.command == "subscribe":
+        try:
+            with socket.create_connection((args.host, args.port), timeout=5) as sock:
+                sock.sendall(b"[AnomalySubscribe]")
+                sock.settimeout(None)
+                for line in sock.makefile("r", encoding="utf-8"):
+                    if line.strip():
+                        print(line.rstrip(), flush=True)
+        except OSError as e:
+            print(f"無法連線到 cooler_app 的 socket 服務：{e}")
+            return 1
+    elif args.command == "recent":
+        conn = sqlite3.connect(args.db)
+        ensure_schema(conn)
+        for event in fetch_events(conn, args.limit, args.device):
+            print(f"{event['timestamp']}  {event['device']:<12} {event['kind']:<9} "
+                  f"{event['channel']:<17} {event['detail']}")
+    elif args.command == "simulate":
+        if args.phase is not None:
+            phases = [args.phase]
+        else:
+            phases = [2 * math.pi * i / 8 for i in range(8)] if args.no_faults else [0.0]
+        total = 0
+        for phase in phases:
+            events, schedule = simulate(args.duration, faults=not args.no_faults, phase=phase,
+                                        sample_period_s=args.sample_period, closed_loop=args.closed_loop)
+            print(f"相位 {phase:.2f}：" + ("設定值 5.0 → 6.0 @ {:.0f}s".format(args.duration / 2) if args.no_faults
+                                         else "注入 " + "，".join(f"{kind} @ {value}" for kind, value in schedule.items())))
+            for t, event in events:
+                print(f"  t={t:>7.0f}s  {event.kind:<9} {event.channel:<17} {event.detail}")
+            total += len(events)
+        print(f"共 {total} 個事件")
+        if args.no_faults and total:
+            return 1
+    else:
+        result = benchmark(args.devices, args.samples)
+        print(f"{result['devices']} 台 × {args.samples} 筆：每筆 {result['us_per_sample']:.1f} µs，"
+              f"{result['samples_per_s']:.0f} 筆/s；1 Hz 擷取下每秒占用 {result['poll_budget_used'] * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,288 @@
+import io
+import os
+import queue
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# -----------------------------
+# TTS 引擎：synthesize(text) -> (音訊位元組, 副檔名)
+# -----------------------------
+class GTTSEngine:
+    """Google TTS（需連網），輸出 mp3。"""
+    name = "gtts"
+
+    def __init__(self, lang: str = "zh"):
+        self.lang = lang
+
+    def synthesize(self, text: str):
+        from gtts import gTTS
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang).write_to_fp(buffer)
+        return buffer.getvalue(), "mp3"
+
+
+class Pyttsx3Engine:
+    """pyttsx3 離線 TTS（Windows SAPI5 / macOS NSSS / Linux eSpeak），輸出 wav。"""
+    name = "pyttsx3"
+
+    def __init__(self, lang: str = "zh", rate: int = None):
+        self.lang = lang
+        self.rate = rate
+        self._lock = threading.Lock()
+
+    def synthesize(self, text: str):
+        import pyttsx3
+        fd, path = tempfile.mkstemp(suffix=".wav", prefix="tts_")
+        os.close(fd)
+        try:
+            # pyttsx3 引擎非執行緒安全，只能序列化使用
+            with self._lock:
+                engine = pyttsx3.init()
+                if self.rate:
+                    engine.setProperty("rate", self.rate)
+                engine.save_to_file(text, path)
+                engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read(), "wav"
+        finally:
+            os.remove(path)
+
+
+class EspeakEngine:
+    """eSpeak NG 離線 TTS，直接由 stdout 取得 wav，不經過暫存檔。"""
+    name = "espeak"
+
+    def __init__(self, lang: str = "cmn", executable: str = "espeak-ng"):
+        self.lang = lang
+        self.executable = executable
+
+    def synthesize(self, text: str):
+        result = subprocess.run([self.executable, "-v", self.lang, "--stdout", text],
+                                capture_output=True, check=True)
+        return result.stdout, "wav"
+
+
+TTS_ENGINES = {
+    GTTSEngine.name: GTTSEngine,
+    Pyttsx3Engine.name: Pyttsx3Engine,
+    EspeakEngine.name: EspeakEngine,
+}
+
+
+def register_tts_engine(name: str, factory):
+    """註冊自訂 TTS 引擎；factory(lang=...) 需回傳具 synthesize(text) 的物件。"""
+    TTS_ENGINES[name] = factory
+
+
+# -----------------------------
+# STT 引擎：以 speech_recognition 的各種 recognizer 實作
+# -----------------------------
+def _recognize_google(recognizer, audio, language):
+    return recognizer.recognize_google(audio, language=language)
+
+
+def _recognize_sphinx(recognizer, audio, language):
+    return recognizer.recognize_sphinx(audio, language=language)
+
+
+def _recognize_whisper(recognizer, audio, language):
+    # whisper 使用 ISO-639-1 語言代碼（zh-TW -> zh）
+    return recognizer.recognize_whisper(audio, language=language.split("-")[0])
+
+
+def _recognize_vosk(recognizer, audio, language):
+    import json
+    return json.loads(recognizer.recognize_vosk(audio)).get("text", "")
+
+
+STT_ENGINES = {
+    "google": _recognize_google,
+    "sphinx": _recognize_sphinx,
+    "whisper": _recognize_whisper,
+    "vosk": _recognize_vosk,
+}
+
+
+def register_stt_engine(name: str, recognize_fn):
+    """註冊自訂 STT 引擎；recognize_fn(recognizer, audio, language) 需回傳文字。"""
+    STT_ENGINES[name] = recognize_fn
+
+
+# -----------------------------
+# 以內容雜湊為鍵的語音快取
+# -----------------------------
+class PhraseAudioCache:
+    """
+    以 (引擎, 語言, 文字) 的 SHA-256 為鍵，快取合成後的音訊。
+    記憶體層為容量受限的 LRU，可選擇寫入磁碟目錄供重啟後沿用。
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(engine_name: str, lang: str, text: str) -> str:
+        return hashlib.sha256(f"{engine_name}\0{lang}\0{text}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+        if self.cache_dir:
+            for fmt in ("mp3", "wav"):
+                path = self._disk_path(key, fmt)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        entry = (f.read(), fmt)
+                    self._store(key, entry)
+                    with self._lock:
+                        self.hits += 1
+                    return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes, fmt: str):
+        self._store(key, (data, fmt))
+        if self.cache_dir:
+            path = self._disk_path(key, fmt)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def _store(self, key: str, entry):
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key)[0])
+            self._items[key] = entry
+            self._size += len(entry[0])
+            while self._size > self.max_bytes and len(self._items) > 1:
+                _, (old_data, _) = self._items.popitem(last=False)
+                self._size -= len(old_data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._size,
+                    "hits": self.hits, "misses": self.misses}
+
+
+# -----------------------------
+# 播放：每次播放都使用獨立的暫存檔，避免多個 session 互相覆蓋
+# -----------------------------
+def play_audio_bytes(data: bytes, fmt: str):
+    """以 playsound 播放記憶體中的音訊（playsound 只接受路徑，故寫入唯一暫存檔）。"""
+    from playsound import playsound
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="speak_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        playsound(path)
+    finally:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"刪除暫存音檔失敗: {e}")
+
+
+class AudioPipeline:
+    """
+    背景語音管線：TTS 合成／播放與 STT 錄音各自在獨立執行緒的佇列中執行，
+    呼叫端立即取得 Future，不會阻塞 Streamlit 腳本。
+    """
+
+    def __init__(self, tts_engine: str = "gtts", stt_engine: str = "google",
+                 tts_lang: str = "zh", stt_lang: str = "zh-TW",
+                 cache: PhraseAudioCache = None, player=play_audio_bytes):
+        self.tts = TTS_ENGINES[tts_engine](lang=tts_lang)
+        self.tts_lang = tts_lang
+        self.stt_engine = stt_engine
+        self.stt_lang = stt_lang
+        self.cache = cache if cache is not None else PhraseAudioCache()
+        self.player = player
+
+        self._tts_queue = queue.Queue()
+        self._stt_queue = queue.Queue()
+        for target, name in ((self._tts_loop, "tts-worker"), (self._stt_loop, "stt-worker")):
+            threading.Thread(target=target, name=name, daemon=True).start()
+
+    # ───────── TTS ─────────
+    def synthesize(self, text: str):
+        """回傳 (音訊位元組, 副檔名)；重複的語句直接由快取取得。"""
+        key = PhraseAudioCache.make_key(self.tts.name, self.tts_lang, text)
+        entry = self.cache.get(key)
+        if entry is None:
+            data, fmt = self.tts.synthesize(text)
+            self.cache.put(key, data, fmt)
+            entry = (data, fmt)
+        return entry
+
+    def speak(self, text: str, play: bool = True) -> Future:
+        """排入合成（及播放）工作，回傳完成時帶有音訊位元組的 Future。"""
+        future = Future()
+        self._tts_queue.put((text, play, future))
+        return future
+
+    def prefetch(self, phrases):
+        """預先合成常用語句（確認、狀態訊息），之後播放即無合成延遲。"""
+        return [self.speak(text, play=False) for text in phrases]
+
+    def _tts_loop(self):
+        while True:
+            text, play, future = self._tts_queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                data, fmt = self.synthesize(text)
+                if play:
+                    self.player(data, fmt)
+                future.set_result(data)
+            except Exception as e:
+                logging.error(f"語音合成／播放錯誤: {e}")
+                future.set_exception(e)
+
+    # ───────── STT ─────────
+    def listen(self, phrase_time_limit: float = 5) -> Future:
+        """排入錄音與辨識工作，回傳結果文字的 Future（無法辨識時為 None）。"""
+        future = Future()
+        self._stt_queue.put((phrase_time_limit, future))
+        return future
+
+    def _stt_loop(self):
+        recognizer = None
+        while True:
+            phrase_time_limit, future = self._stt_queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                import speech_recognition as sr
+                if recognizer is None:
+                    recognizer = sr.Recognizer()
+                with sr.Microphone() as source:
+                    audio = recognizer.listen(source, phrase_time_limit=phrase_time_limit)
+                try:
+                    text = STT_ENGINES[self.stt_engine](recognizer, audio, self.stt_lang)
+                except sr.UnknownValueError:
+                    text = None
+                future.set_result(text or None)
+            except Exception as e:
+                logging.error(f"語音辨識錯誤: {e}")
+                future.set_exception(e)
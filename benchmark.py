@@ -0,0 +1,358 @@
+"""
+效能基準測試：最佳化器、模型推論、NC 解析與資料庫熱路徑。
+
+以合成資料產生器建立可重現的測試資料（可調大小的 NC 程式、數百萬筆的
+temperature_log 資料庫、(rpm, hour) 查詢網格），量測延遲百分位數、吞吐量與
+峰值記憶體，結果輸出為 JSON；可與先前的基準檔比較並標示效能退化。
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --threshold 0.15 --fail-on-regression
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+import temperature_store
+from nc_program import parse_nc_segments, parse_nc_code_file
+
+PRESETS = {
+    "quick": {"nc_segments": 2_000, "db_rows": 200_000, "grid_rpm": 3, "grid_hour": 2,
+              "optimizer_trials": 20, "repeat": 20},
+    "full": {"nc_segments": 50_000, "db_rows": 2_000_000, "grid_rpm": 6, "grid_hour": 4,
+             "optimizer_trials": 60, "repeat": 50},
+}
+
+
+# -----------------------------
+# 合成資料產生器
+# -----------------------------
+def generate_nc_program(n_segments: int, seed: int = 0) -> str:
+    """產生含 n_segments 個轉速區段的 NC 程式（S 指令、G01 移動與 G04 延遲）。"""
+    rng = random.Random(seed)
+    lines = ["%", "O1000", "G90 G54 G17"]
+    for i in range(n_segments):
+        lines.append(f"N{i * 10 + 10} S{rng.choice([1500, 3000, 6000, 9000, 12000])} M03")
+        for _ in range(rng.randint(1, 4)):
+            lines.append(f"G01 X{rng.uniform(-100, 100):.3f} Y{rng.uniform(-100, 100):.3f} F{rng.randint(200, 2000)}")
+        lines.append(f"G04 F{rng.randint(10, 600)}.")
+    lines += ["M05", "M30", "%"]
+    return "\n".join(lines)
+
+
+def generate_temperature_db(path: str, n_rows: int, seed: int = 0,
+                            interval_s: int = 1, batch_size: int = 50_000) -> str:
+    """產生含 n_rows 筆 1 Hz 取樣（結束於現在）的 temperature_log 資料庫。"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    temperature_store.ensure_schema(conn)
+    start = datetime.now().replace(microsecond=0) - timedelta(seconds=n_rows * interval_s)
+    liquid, reference, setpoint = 22.0, 23.0, 5.0
+    insert_sql = ("INSERT INTO temperature_log (timestamp, sensor_liquid, sensor_reference, set_temperature) "
+                  "VALUES (?, ?, ?, ?)")
+    batch = []
+    for i in range(n_rows):
+        if i % 3600 == 0:
+            setpoint = rng.choice([2.5, 4.0, 5.0, 6.5, 8.5])
+        liquid += 0.02 * (reference - setpoint - liquid) + rng.gauss(0, 0.01)
+        reference += rng.gauss(0, 0.005)
+        ts = (start + timedelta(seconds=i * interval_s)).strftime(temperature_store.TIMESTAMP_FORMAT)
+        batch.append((ts, round(liquid, 2), round(reference, 2), setpoint))
+        if len(batch) >= batch_size:
+            conn.executemany(insert_sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(insert_sql, batch)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def generate_query_grid(n_rpm: int, n_hour: int, rpm_range=(1500, 12000), hour_range=(0.5, 5.0)):
+    """產生 (rpm, hour) 查詢網格。"""
+    def linspace(lo, hi, n):
+        return [lo] if n == 1 else [lo + (hi - lo) * i / (n - 1) for i in range(n)]
+    return [(rpm, hour) for rpm in linspace(*rpm_range, n_rpm) for hour in linspace(*hour_range, n_hour)]
+
+
+# -----------------------------
+# 量測
+# -----------------------------
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(fn, repeat: int, warmup: int = 1, ops_per_call: int = 1) -> dict:
+    """
+    執行 fn 並回傳延遲百分位數（毫秒）、吞吐量（ops/s）與峰值記憶體（MB）。
+    峰值記憶體以 tracemalloc 另外跑一次量測，避免影響計時。
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ordered = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "repeat": repeat,
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p90_ms": _percentile(ordered, 0.90) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+        "mean_ms": total / repeat * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "throughput_ops": (repeat * ops_per_call) / total if total > 0 else None,
+        "peak_mem_mb": peak / 1024 / 1024,
+    }
+
+
+# -----------------------------
+# 測試案例
+# -----------------------------
+def _ensure_models(workdir: str):
+    """找不到模型檔時，以樣本資料訓練一組暫存模型。"""
+    energy_path = os.path.abspath("energy_model_poly_ridge.joblib")
+    error_path = os.path.abspath("error_model_poly_ridge.joblib")
+    if os.path.exists(energy_path) and os.path.exists(error_path):
+        return energy_path, error_path
+    from joblib import dump
+    import training_dataset
+    data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Cooling_Machine_Data_EN.csv")
+    energy_model, error_model, *_ = training_dataset.train_models(training_dataset.load_and_preprocess(data_path))
+    energy_path = os.path.join(workdir, "energy_model_poly_ridge.joblib")
+    error_path = os.path.join(workdir, "error_model_poly_ridge.joblib")
+    dump(energy_model, energy_path)
+    dump(error_model, error_path)
+    return energy_path, error_path
+
+
+def bench_nc_parse(cfg, ctx):
+    program = generate_nc_program(cfg["nc_segments"])
+    encoded = program.encode("utf-8")
+    lines = program.count("\n") + 1
+    return {
+        "parse_nc_segments": measure(lambda: parse_nc_segments(program), cfg["repeat"], ops_per_call=lines),
+        "parse_nc_code_file": measure(lambda: parse_nc_code_file(io.BytesIO(encoded)), cfg["repeat"],
+                                      ops_per_call=lines),
+    }
+
+
+def bench_model_predict(cfg, ctx):
+    import pandas as pd
+    from joblib import load
+    energy_model = load(ctx["energy_model_path"])
+    error_model = load(ctx["error_model_path"])
+    single = pd.DataFrame([[6000, 2.0, 5.0]], columns=["RPM", "Hour", "TempOffset"])
+    grid = [(rpm, hour, offset / 10) for rpm, hour in ctx["grid"] for offset in range(25, 86)]
+    batch = pd.DataFrame(grid, columns=["RPM", "Hour", "TempOffset"])
+    return {
+        "predict_single_row": measure(lambda: (energy_model.predict(single), error_model.predict(single)),
+                                      cfg["repeat"] * 5),
+        "predict_batch": measure(lambda: (energy_model.predict(batch), error_model.predict(batch)),
+                                 cfg["repeat"], ops_per_call=len(batch)),
+        "model_load": measure(lambda: (load(ctx["energy_model_path"]), load(ctx["error_model_path"])),
+                              cfg["repeat"]),
+    }
+
+
+def bench_optimizer(cfg, ctx):
+    import optuna
+    from temp_optimizer import find_optimal_temp_offset
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    grid = ctx["grid"]
+    state = {"i": 0}
+
+    def run_one():
+        rpm, hour = grid[state["i"] % len(grid)]
+        state["i"] += 1
+        find_optimal_temp_offset(rpm, hour,
+                                 energy_model_path=ctx["energy_model_path"],
+                                 error_model_path=ctx["error_model_path"],
+                                 n_trials=cfg["optimizer_trials"])
+
+    return {"find_optimal_temp_offset": measure(run_one, max(len(grid), 3))}
+
+
+def bench_storage(cfg, ctx):
+    db_path = ctx["db_path"]
+    results = {}
+
+    # CoolerApp.log_temperature：以不建立 Qt 視窗的替身物件呼叫原方法
+    try:
+        from cooler_app import CoolerApp
+    except ImportError as e:
+        results["log_temperature"] = {"skipped": f"無法匯入 cooler_app: {e}"}
+    else:
+        conn = sqlite3.connect(db_path)
+        fake_app = SimpleNamespace(db_connection=conn)
+        values = [2250, 2310, 50]
+        results["log_temperature"] = measure(lambda: CoolerApp.log_temperature(fake_app, values),
+                                             cfg["repeat"] * 5)
+        conn.close()
+
+    results["fetch_latest"] = measure(
+        lambda: temperature_store.fetch_cooler_temperature(db_path=db_path), cfg["repeat"])
+    results["fetch_delta_40s"] = measure(
+        lambda: temperature_store.fetch_cooler_temperature(delta_seconds=40, db_path=db_path),
+        max(3, cfg["repeat"] // 5))
+
+    conn = temperature_store.connect(db_path)
+    end = datetime.now() + timedelta(seconds=1)
+    results["downsample_30d"] = measure(
+        lambda: temperature_store.fetch_range_downsampled(conn, end - timedelta(days=30), end),
+        max(3, cfg["repeat"] // 5))
+    conn.close()
+    return results
+
+
+CASES = {
+    "nc_parse": bench_nc_parse,
+    "model_predict": bench_model_predict,
+    "optimizer": bench_optimizer,
+    "storage": bench_storage,
+}
+
+
+# -----------------------------
+# 基準比較
+# -----------------------------
+COMPARED_METRICS = ("p50_ms", "p99_ms", "peak_mem_mb")
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float):
+    """比較各案例的 p50/p99/峰值記憶體，超過 (1 + threshold) 倍者視為退化。"""
+    regressions, report = [], {}
+    for case, benches in results.items():
+        for name, current in benches.items():
+            previous = baseline.get("results", {}).get(case, {}).get(name)
+            if not previous or "skipped" in current or "skipped" in previous:
+                continue
+            entry = {}
+            for metric in COMPARED_METRICS:
+                old, new = previous.get(metric), current.get(metric)
+                if not old or new is None:
+                    continue
+                ratio = new / old
+                entry[metric] = {"baseline": old, "current": new, "ratio": ratio}
+                if ratio > 1 + threshold:
+                    regressions.append(f"{case}.{name}.{metric}: {old:.3f} → {new:.3f} (×{ratio:.2f})")
+            report[f"{case}.{name}"] = entry
+    return report, regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷卻系統熱路徑效能基準測試")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--nc-segments", type=int)
+    parser.add_argument("--db-rows", type=int)
+    parser.add_argument("--repeat", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="合成資料目錄（預設為暫存目錄）；可重複使用已產生的資料庫")
+    parser.add_argument("--output", help="結果 JSON 輸出路徑（預設輸出至 stdout）")
+    parser.add_argument("--baseline", help="先前的結果 JSON，用於比較")
+    parser.add_argument("--threshold", type=float, default=0.10, help="視為退化的相對增幅")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    # 熱路徑本身的 INFO 日誌會淹沒輸出，基準測試期間只保留警告
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    cfg = dict(PRESETS[args.preset])
+    for key in ("nc_segments", "db_rows", "repeat"):
+        if getattr(args, key) is not None:
+            cfg[key] = getattr(args, key)
+    random.seed(args.seed)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cooler_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    ctx = {"grid": generate_query_grid(cfg["grid_rpm"], cfg["grid_hour"])}
+
+    if "storage" in args.cases:
+        db_path = os.path.join(workdir, f"temperature_log_{cfg['db_rows']}.db")
+        if not os.path.exists(db_path):
+            start = time.perf_counter()
+            generate_temperature_db(db_path, cfg["db_rows"], seed=args.seed)
+            print(f"已產生 {cfg['db_rows']} 筆資料庫（{time.perf_counter() - start:.1f}s）: {db_path}",
+                  file=sys.stderr)
+        ctx["db_path"] = db_path
+    if {"model_predict", "optimizer"} & set(args.cases):
+        ctx["energy_model_path"], ctx["error_model_path"] = _ensure_models(workdir)
+
+    results = {}
+    for case in args.cases:
+        print(f"執行 {case} ...", file=sys.stderr)
+        try:
+            results[case] = CASES[case](cfg, ctx)
+        except ImportError as e:
+            results[case] = {"_case": {"skipped": f"缺少相依套件: {e}"}}
+
+    output = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "preset": args.preset,
+            "config": cfg,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparison, regressions = compare_with_baseline(results, baseline, args.threshold)
+        output["comparison"] = {"baseline": args.baseline, "threshold": args.threshold,
+                                "metrics": comparison, "regressions": regressions}
+        for line in regressions:
+            print(f"⚠️ 效能退化：{line}", file=sys.stderr)
+        if regressions and args.fail_on_regression:
+            exit_code = 1
+
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
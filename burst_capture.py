@@ -0,0 +1,248 @@
+"""
+設定值變更前後的高頻突發擷取（burst），供步階響應分析。
+
+平常擷取維持 1 Hz；當 external_write_temperature 寫入新的設定值（變化 ≥ setpoint_step_c），
+或相鄰兩筆樣本的溫度變化超過 delta_threshold_c 時觸發 burst：
+擷取頻率暫時提高到 burst_interval_ms（預設 50 ms = 20 Hz），持續 post_trigger_s 秒。
+觸發前的資料來自小型環形緩衝區（pre_trigger_s 秒），整段 burst 以
+float32 欄位壓縮成單一 blob 存入 temperature_log.db 的 burst_capture 資料表，
+高頻資料不會寫進 temperature_log。
+
+    python burst_capture.py list
+    python burst_capture.py show 3            # 步階響應指標
+    python burst_capture.py export 3 --csv burst3.csv
+"""
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import temperature_store
+from metrics import counter
+from temperature_store import Sample
+
+BLOB_COLUMNS = ("t_rel_s",) + temperature_store.CHANNELS
+BLOB_DTYPE = "<f4"
+
+
+@dataclass
+class Burst:
+    trigger_time: datetime
+    reason: str
+    detail: str = ""
+    end_time: datetime = None
+    interval_ms: int = 50
+    samples: list = field(default_factory=list)
+
+
+class BurstCapture:
+    """作為擷取流程的樣本回呼；poll_interval_ms() 告訴擷取迴圈目前應使用的間隔。"""
+
+    def __init__(self, on_complete=None, pre_trigger_s: float = 10.0, post_trigger_s: float = 60.0,
+                 burst_interval_ms: int = 50, delta_threshold_c: float = 0.3,
+                 setpoint_step_c: float = 0.5, max_pre_samples: int = 256):
+        self.on_complete = on_complete
+        self.pre_trigger_s = pre_trigger_s
+        self.post_trigger_s = post_trigger_s
+        self.burst_interval_ms = burst_interval_ms
+        self.delta_threshold_c = delta_threshold_c
+        self.setpoint_step_c = setpoint_step_c
+        self._pre = deque(maxlen=max_pre_samples)
+        self._active = None
+        self._last_sample = None
+        self._last_setpoint = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self._active is not None
+
+    def poll_interval_ms(self, base_interval_ms: int) -> int:
+        return self.burst_interval_ms if self._active is not None else base_interval_ms
+
+    # ───────── 觸發 ─────────
+    def trigger(self, reason: str, detail: str = "", now: datetime = None) -> bool:
+        """開始 burst；已在進行中時延長結束時間。回傳是否為新的 burst。"""
+        now = now or datetime.now()
+        with self._lock:
+            if self._active is not None:
+                self._active.end_time = now + timedelta(seconds=self.post_trigger_s)
+                return False
+            start = now - timedelta(seconds=self.pre_trigger_s)
+            burst = Burst(trigger_time=now, reason=reason, detail=detail,
+                          end_time=now + timedelta(seconds=self.post_trigger_s),
+                          interval_ms=self.burst_interval_ms)
+            burst.samples = [s for s in self._pre if s.timestamp >= start]
+            self._active = burst
+        counter("cooler_burst_triggers_total", "高頻突發擷取觸發次數", reason=reason).inc()
+        logging.info(f"📸 開始高頻擷取（{reason} {detail}），{self.burst_interval_ms} ms 間隔")
+        return True
+
+    def notify_setpoint(self, value: float, now: datetime = None):
+        """設定值寫入後呼叫；與上次寫入值相差 ≥ setpoint_step_c 時觸發。"""
+        previous, self._last_setpoint = self._last_setpoint, float(value)
+        if previous is None or abs(float(value) - previous) >= self.setpoint_step_c:
+            self.trigger("setpoint", f"{previous} → {value}", now)
+
+    # ───────── 樣本 ─────────
+    def on_sample(self, sample: Sample):
+        previous, self._last_sample = self._last_sample, sample
+        if self._last_setpoint is None:
+            self._last_setpoint = sample.set_temperature   # 以機台目前的設定值作為比較基準
+        if previous is not None and self._active is None:
+            delta = max(abs(sample.sensor_liquid - previous.sensor_liquid),
+                        abs(sample.sensor_reference - previous.sensor_reference))
+            if delta >= self.delta_threshold_c:
+                self.trigger("delta", f"Δ{delta:.2f} °C", sample.timestamp)
+
+        finished = None
+        with self._lock:
+            self._pre.append(sample)
+            if self._active is not None:
+                self._active.samples.append(sample)
+                if sample.timestamp >= self._active.end_time:
+                    finished, self._active = self._active, None
+        if finished is not None:
+            logging.info(f"📸 高頻擷取結束：{len(finished.samples)} 筆樣本")
+            if self.on_complete:
+                self.on_complete(finished)
+
+
+# -----------------------------
+# 儲存：每個 burst 一筆，樣本壓縮為單一 blob
+# -----------------------------
+def ensure_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS burst_capture (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            trigger_time TEXT NOT NULL,
+            reason TEXT,
+            detail TEXT,
+            interval_ms INTEGER,
+            sample_count INTEGER,
+            data BLOB NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_burst_capture_time ON burst_capture (trigger_time)")
+    conn.commit()
+
+
+def encode_samples(samples, trigger_time: datetime) -> bytes:
+    """欄位 (相對觸發秒數, 液溫, 參考, 設定) 以 float32 排列後 zlib 壓縮。"""
+    t0 = trigger_time.timestamp()
+    matrix = np.array([(s.timestamp.timestamp() - t0, *s[1:]) for s in samples], dtype=BLOB_DTYPE)
+    return zlib.compress(matrix.reshape(-1, len(BLOB_COLUMNS)).tobytes(), 6)
+
+
+def decode_samples(blob: bytes) -> np.ndarray:
+    """回傳 (n, 4) 陣列，欄位依 BLOB_COLUMNS。"""
+    return np.frombuffer(zlib.decompress(blob), dtype=BLOB_DTYPE).reshape(-1, len(BLOB_COLUMNS))
+
+
+def save_burst(conn, burst: Burst) -> int:
+    cursor = conn.execute(
+        "INSERT INTO burst_capture (trigger_time, reason, detail, interval_ms, sample_count, data) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (burst.trigger_time.isoformat(timespec="milliseconds"), burst.reason, burst.detail,
+         burst.interval_ms, len(burst.samples), encode_samples(burst.samples, burst.trigger_time)),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def load_burst(conn, burst_id: int):
+    row = conn.execute(
+        "SELECT trigger_time, reason, detail, interval_ms, data FROM burst_capture WHERE id = ?", (burst_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    trigger_time, reason, detail, interval_ms, data = row
+    return {"id": burst_id, "trigger_time": trigger_time, "reason": reason, "detail": detail,
+            "interval_ms": interval_ms, "data": decode_samples(data)}
+
+
+# -----------------------------
+# 步階響應分析
+# -----------------------------
+def step_response(data: np.ndarray, settle_band: float = 0.05) -> dict:
+    """
+    以溫差 d = 參考 − 液溫 分析觸發（t=0）後的響應：
+    初值取觸發前平均、終值取最後 10% 樣本平均，
+    計算 10–90% 上升時間、超越量與進入終值 ±settle_band 範圍的安定時間。
+    """
+    t = data[:, 0].astype(float)
+    diff = (data[:, 2] - data[:, 1]).astype(float)
+    before, after = t < 0, t >= 0
+    if not before.any() or after.sum() < 3:
+        return {"error": "觸發前後樣本不足"}
+    initial = float(diff[before].mean())
+    t_after, d_after = t[after], diff[after]
+    final = float(d_after[-max(1, len(d_after) // 10):].mean())
+    step = final - initial
+    result = {"initial_diff_c": initial, "final_diff_c": final, "step_c": step,
+              "samples": int(len(t)), "post_trigger_s": float(t_after[-1])}
+    if abs(step) < 1e-6:
+        return result
+
+    progress = (d_after - initial) / step
+    reached_10 = np.flatnonzero(progress >= 0.1)
+    reached_90 = np.flatnonzero(progress >= 0.9)
+    if reached_10.size and reached_90.size:
+        result["rise_time_s"] = float(t_after[reached_90[0]] - t_after[reached_10[0]])
+    result["overshoot_pct"] = float(max(0.0, progress.max() - 1.0) * 100)
+    outside = np.flatnonzero(np.abs(progress - 1.0) > settle_band)
+    if not outside.size:
+        result["settling_time_s"] = 0.0
+    elif outside[-1] + 1 < len(t_after):
+        result["settling_time_s"] = float(t_after[outside[-1] + 1])
+    else:
+        result["settling_time_s"] = None   # 擷取結束前尚未安定
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="高頻突發擷取記錄")
+    parser.add_argument("--db", default=temperature_store.DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list")
+    p_list.add_argument("--limit", type=int, default=20)
+    p_show = sub.add_parser("show", help="顯示步階響應指標")
+    p_show.add_argument("id", type=int)
+    p_export = sub.add_parser("export")
+    p_export.add_argument("id", type=int)
+    p_export.add_argument("--csv", required=True)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    ensure_schema(conn)
+    if args.command == "list":
+        rows = conn.execute(
+            "SELECT id, trigger_time, reason, detail, sample_count, LENGTH(data) FROM burst_capture "
+            "ORDER BY id DESC LIMIT ?", (args.limit,)
+        ).fetchall()
+        for burst_id, trigger_time, reason, detail, count, size in rows:
+            print(f"#{burst_id:<5} {trigger_time}  {reason:<9} {detail:<16} {count:>5} 筆  {size:>7} bytes")
+        return
+
+    burst = load_burst(conn, args.id)
+    if burst is None:
+        print(f"找不到 burst #{args.id}")
+        return
+    if args.command == "show":
+        print(f"#{args.id} {burst['trigger_time']} {burst['reason']} {burst['detail']}")
+        for name, value in step_response(burst["data"]).items():
+            print(f"  {name:<18} {value:.3f}" if isinstance(value, float) else f"  {name:<18} {value}")
+    else:
+        np.savetxt(args.csv, burst["data"], delimiter=",", header=",".join(BLOB_COLUMNS), comments="", fmt="%.4f")
+        print(f"已匯出 {len(burst['data'])} 筆 → {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
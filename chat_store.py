@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+DEFAULT_ARCHIVE_DIR = "chat_archive"
+# 每個 Streamlit 工作階段一個封存檔；建立 ChatHistory 時清理過舊或超出總量的檔案
+ARCHIVE_MAX_AGE_DAYS = float(os.environ.get("CHAT_ARCHIVE_MAX_AGE_DAYS", "7"))
+ARCHIVE_MAX_MB = float(os.environ.get("CHAT_ARCHIVE_MAX_MB", "100"))
+ARCHIVE_ACTIVE_S = 3600   # 最近一小時內寫入的檔案視為仍在使用中的工作階段，不因總量而刪除
+
+
+def prune_archives(archive_dir: str = DEFAULT_ARCHIVE_DIR, max_age_days: float = ARCHIVE_MAX_AGE_DAYS,
+                   max_total_mb: float = ARCHIVE_MAX_MB, keep: str = None) -> int:
+    """
+    刪除超過 max_age_days 未更新的封存檔；總量仍超過 max_total_mb 時，
+    再由最舊的開始刪除（最近 ARCHIVE_ACTIVE_S 秒內寫入的檔案與 keep 除外）。回傳刪除的檔案數。
+    """
+    try:
+        names = [name for name in os.listdir(archive_dir) if name.endswith(".jsonl")]
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    files = []
+    for name in names:
+        path = os.path.join(archive_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()   # 最舊的在前
+
+    removed = 0
+    total = sum(size for _, size, _ in files)
+    limit = max_total_mb * 1024 * 1024
+    for mtime, size, path in files:
+        if keep and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        expired = now - mtime > max_age_days * 86400
+        over_size = total > limit and now - mtime > ARCHIVE_ACTIVE_S
+        if not (expired or over_size):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logging.info(f"🧹 已清理 {removed} 個聊天封存檔（{archive_dir}）")
+    return removed
+
+
+class ChatHistory:
+    """
+    容量受限的聊天記錄，介面與原本的 list[(role, message)] 相容（append、迭代、索引）。
+    記憶體中最多保留 max_in_memory 則訊息，超過時最舊的 page_size 則會整頁
+    寫入磁碟 JSONL 檔；較早的訊息可依頁次按需讀回，不會常駐記憶體。
+    """
+
+    def __init__(self, max_in_memory: int = 200, page_size: int = 50,
+                 archive_dir: str = DEFAULT_ARCHIVE_DIR, session_id: str = None):
+        self.max_in_memory = max_in_memory
+        self.page_size = page_size
+        self.archive_path = os.path.join(archive_dir, f"{session_id or uuid.uuid4().hex}.jsonl")
+        self._archive_dir = archive_dir
+        prune_archives(archive_dir, keep=self.archive_path)
+        self._recent = deque()
+        self._page_offsets = []   # 每一頁在 JSONL 檔中的起始位元組位置
+        self._archived_count = 0
+        self._lock = threading.Lock()
+
+    # ───────── list 相容介面 ─────────
+    def append(self, entry):
+        role, message = entry
+        with self._lock:
+            self._recent.append((role, message))
+            if len(self._recent) > self.max_in_memory:
+                self._spill_page()
+
+    def __iter__(self):
+        return iter(list(self._recent))
+
+    def __len__(self):
+        return self._archived_count + len(self._recent)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        """只支援記憶體中的訊息（例如 [-1] 取最新一則）。"""
+        return list(self._recent)[index]
+
+    # ───────── 分頁與磁碟 ─────────
+    def _spill_page(self):
+        os.makedirs(self._archive_dir, exist_ok=True)
+        page = [self._recent.popleft() for _ in range(min(self.page_size, len(self._recent)))]
+        with open(self.archive_path, "ab") as f:
+            self._page_offsets.append(f.tell())
+            for role, message in page:
+                f.write(json.dumps({"role": role, "message": message}, ensure_ascii=False).encode("utf-8"))
+                f.write(b"\n")
+        self._archived_count += len(page)
+
+    @property
+    def in_memory_count(self) -> int:
+        return len(self._recent)
+
+    @property
+    def archived_pages(self) -> int:
+        return len(self._page_offsets)
+
+    def load_page(self, page_index: int):
+        """
+        讀回第 page_index 頁已封存的訊息（0 為最舊）。
+        以記錄的位元組位置直接定位，只讀取該頁內容。
+        """
+        with self._lock:
+            if not 0 <= page_index < len(self._page_offsets):
+                return []
+            start = self._page_offsets[page_index]
+            end = self._page_offsets[page_index + 1] if page_index + 1 < len(self._page_offsets) else None
+        try:
+            with open(self.archive_path, "rb") as f:
+                f.seek(start)
+                data = f.read() if end is None else f.read(end - start)
+        except FileNotFoundError:   # 已被清理
+            return []
+        page = []
+        for line in data.splitlines():
+            if line:
+                item = json.loads(line)
+                page.append((item["role"], item["message"]))
+        return page
+
+    def recent(self, limit: int):
+        """回傳最新的 limit 則訊息（渲染視窗）。"""
+        with self._lock:
+            if limit >= len(self._recent):
+                return list(self._recent)
+            return list(self._recent)[-limit:]
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._page_offsets = []
+            self._archived_count = 0
+            if os.path.exists(self.archive_path):
+                os.remove(self.archive_path)
@@ -1,4 +1,5 @@
 import sys
+import time
 import socket
 import threading
 import os
@@ -8,10 +9,23 @@ from PyQt5.QtWidgets import (
 )
 import sqlite3
 import datetime
-from PyQt5.QtCore import QTimer
+import json
+from PyQt5.QtCore import QTimer, pyqtSignal
 from pyModbusTCP.client import ModbusClient
 from threading import Lock
 import logging
+import temperature_store
+from metrics import timed, counter, start_exporters_from_env
+from profiling import profiled, add_profile_arguments, start_profiling_from_args
+from setpoint_controller import SetpointController
+from sample_ring import SampleRing, handle_command as handle_sample_command
+import burst_capture
+from burst_capture import BurstCapture
+from live_plot import LivePlotWidget
+from sample_pipeline import SamplePipeline
+import anomaly_detector
+from anomaly_detector import AnomalyMonitor
+import argparse
 
 # Configure logging
 logging.basicConfig(
@@ -23,36 +37,55 @@ logging.basicConfig(
     ]
 )
 
+# 平常的擷取間隔；設定值變更後暫時改用 BurstCapture 的高頻間隔
+POLL_INTERVAL_MS = 1000
+# 高頻擷取期間，temperature_log 與以 1 Hz 計算容量的消費者仍只收約 1 Hz 的樣本（容許計時器抖動）
+LOG_INTERVAL_S = 0.95
+
 class CoolerApp(QWidget):
+    # socket 執行緒變更控制模式後通知 GUI 執行緒更新按鈕與狀態列（Qt 元件只能在 GUI 執行緒操作）
+    control_mode_changed = pyqtSignal()
+
     def __init__(self):
         super().__init__()
         self.modbus_client = ModbusClient()
         self.modbus_lock = Lock()
         self.read_temp_timer = QTimer()
         self.read_temp_timer.timeout.connect(self.read_temperature)
+        # 每筆擷取樣本依序交給這些回呼（閉迴路控制等），回呼須保持輕量（見 sample_pipeline.py；
+        # replay.py 以相同順序重播歷史資料）
+        self.pipeline = SamplePipeline()
+        # 近期樣本留在記憶體，近期查詢不必讀資料庫（見 sample_ring.py）；容量以 1 Hz 計算，
+        # 高頻擷取的 20 Hz 樣本只存在 burst 中，不占用緩衝區
+        self.sample_ring = SampleRing.for_duration()
+        self.pipeline.add(self.sample_ring.append, "sample_ring", min_interval_s=LOG_INTERVAL_S)
+        self.controller = SetpointController(write_fn=self.external_write_temperature)
+        self.pipeline.add(self.controller.on_sample, "controller")
+        # 設定值變更或溫度劇變時暫時提高擷取頻率，整段存成一筆 blob（見 burst_capture.py）
+        self.burst = BurstCapture(on_complete=self.save_burst)
+        self.pipeline.add(self.burst.on_sample, "burst")
+        # 串流異常／漂移偵測：事件寫入 anomaly_event 並推送給 socket 訂閱者（見 anomaly_detector.py）
+        self.anomaly = AnomalyMonitor(on_event=self.save_anomaly)
+        self.pipeline.add(self.anomaly.on_sample, "anomaly")
+        self._last_logged = 0.0
         self.init_db()  # 初始化資料庫
         self.initUI()
+        self.control_mode_changed.connect(self.refresh_control_mode)
         self.start_socket_server(host='localhost', port=9999)
+        start_exporters_from_env(default_port=9108)
 
     def init_db(self):
         """建立資料庫和資料表（如果尚未存在的話）"""
         try:
-            db_path = 'temperature_log.db'
+            db_path = temperature_store.DB_PATH
             abs_path = os.path.abspath(db_path)
             logging.info(f"資料庫路徑: {abs_path}")
             
             self.db_connection = sqlite3.connect(db_path)
+            temperature_store.ensure_schema(self.db_connection)
+            burst_capture.ensure_schema(self.db_connection)
+            anomaly_detector.ensure_schema(self.db_connection)
             cursor = self.db_connection.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS temperature_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    sensor_liquid REAL,
-                    sensor_reference REAL,
-                    set_temperature REAL
-                )
-            ''')
-            self.db_connection.commit()
             
             # 驗證資料表創建成功
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='temperature_log'")
@@ -79,12 +112,13 @@ class CoolerApp(QWidget):
             # 打印數據，確認即將寫入
             logging.info(f"即將寫入數據: {timestamp}, 液態溫度: {sensor_liquid}, 參考溫度: {sensor_reference}, 設定溫度: {set_temperature}")
 
-            cursor.execute("""
-                INSERT INTO temperature_log (timestamp, sensor_liquid, sensor_reference, set_temperature)
-                VALUES (?, ?, ?, ?)
-            """, (timestamp, sensor_liquid, sensor_reference, set_temperature))
+            with timed("cooler_sqlite_write_seconds", "寫入溫度記錄（INSERT + commit）耗時"):
+                cursor.execute("""
+                    INSERT INTO temperature_log (timestamp, sensor_liquid, sensor_reference, set_temperature)
+                    VALUES (?, ?, ?, ?)
+                """, (timestamp, sensor_liquid, sensor_reference, set_temperature))
 
-            self.db_connection.commit()  # 確保提交
+                self.db_connection.commit()  # 確保提交
             logging.info(f"✅ 成功提交數據到資料庫: {timestamp}")
             
             # 驗證數據是否寫入成功
@@ -102,7 +136,6 @@ class CoolerApp(QWidget):
             cursor.execute("SELECT COUNT(*) FROM temperature_log")
             count = cursor.fetchone()[0]
             logging.info(f"資料庫中有 {count} 筆記錄")
-            cursor.execute("SELECT * FROM temperature_log ORDER BY id ASC")
             
             if count > 0:
                 cursor.execute("SELECT * FROM temperature_log ORDER BY id DESC LIMIT 5")
@@ -116,24 +149,55 @@ class CoolerApp(QWidget):
             logging.error(f"檢查資料庫錯誤: {e}")
             self.status_label.setText(f"檢查資料庫錯誤: {e}")
 
+    @profiled("acquisition")
     def read_temperature(self):
         """讀取溫度並記錄到資料庫"""
         try:
-            with self.modbus_lock:
+            with self.modbus_lock, timed("cooler_modbus_read_seconds", "Modbus 讀取溫度往返耗時"):
                 values = self.modbus_client.read_input_registers(0x0004, 3)
             
             logging.info(f"從 Modbus 讀取到的數值: {values}")
             
             if values:
                 self.update_temperature_ui(values)
-                self.log_temperature(values)  # 讀取後同時記錄資料庫
+                # 高頻擷取期間 temperature_log 仍維持約 1 Hz，高頻資料只存在 burst 中
+                now = time.monotonic()
+                if not self.burst.active or now - self._last_logged >= LOG_INTERVAL_S:
+                    self.log_temperature(values)  # 讀取後同時記錄資料庫
+                    self._last_logged = now
+                self.dispatch_sample(temperature_store.sample_from_registers(values))
+                self.update_poll_interval()
             else:
+                counter("cooler_modbus_read_failures_total", "Modbus 讀取未返回數值次數").inc()
                 logging.warning("Modbus 沒有返回數值")
                 self.status_label.setText("無法讀取溫度數值")
         except Exception as e:
             logging.error(f"讀取溫度失敗: {e}")
             self.status_label.setText(f"讀取溫度失敗：{e}")
 
+    def dispatch_sample(self, sample):
+        self.pipeline.dispatch(sample)
+
+    def update_poll_interval(self):
+        interval = self.burst.poll_interval_ms(POLL_INTERVAL_MS)
+        if self.read_temp_timer.isActive() and self.read_temp_timer.interval() != interval:
+            self.read_temp_timer.setInterval(interval)
+            logging.info(f"擷取間隔改為 {interval} ms")
+
+    def save_burst(self, burst):
+        try:
+            burst_id = burst_capture.save_burst(self.db_connection, burst)
+            logging.info(f"📸 已儲存高頻擷取 #{burst_id}（{len(burst.samples)} 筆）")
+        except Exception as e:
+            logging.error(f"儲存高頻擷取失敗: {e}")
+
+    def save_anomaly(self, event):
+        try:
+            anomaly_detector.save_event(self.db_connection, event)
+        except Exception as e:
+            logging.error(f"儲存異常事件失敗: {e}")
+        self.status_label.setText(f"⚠️ {event.kind}：{event.detail}")
+
     def initUI(self):
         # 設定全局風格，讓介面更美觀
         self.setStyleSheet("""
@@ -176,7 +240,7 @@ class CoolerApp(QWidget):
         connectionGroup = QGroupBox("連線設定")
         connectionLayout = QGridLayout()
         self.ip_address_input = QLineEdit()
-        self.ip_address_input.setPlaceholderText("輸入 IP 位址")
+        self.ip_address_input.setPlaceholderText("輸入 IP 位址（可加 :port）")
         self.connect_button = QPushButton("連線")
         self.connect_button.clicked.connect(self.connect_to_device)
         connectionLayout.addWidget(QLabel("IP 位址:"), 0, 0)
@@ -205,6 +269,11 @@ class CoolerApp(QWidget):
         # 添加檢查資料庫按鈕
         self.check_db_button = QPushButton("檢查資料庫")
         self.check_db_button.clicked.connect(self.check_db_data)
+
+        # 閉迴路控制：以目前設定值（或輸入框的值）為前饋，依即時溫差修正
+        self.control_button = QPushButton("閉迴路控制：關")
+        self.control_button.setCheckable(True)
+        self.control_button.clicked.connect(self.toggle_closed_loop)
         
         self.status_label = QLabel("狀態：未連線")
         self.temp_label = QLabel("液態溫度感測器：-- °C")
@@ -212,26 +281,38 @@ class CoolerApp(QWidget):
         self.temp_label3 = QLabel("設定溫度：-- °C")
         temperatureReadLayout.addWidget(self.read_temp_button)
         temperatureReadLayout.addWidget(self.check_db_button)  # 新增按鈕
+        temperatureReadLayout.addWidget(self.control_button)
         temperatureReadLayout.addWidget(self.status_label)
         temperatureReadLayout.addWidget(self.temp_label)
         temperatureReadLayout.addWidget(self.temp_label2)
         temperatureReadLayout.addWidget(self.temp_label3)
         temperatureReadGroup.setLayout(temperatureReadLayout)
 
+        # Group 4：即時溫度趨勢（資料取自 sample_ring，重繪頻率與擷取頻率無關；滾輪縮放）
+        trendGroup = QGroupBox("溫度趨勢")
+        trendLayout = QVBoxLayout()
+        self.live_plot = LivePlotWidget(span_s=600)
+        self.live_plot.add_ring(self.sample_ring)
+        trendLayout.addWidget(self.live_plot)
+        trendGroup.setLayout(trendLayout)
+
         # 主版面佈局
         mainLayout = QVBoxLayout()
         mainLayout.addWidget(connectionGroup)
         mainLayout.addWidget(temperatureWriteGroup)
         mainLayout.addWidget(temperatureReadGroup)
+        mainLayout.addWidget(trendGroup)
         self.setLayout(mainLayout)
         self.setWindowTitle("Cooler App")
-        self.resize(400, 350)  # 略微加大以適應新按鈕
+        self.resize(640, 640)  # 加大以容納趨勢圖
         self.show()
 
     def connect_to_device(self):
         ip_address = self.ip_address_input.text()
         try:
-            self.modbus_client = ModbusClient(host=ip_address, port=502, auto_open=False)
+            # 支援 "IP:port" 格式（例如連線到 cooler_simulator.py 的模擬裝置），預設 502
+            host, _, port = ip_address.partition(':')
+            self.modbus_client = ModbusClient(host=host, port=int(port or 502), auto_open=False)
             if self.modbus_client.open():
                 self.status_label.setText("已連線到冷卻機")
                 logging.info(f"成功連線到冷卻機: {ip_address}")
@@ -248,11 +329,13 @@ class CoolerApp(QWidget):
             return
         try:
             temperature_value = float(self.temperature_input.text())
-            with self.modbus_lock:
+            with self.modbus_lock, timed("cooler_modbus_write_seconds", "Modbus 寫入設定溫度往返耗時"):
                 result = self.modbus_client.write_single_register(0x0001, int(temperature_value * 10))
             
             logging.info(f"寫入溫度結果: {result}, 值: {temperature_value}")
             self.status_label.setText("溫度寫入成功")
+            self.burst.notify_setpoint(temperature_value)
+            self.anomaly.notify_setpoint(temperature_value)
         except Exception as e:
             logging.error(f"溫度寫入失敗: {e}")
             self.status_label.setText(f"溫度寫入失敗：{e}")
@@ -265,10 +348,11 @@ class CoolerApp(QWidget):
             return
         try:
             temperature_value = float(temperature_value)
-            with self.modbus_lock:
+            with self.modbus_lock, timed("cooler_modbus_write_seconds", "Modbus 寫入設定溫度往返耗時"):
                 result = self.modbus_client.write_single_register(0x0001, int(temperature_value * 10))
             logging.info(f"寫入結果: {result}")
             self.status_label.setText("外部寫入溫度成功")
+            self.burst.notify_setpoint(temperature_value)
         except Exception as e:
             self.status_label.setText(f"外部寫入溫度失敗：{e}")
             logging.error(f"外部寫入溫度錯誤: {e}")
@@ -278,7 +362,7 @@ class CoolerApp(QWidget):
             self.status_label.setText("尚未連線到冷卻機")
             return
         if not self.read_temp_timer.isActive():
-            self.read_temp_timer.start(1000)
+            self.read_temp_timer.start(self.burst.poll_interval_ms(POLL_INTERVAL_MS))
             self.status_label.setText("開始自動讀取溫度")
             logging.info("開始自動讀取溫度")
         else:
@@ -286,6 +370,34 @@ class CoolerApp(QWidget):
             self.status_label.setText("停止自動讀取溫度")
             logging.info("停止自動讀取溫度")
 
+    def toggle_closed_loop(self):
+        if self.controller.enabled:
+            self.controller.disable()
+        else:
+            feedforward = self.controller.feedforward
+            text = self.temperature_input.text().strip()
+            if text:
+                try:
+                    feedforward = float(text)
+                except ValueError:
+                    self.status_label.setText("目標溫度格式錯誤")
+                    self.control_button.setChecked(False)
+                    return
+            if feedforward is None:
+                self.status_label.setText("請先輸入目標溫度或由外部送出 TempOffset")
+                self.control_button.setChecked(False)
+                return
+            self.controller.enable(feedforward)
+        self.refresh_control_mode()
+
+    def refresh_control_mode(self):
+        """依控制器目前狀態更新按鈕與狀態列（按鈕切換與 socket 的 [ControlMode] 共用）。"""
+        enabled = self.controller.enabled
+        self.anomaly.set_closed_loop(enabled, self.controller.feedforward)
+        self.control_button.setChecked(enabled)
+        self.control_button.setText(f"閉迴路控制：{'開' if enabled else '關'}")
+        self.status_label.setText("閉迴路控制已啟用" if enabled else "閉迴路控制已停用")
+
     def update_temperature_ui(self, values):
         if len(values) >= 3:
             liquid_temp = values[0] / 100.0
@@ -317,15 +429,61 @@ class CoolerApp(QWidget):
                 message = data.decode('utf-8').strip()
                 logging.info(f"收到 socket 訊息: {message}")
                 if message.startswith("[TempOffset]:"):
-                    try:
-                        offset_str = message.split(":", 1)[1].strip()
-                        offset_value = float(offset_str)
-                        self.external_write_temperature(offset_value)
+                    with timed("cooler_socket_command_seconds", "Socket 指令處理耗時", command="TempOffset"):
+                        try:
+                            offset_str = message.split(":", 1)[1].strip()
+                            offset_value = float(offset_str)
+                            # 閉迴路控制啟用時，TempOffset 改為控制器的前饋值，由控制迴圈寫入
+                            self.controller.set_feedforward(offset_value)
+                            # 控制器的寫入不觸發異常偵測的寬限期，只有這裡（NC 執行器／外部指令）與手動寫入會
+                            self.anomaly.notify_setpoint(offset_value)
+                            if not self.controller.enabled:
+                                self.external_write_temperature(offset_value)
+                            client_socket.send("OK".encode('utf-8'))
+                        except Exception as e:
+                            counter("cooler_socket_command_errors_total", command="TempOffset").inc()
+                            error_msg = f"Error: {e}"
+                            client_socket.send(error_msg.encode('utf-8'))
+                elif message.startswith("[ControlMode]:"):
+                    mode = message.split(":", 1)[1].strip().lower()
+                    if mode == "on":
+                        if self.controller.feedforward is None:
+                            client_socket.send("Error: no feedforward TempOffset yet".encode('utf-8'))
+                        else:
+                            self.controller.enable()
+                            self.control_mode_changed.emit()
+                            client_socket.send("OK".encode('utf-8'))
+                    elif mode == "off":
+                        self.controller.disable()
+                        self.control_mode_changed.emit()
                         client_socket.send("OK".encode('utf-8'))
-                    except Exception as e:
-                        error_msg = f"Error: {e}"
-                        client_socket.send(error_msg.encode('utf-8'))
+                    else:
+                        counter("cooler_socket_command_errors_total", command="ControlMode").inc()
+                        client_socket.send("Error: expected on|off".encode('utf-8'))
+                elif message.startswith("[ControlStatus]"):
+                    client_socket.send(json.dumps(self.controller.snapshot()).encode('utf-8'))
+                elif message.startswith("[Sample"):
+                    command = message.split(":", 1)[0].strip("[] ")
+                    with timed("cooler_socket_command_seconds", "Socket 指令處理耗時", command=command):
+                        try:
+                            reply = handle_sample_command(self.sample_ring, message)
+                        except ValueError as e:
+                            reply = json.dumps({"error": str(e)})
+                    if reply is None:
+                        counter("cooler_socket_command_errors_total", command="invalid").inc()
+                        reply = "Invalid command"
+                    client_socket.sendall(reply.encode('utf-8'))
+                elif message.startswith("[AnomalySubscribe]"):
+                    # 保持連線推送事件，直到訂閱者斷線
+                    self.anomaly.subscribers.serve(client_socket)
+                elif message.startswith("[AnomalyRecent]"):
+                    try:
+                        reply = anomaly_detector.handle_command(self.anomaly, message)
+                    except ValueError as e:
+                        reply = json.dumps({"error": str(e)})
+                    client_socket.sendall(reply.encode('utf-8'))
                 else:
+                    counter("cooler_socket_command_errors_total", command="invalid").inc()
                     client_socket.send("Invalid command".encode('utf-8'))
             finally:
                 client_socket.close()
@@ -356,7 +514,11 @@ class CoolerApp(QWidget):
         event.accept()
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="冷卻機溫度控制")
+    add_profile_arguments(parser)
+    args, qt_args = parser.parse_known_args()
+    start_profiling_from_args(args)
+    app = QApplication(sys.argv[:1] + qt_args)
     cooler_app_instance = CoolerApp()
     sys.exit(app.exec_())
 # 192.168.40.30 255.25.128
\ No newline at end of file
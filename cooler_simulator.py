@@ -0,0 +1,343 @@
+"""
+Modbus TCP 冷卻機模擬器。
+
+在單一行程中模擬數百台冷卻機，提供與實機相同的暫存器與比例：
+  - Input register 0x0004：液態溫度 ×100
+  - Input register 0x0005：參考溫度 ×100
+  - Input register 0x0006：設定溫度 ×10
+  - Holding register 0x0001：設定溫度 ×10（寫入即改變設定點）
+液溫以一階熱模型追隨設定點，並可注入延遲、抖動、斷線與 Modbus 例外，
+用於壓力測試 cooler_app 的擷取迴圈、socket 指令路徑與重新連線邏輯。
+
+    python cooler_simulator.py --devices 200 --base-port 15020 --latency-ms 5 --jitter-ms 20 --drop-rate 0.01
+"""
+import sys
+import time
+import math
+import random
+import struct
+import asyncio
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+
+# Modbus 功能碼與例外碼
+FC_READ_HOLDING = 0x03
+FC_READ_INPUT = 0x04
+FC_WRITE_SINGLE = 0x06
+FC_WRITE_MULTIPLE = 0x10
+EXC_ILLEGAL_FUNCTION = 0x01
+EXC_ILLEGAL_ADDRESS = 0x02
+EXC_ILLEGAL_VALUE = 0x03
+EXC_DEVICE_FAILURE = 0x04
+EXC_DEVICE_BUSY = 0x06
+
+# 暫存器位址
+REG_SETPOINT = 0x0001
+REG_LIQUID = 0x0004
+REG_REFERENCE = 0x0005
+REG_SET_TEMPERATURE = 0x0006
+
+
+@dataclass
+class FaultProfile:
+    """故障注入設定：回應延遲與抖動（毫秒）、斷線機率、例外機率。"""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    drop_rate: float = 0.0
+    exception_rate: float = 0.0
+    exception_code: int = EXC_DEVICE_BUSY
+
+
+@dataclass
+class ThermalModel:
+    """
+    一階熱模型：參考溫度（機台）隨加工負載緩慢漂移，
+    液溫以時間常數 tau_s 追隨目標溫度，且冷卻速率受 max_rate_c_per_s 限制。
+    differential=True 時設定值為相對參考溫度的溫差（目標 = 參考 − 設定值），
+    否則為絕對溫度。load_bias 為加工熱負載造成的液溫穩態偏差（冷卻機追不上目標的部分）。
+    """
+    liquid: float = 24.0
+    reference: float = 25.0
+    setpoint: float = 5.0
+    tau_s: float = 120.0
+    max_rate_c_per_s: float = 0.05
+    ambient: float = 25.0
+    load_amplitude: float = 1.5
+    load_period_s: float = 1800.0
+    noise: float = 0.01
+    differential: bool = True
+    load_bias: float = 0.0
+    phase: float = field(default_factory=lambda: random.uniform(0, 2 * math.pi))
+
+    def target(self) -> float:
+        return self.reference - self.setpoint if self.differential else self.setpoint
+
+    def advance(self, t: float, dt: float, rng: random.Random):
+        if dt <= 0:
+            return
+        self.reference = (self.ambient +
+                          self.load_amplitude * math.sin(2 * math.pi * t / self.load_period_s + self.phase) +
+                          rng.gauss(0, self.noise))
+        step = (self.target() + self.load_bias - self.liquid) * (1 - math.exp(-dt / self.tau_s))
+        limit = self.max_rate_c_per_s * dt
+        self.liquid += max(-limit, min(limit, step)) + rng.gauss(0, self.noise)
+
+
+class SimulatedCooler:
+    """單台模擬冷卻機：熱狀態於每次存取時依經過時間更新（O(1)，不需背景計時器）。"""
+
+    def __init__(self, device_id: int, faults: FaultProfile = None,
+                 thermal: ThermalModel = None, time_scale: float = 1.0, seed: int = None):
+        self.device_id = device_id
+        self.faults = faults or FaultProfile()
+        self.thermal = thermal or ThermalModel()
+        self.time_scale = time_scale
+        self.rng = random.Random(seed if seed is not None else device_id)
+        self._t0 = time.monotonic()
+        self._last = self._t0
+        self.stats = {"requests": 0, "reads": 0, "writes": 0, "exceptions": 0, "drops": 0}
+
+    def _update(self):
+        now = time.monotonic()
+        self.thermal.advance((now - self._t0) * self.time_scale,
+                             (now - self._last) * self.time_scale, self.rng)
+        self._last = now
+
+    def read_input(self, address: int, count: int):
+        self._update()
+        bank = {
+            REG_LIQUID: int(round(self.thermal.liquid * 100)),
+            REG_REFERENCE: int(round(self.thermal.reference * 100)),
+            REG_SET_TEMPERATURE: int(round(self.thermal.setpoint * 10)),
+        }
+        if any(a not in bank for a in range(address, address + count)):
+            return None
+        return [bank[a] & 0xFFFF for a in range(address, address + count)]
+
+    def read_holding(self, address: int, count: int):
+        if address != REG_SETPOINT or count != 1:
+            return None
+        return [int(round(self.thermal.setpoint * 10)) & 0xFFFF]
+
+    def write_holding(self, address: int, value: int) -> bool:
+        if address != REG_SETPOINT:
+            return False
+        self._update()
+        self.thermal.setpoint = value / 10.0
+        logging.debug(f"裝置 {self.device_id} 設定點 → {self.thermal.setpoint:.1f}")
+        return True
+
+
+class ModbusDeviceProtocol(asyncio.Protocol):
+    """單一 TCP 連線的 Modbus TCP 協定處理（MBAP 標頭 + PDU）。"""
+
+    def __init__(self, device: SimulatedCooler):
+        self.device = device
+        self.transport = None
+        self._buffer = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buffer += data
+        while len(self._buffer) >= 7:
+            tid, pid, length, unit = struct.unpack(">HHHB", self._buffer[:7])
+            frame_len = 6 + length
+            if len(self._buffer) < frame_len:
+                return
+            pdu = self._buffer[7:frame_len]
+            self._buffer = self._buffer[frame_len:]
+            asyncio.ensure_future(self._respond(tid, pid, unit, pdu))
+
+    async def _respond(self, tid, pid, unit, pdu):
+        device = self.device
+        faults = device.faults
+        device.stats["requests"] += 1
+
+        delay = faults.latency_ms + (device.rng.uniform(0, faults.jitter_ms) if faults.jitter_ms else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+        if self.transport is None or self.transport.is_closing():
+            return
+        if faults.drop_rate and device.rng.random() < faults.drop_rate:
+            device.stats["drops"] += 1
+            self.transport.close()
+            return
+        if faults.exception_rate and device.rng.random() < faults.exception_rate:
+            response = self._exception(pdu[0] if pdu else 0, faults.exception_code)
+        else:
+            response = self._handle_pdu(pdu)
+        self.transport.write(struct.pack(">HHHB", tid, pid, len(response) + 1, unit) + response)
+
+    def _exception(self, function_code: int, code: int) -> bytes:
+        self.device.stats["exceptions"] += 1
+        return struct.pack(">BB", (function_code | 0x80) & 0xFF, code)
+
+    def _handle_pdu(self, pdu: bytes) -> bytes:
+        if not pdu:
+            return self._exception(0, EXC_ILLEGAL_FUNCTION)
+        fc = pdu[0]
+        device = self.device
+        if fc in (FC_READ_HOLDING, FC_READ_INPUT):
+            if len(pdu) != 5:
+                return self._exception(fc, EXC_ILLEGAL_VALUE)
+            address, count = struct.unpack(">HH", pdu[1:5])
+            if not 1 <= count <= 125:
+                return self._exception(fc, EXC_ILLEGAL_VALUE)
+            values = (device.read_input if fc == FC_READ_INPUT else device.read_holding)(address, count)
+            if values is None:
+                return self._exception(fc, EXC_ILLEGAL_ADDRESS)
+            device.stats["reads"] += 1
+            return struct.pack(f">BB{count}H", fc, count * 2, *values)
+        if fc == FC_WRITE_SINGLE:
+            if len(pdu) != 5:
+                return self._exception(fc, EXC_ILLEGAL_VALUE)
+            address, value = struct.unpack(">HH", pdu[1:5])
+            if not device.write_holding(address, value):
+                return self._exception(fc, EXC_ILLEGAL_ADDRESS)
+            device.stats["writes"] += 1
+            return pdu
+        if fc == FC_WRITE_MULTIPLE:
+            if len(pdu) != 8:
+                return self._exception(fc, EXC_ILLEGAL_VALUE)
+            address, count, byte_count = struct.unpack(">HHB", pdu[1:6])
+            if count != 1 or byte_count != 2:
+                return self._exception(fc, EXC_ILLEGAL_VALUE)
+            value = struct.unpack(">H", pdu[6:8])[0]
+            if not device.write_holding(address, value):
+                return self._exception(fc, EXC_ILLEGAL_ADDRESS)
+            device.stats["writes"] += 1
+            return struct.pack(">BHH", fc, address, count)
+        return self._exception(fc, EXC_ILLEGAL_FUNCTION)
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+
+class CoolerSimulator:
+    """
+    在同一個 asyncio 事件迴圈中執行多台模擬冷卻機。
+    每台裝置監聽 (host, base_port + i)；ip_per_device=True 時改為
+    監聽 127.0.1.(i+1):base_port（Linux 迴路位址），可使用固定的 502 埠。
+    """
+
+    def __init__(self, n_devices: int = 1, host: str = "127.0.0.1", base_port: int = 15020,
+                 ip_per_device: bool = False, faults: FaultProfile = None,
+                 time_scale: float = 1.0, seed: int = 0, thermal_factory=None):
+        self.host = host
+        self.base_port = base_port
+        self.ip_per_device = ip_per_device
+        self.devices = [
+            SimulatedCooler(i, faults=faults or FaultProfile(),
+                            thermal=thermal_factory() if thermal_factory else None,
+                            time_scale=time_scale, seed=seed + i)
+            for i in range(n_devices)
+        ]
+        self.loop = None
+        self._servers = []
+        self._thread = None
+        self._ready = threading.Event()
+
+    def address(self, index: int):
+        if self.ip_per_device:
+            return f"127.0.1.{index + 1}", self.base_port
+        return self.host, self.base_port + index
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        for i, device in enumerate(self.devices):
+            host, port = self.address(i)
+            server = await self.loop.create_server(lambda d=device: ModbusDeviceProtocol(d), host, port,
+                                                   reuse_address=True)
+            self._servers.append(server)
+        first, last = self.address(0), self.address(len(self.devices) - 1)
+        logging.info(f"模擬冷卻機 {len(self.devices)} 台已啟動：{first[0]}:{first[1]} … {last[0]}:{last[1]}")
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+    # ───────── 以背景執行緒執行（供測試／基準程式內嵌使用） ─────────
+    def start_in_thread(self):
+        def runner():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            self._ready.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=runner, name="cooler-simulator", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop_thread(self):
+        if self.loop is not None and self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+
+    def summary(self) -> dict:
+        totals = {}
+        for device in self.devices:
+            for key, value in device.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+async def _report_loop(simulator: CoolerSimulator, interval: float):
+    previous = simulator.summary()
+    while True:
+        await asyncio.sleep(interval)
+        current = simulator.summary()
+        rate = (current["requests"] - previous["requests"]) / interval
+        logging.info(f"請求 {rate:.0f}/s，累計 {current}")
+        previous = current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modbus TCP 冷卻機模擬器")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=15020)
+    parser.add_argument("--ip-per-device", action="store_true",
+                        help="每台裝置使用 127.0.1.N 位址並共用 --base-port（例如 502）")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="每個請求直接斷線的機率")
+    parser.add_argument("--exception-rate", type=float, default=0.0, help="每個請求回應 Modbus 例外的機率")
+    parser.add_argument("--exception-code", type=int, default=EXC_DEVICE_BUSY)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="熱模型時間加速倍率")
+    parser.add_argument("--load-bias", type=float, default=0.0, help="熱負載造成的液溫穩態偏差（°C）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    faults = FaultProfile(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          drop_rate=args.drop_rate, exception_rate=args.exception_rate,
+                          exception_code=args.exception_code)
+    simulator = CoolerSimulator(args.devices, host=args.host, base_port=args.base_port,
+                                ip_per_device=args.ip_per_device, faults=faults,
+                                time_scale=args.time_scale, seed=args.seed,
+                                thermal_factory=lambda: ThermalModel(load_bias=args.load_bias))
+
+    async def run():
+        await simulator.start()
+        await _report_loop(simulator, args.report_interval)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logging.info(f"模擬器結束，統計：{simulator.summary()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
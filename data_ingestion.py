@@ -0,0 +1,324 @@
+"""
+訓練資料讀取層：明確的欄位 schema 與型別、分塊讀取、多檔／目錄與 Parquet，
+並區分兩種被排除的資料列：
+
+    dropped  — 預期中、無害的排除：空白分隔列、只有輸入沒有量測結果的列（尚未量測）
+    rejected — 資料有問題：欄位數不符、數值無法解析、超出合理範圍
+
+處理後的結果以 .npz 快取（依檔案路徑、大小、修改時間與 schema 版本為鍵），
+重複訓練時直接載入，不必重新解析。
+
+    from data_ingestion import load_training_data
+    df, report = load_training_data(["Cooling_Machine_Data_EN.csv", "production_exports/"])
+    print(report.summary())
+"""
+import os
+import re
+import json
+import glob
+import hashlib
+import logging
+import warnings
+import argparse
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_VERSION = 1
+
+# 欄位 -> (是否為輸入特徵, 最小值, 最大值)
+SCHEMA = {
+    "RPM":          (True, 0.0, 60000.0),
+    "Hour":         (True, 0.0, 1000.0),
+    "TempOffset":   (True, -30.0, 50.0),
+    "CoolerPower":  (False, 0.0, 1e6),
+    "MachinePower": (False, 0.0, 1e6),
+    "MaxError":     (False, -1e4, 1e4),
+    "AvgError":     (False, -1e4, 1e4),
+}
+FEATURE_COLUMNS = [c for c, (is_input, *_) in SCHEMA.items() if is_input]
+TARGET_COLUMNS = [c for c, (is_input, *_) in SCHEMA.items() if not is_input]
+DTYPES = {column: "float64" for column in SCHEMA}
+
+TEXT_EXTENSIONS = (".csv", ".tsv", ".txt")
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+DEFAULT_CACHE_DIR = os.path.join(".cache", "ingestion")
+DEFAULT_CHUNKSIZE = 100_000
+MAX_EXAMPLES = 20
+
+_BAD_LINE_PATTERN = re.compile(r"Skipping line (\d+): (.*)")
+
+
+class SchemaError(ValueError):
+    """檔案缺少必要欄位。"""
+
+
+class IngestionReport:
+    """記錄每個檔案讀入、保留、dropped 與 rejected 的筆數與原因。"""
+
+    def __init__(self):
+        self.files = []
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.dropped = {}
+        self.rejected = {}
+        self.examples = []     # [(file, line, reason)]，最多 MAX_EXAMPLES 筆
+        self.from_cache = False
+
+    def drop(self, reason: str, count: int):
+        if count:
+            self.dropped[reason] = self.dropped.get(reason, 0) + int(count)
+
+    def reject(self, reason: str, source: str, lines):
+        lines = list(lines)
+        if not lines:
+            return
+        self.rejected[reason] = self.rejected.get(reason, 0) + len(lines)
+        for line in lines[:max(0, MAX_EXAMPLES - len(self.examples))]:
+            self.examples.append((source, int(line), reason))
+
+    @property
+    def total_dropped(self) -> int:
+        return sum(self.dropped.values())
+
+    @property
+    def total_rejected(self) -> int:
+        return sum(self.rejected.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "files": self.files, "rows_read": self.rows_read, "rows_kept": self.rows_kept,
+            "dropped": self.dropped, "rejected": self.rejected,
+            "examples": [list(e) for e in self.examples],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        report = cls()
+        report.files = data["files"]
+        report.rows_read = data["rows_read"]
+        report.rows_kept = data["rows_kept"]
+        report.dropped = data["dropped"]
+        report.rejected = data["rejected"]
+        report.examples = [tuple(e) for e in data["examples"]]
+        return report
+
+    def summary(self) -> str:
+        lines = [f"讀入 {self.rows_read} 列（{len(self.files)} 個檔案{'，快取' if self.from_cache else ''}），"
+                 f"保留 {self.rows_kept}，dropped {self.total_dropped}，rejected {self.total_rejected}"]
+        for reason, count in self.dropped.items():
+            lines.append(f"  dropped  {reason}: {count}")
+        for reason, count in self.rejected.items():
+            lines.append(f"  rejected {reason}: {count}")
+        for source, line, reason in self.examples:
+            lines.append(f"    {os.path.basename(source)}:{line} {reason}")
+        return "\n".join(lines)
+
+
+# -----------------------------
+# 檔案列舉
+# -----------------------------
+def expand_sources(paths):
+    """展開檔案與目錄（目錄遞迴找支援的副檔名），回傳排序後的檔案列表。"""
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files = []
+    for path in paths:
+        path = os.fspath(path)
+        if os.path.isdir(path):
+            for ext in TEXT_EXTENSIONS + PARQUET_EXTENSIONS:
+                files.extend(glob.glob(os.path.join(path, "**", f"*{ext}"), recursive=True))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            raise FileNotFoundError(path)
+    return sorted(set(files))
+
+
+# -----------------------------
+# 讀取與驗證
+# -----------------------------
+def _iter_text_chunks(path: str, sep: str, chunksize: int, report: IngestionReport):
+    """以字串讀入（之後再自行轉型，才能區分空值與無法解析的值），欄位數不符的列列為 rejected。"""
+    bad_lines = set()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        reader = pd.read_csv(path, sep=sep, dtype=str, chunksize=chunksize,
+                             skip_blank_lines=False, on_bad_lines="warn", encoding="utf-8-sig")
+        line = 2   # 第 1 行為標題
+        for chunk in reader:
+            # 解析器在交出這個分塊前已對其中的壞行發出警告，據此還原每列的實際行號
+            for warning in caught:
+                for match in _BAD_LINE_PATTERN.finditer(str(warning.message)):
+                    bad_lines.add(int(match.group(1)))
+            caught.clear()
+            line_numbers = []
+            while len(line_numbers) < len(chunk):
+                if line not in bad_lines:
+                    line_numbers.append(line)
+                line += 1
+            chunk.columns = [c.strip() for c in chunk.columns]
+            chunk.index = pd.Index(line_numbers)
+            yield chunk
+    for warning in caught:
+        for match in _BAD_LINE_PATTERN.finditer(str(warning.message)):
+            bad_lines.add(int(match.group(1)))
+    report.reject("欄位數不符", path, sorted(bad_lines))
+
+
+def _iter_parquet_chunks(path: str, chunksize: int):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        yield pd.read_parquet(path)
+        return
+    line_base = 1
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(line_base, line_base + len(chunk))
+        line_base += len(chunk)
+        yield chunk
+
+
+def _validate_chunk(chunk: pd.DataFrame, source: str, report: IngestionReport) -> pd.DataFrame:
+    missing = [c for c in SCHEMA if c not in chunk.columns]
+    if missing:
+        raise SchemaError(f"{source} 缺少欄位: {missing}")
+    chunk = chunk[list(SCHEMA)]
+    report.rows_read += len(chunk)
+
+    raw = chunk.apply(lambda col: col if pd.api.types.is_numeric_dtype(col) else col.str.strip())
+    blank = raw.isna() | (raw == "")
+    values = raw.mask(blank).apply(pd.to_numeric, errors="coerce").astype(DTYPES)
+
+    # 1. 整列空白：分隔用的空行
+    all_blank = blank.all(axis=1)
+    report.drop("空白列", all_blank.sum())
+
+    # 2. 有內容但無法解析為數值
+    unparsable = (values.isna() & ~blank).any(axis=1) & ~all_blank
+    report.reject("數值無法解析", source, chunk.index[unparsable])
+
+    # 3. 輸入不完整（有部分內容但缺少特徵）
+    remaining = ~all_blank & ~unparsable
+    inputs_missing = values[FEATURE_COLUMNS].isna().any(axis=1) & remaining
+    report.reject("缺少輸入特徵", source, chunk.index[inputs_missing])
+    remaining &= ~inputs_missing
+
+    # 4. 超出合理範圍
+    out_of_range = pd.Series(False, index=chunk.index)
+    for column, (_, low, high) in SCHEMA.items():
+        column_values = values[column]
+        out_of_range |= column_values.notna() & ((column_values < low) | (column_values > high))
+    out_of_range &= remaining
+    report.reject("數值超出範圍", source, chunk.index[out_of_range])
+    remaining &= ~out_of_range
+
+    # 5. 只有輸入、沒有（完整的）量測結果：尚未量測的條件
+    unlabeled = values[TARGET_COLUMNS].isna().any(axis=1) & remaining
+    report.drop("缺少量測結果", unlabeled.sum())
+    remaining &= ~unlabeled
+
+    return values[remaining]
+
+
+def read_source(path: str, report: IngestionReport, sep: str = "\t",
+                chunksize: int = DEFAULT_CHUNKSIZE) -> pd.DataFrame:
+    """讀取單一檔案並驗證，回傳保留的資料列。"""
+    if path.lower().endswith(PARQUET_EXTENSIONS):
+        chunks = _iter_parquet_chunks(path, chunksize)
+    else:
+        chunks = _iter_text_chunks(path, sep, chunksize, report)
+    kept = [_validate_chunk(chunk, path, report) for chunk in chunks]
+    report.files.append(path)
+    if not kept:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in DTYPES.items()})
+    return pd.concat(kept, ignore_index=True)
+
+
+# -----------------------------
+# 快取
+# -----------------------------
+def _cache_key(files, sep: str) -> str:
+    digest = hashlib.sha256(f"schema={SCHEMA_VERSION};sep={sep!r}".encode("utf-8"))
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()[:24]
+
+
+def _load_cache(cache_dir: str, key: str):
+    data_path = os.path.join(cache_dir, f"{key}.npz")
+    report_path = os.path.join(cache_dir, f"{key}.json")
+    if not (os.path.exists(data_path) and os.path.exists(report_path)):
+        return None
+    try:
+        with np.load(data_path, allow_pickle=False) as data:
+            df = pd.DataFrame({column: data[column] for column in SCHEMA})
+        with open(report_path, encoding="utf-8") as f:
+            report = IngestionReport.from_dict(json.load(f))
+    except (OSError, KeyError, ValueError) as e:
+        logging.warning(f"讀取訓練資料快取失敗，重新解析: {e}")
+        return None
+    report.from_cache = True
+    return df, report
+
+
+def _save_cache(cache_dir: str, key: str, df: pd.DataFrame, report: IngestionReport):
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path = os.path.join(cache_dir, f"{key}.npz")
+    tmp_path = os.path.join(cache_dir, f"{key}.tmp.npz")
+    np.savez(tmp_path, **{column: df[column].to_numpy() for column in SCHEMA})
+    os.replace(tmp_path, data_path)
+    with open(os.path.join(cache_dir, f"{key}.json"), "w", encoding="utf-8") as f:
+        json.dump(report.to_dict(), f, ensure_ascii=False)
+
+
+def load_training_data(paths, sep: str = "\t", chunksize: int = DEFAULT_CHUNKSIZE,
+                       use_cache: bool = True, cache_dir: str = DEFAULT_CACHE_DIR):
+    """
+    讀取一或多個檔案／目錄（CSV/TSV/TXT 與 Parquet），回傳 (DataFrame, IngestionReport)。
+    DataFrame 欄位依 SCHEMA 順序、型別皆為 float64。
+    """
+    files = expand_sources(paths)
+    if not files:
+        raise FileNotFoundError(f"找不到訓練資料檔: {paths}")
+
+    key = _cache_key(files, sep) if use_cache else None
+    if use_cache:
+        cached = _load_cache(cache_dir, key)
+        if cached is not None:
+            return cached
+
+    report = IngestionReport()
+    frames = [read_source(path, report, sep=sep, chunksize=chunksize) for path in files]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    report.rows_kept = len(df)
+
+    if use_cache:
+        try:
+            _save_cache(cache_dir, key, df, report)
+        except OSError as e:
+            logging.warning(f"寫入訓練資料快取失敗: {e}")
+    return df, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="驗證訓練資料檔並顯示讀取報告")
+    parser.add_argument("paths", nargs="+", help="檔案或目錄")
+    parser.add_argument("--sep", default="\t")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出報告")
+    args = parser.parse_args()
+
+    df, report = load_training_data(args.paths, sep=args.sep, chunksize=args.chunksize,
+                                    use_cache=not args.no_cache)
+    if args.json:
+        print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
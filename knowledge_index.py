@@ -0,0 +1,298 @@
+"""
+冷卻機知識庫的分段檢索索引（BM25）。
+
+get_cooling_machine_basics 原本把整份基礎知識貼進追問 prompt，本機 llama3.2 的
+prompt eval 時間隨之增加。知識文件（knowledge/ 目錄下的 .md / .txt，含操作手冊與保養文件）
+依 Markdown 標題切段，以 BM25 建立索引並存成 JSON；查詢時只把最相關的前 k 段放進 prompt。
+索引記錄來源檔案的大小與修改時間，文件有變動時自動重建。
+
+中文沒有空白分詞，詞元採「連續漢字的二字組」加上英數字詞，不需要額外的分詞套件。
+
+    from knowledge_index import load_or_build, format_context
+    hits = load_or_build().search("冷凝器風冷和水冷差在哪", k=2)
+    basics = format_context(hits)
+
+    python knowledge_index.py add 保養手冊.md 故障排除.txt
+    python knowledge_index.py build
+    python knowledge_index.py query "膨脹閥的作用" --k 2
+    python knowledge_index.py list
+"""
+import os
+import re
+import json
+import math
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+from collections import Counter, defaultdict
+
+from metrics import histogram
+
+# 切段或詞元規則改變時遞增，讓舊索引自動重建
+INDEX_VERSION = 1
+KNOWLEDGE_DIR = os.environ.get("COOLER_KNOWLEDGE_DIR",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge"))
+DEFAULT_INDEX_PATH = os.environ.get("COOLER_KNOWLEDGE_INDEX", os.path.join(".cache", "knowledge", "index.json"))
+DOCUMENT_SUFFIXES = (".md", ".txt")
+DEFAULT_TOP_K = 2
+MAX_CHUNK_CHARS = 800
+
+_HEADING = re.compile(r"^(#{1,3})\s+(.+?)\s*$")
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_WORD = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+# -----------------------------
+# 詞元與 token 估計
+# -----------------------------
+def tokenize(text: str) -> list:
+    """英數字詞（小寫）＋連續漢字的二字組；單一漢字自成一個詞元。"""
+    text = text.lower()
+    terms = _WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 llama 系列的 token 數：漢字約一字一 token，其餘字元約四字一 token。"""
+    cjk = sum(len(run) for run in _CJK_RUN.findall(text))
+    other = len(re.sub(r"\s+", "", text)) - cjk
+    return cjk + math.ceil(other / 4)
+
+
+# -----------------------------
+# 切段
+# -----------------------------
+def split_sections(text: str, source: str, max_chars: int = MAX_CHUNK_CHARS) -> list:
+    """
+    依 # / ## / ### 標題切段，回傳 [{"source", "title", "text"}]。
+    沒有標題的文件以檔名為標題；超過 max_chars 的段落再依空行或條列項目切開。
+    """
+    default_title = os.path.splitext(os.path.basename(source))[0]
+    sections, title, lines = [], default_title, []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body:
+            sections.append((title, body))
+
+    for line in text.splitlines():
+        match = _HEADING.match(line)
+        if match:
+            flush()
+            title, lines = match.group(2), [line]
+        else:
+            lines.append(line)
+    flush()
+
+    chunks = []
+    for title, body in sections:
+        for i, part in enumerate(_split_long(body, max_chars)):
+            chunks.append({"source": source, "title": title if i == 0 else f"{title}（續 {i}）",
+                           "text": part})
+    return chunks
+
+
+def _split_long(body: str, max_chars: int) -> list:
+    if len(body) <= max_chars:
+        return [body]
+    parts, current = [], ""
+    for block in re.split(r"\n\s*\n|\n(?=\s*(?:[-*]|\d+\.)\s)", body):
+        block = block.strip()
+        if not block:
+            continue
+        if current and len(current) + len(block) + 1 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n{block}" if current else block
+    if current:
+        parts.append(current)
+    return parts
+
+
+# -----------------------------
+# BM25 索引
+# -----------------------------
+class KnowledgeIndex:
+    """Okapi BM25 倒排索引；以 JSON 保存段落、段長與倒排串列。"""
+
+    def __init__(self, chunks: list, fingerprint: str = "", k1: float = 1.5, b: float = 0.75,
+                 lengths: list = None, postings: dict = None):
+        self.chunks = chunks
+        self.fingerprint = fingerprint
+        self.k1 = k1
+        self.b = b
+        if lengths is None or postings is None:
+            lengths, postings = [], defaultdict(list)   # 詞元 -> [(段落索引, 詞頻)]
+            for i, chunk in enumerate(chunks):
+                terms = tokenize(f"{chunk['title']}\n{chunk['text']}")
+                lengths.append(len(terms))
+                for term, tf in Counter(terms).items():
+                    postings[term].append((i, tf))
+        self.lengths = lengths
+        self.postings = dict(postings)
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.chunks) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = DEFAULT_TOP_K) -> list:
+        """回傳分數最高的前 k 段 [(分數, 段落 dict)]；與查詢無共同詞元的段落不列入。"""
+        start = time.perf_counter()
+        scores = defaultdict(float)
+        for term, qtf in Counter(tokenize(query)).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                scores[i] += qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        histogram("cooler_knowledge_search_seconds", "知識庫檢索耗時").observe(time.perf_counter() - start)
+        return [(score, self.chunks[i]) for i, score in ranked]
+
+    # ───────── 保存 ─────────
+    def to_dict(self) -> dict:
+        return {"version": INDEX_VERSION, "fingerprint": self.fingerprint, "k1": self.k1, "b": self.b,
+                "chunks": self.chunks, "lengths": self.lengths, "postings": self.postings}
+
+    def save(self, path: str = DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH):
+        """讀取索引；檔案不存在、損毀或版本不符時回傳 None。"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"讀取知識庫索引失敗，將重新建立: {e}")
+            return None
+        if data.get("version") != INDEX_VERSION or "postings" not in data:
+            return None
+        postings = {term: [tuple(entry) for entry in entries] for term, entries in data["postings"].items()}
+        return cls(data["chunks"], data.get("fingerprint", ""), data.get("k1", 1.5), data.get("b", 0.75),
+                   data["lengths"], postings)
+
+
+# -----------------------------
+# 文件來源
+# -----------------------------
+def list_documents(knowledge_dir: str = KNOWLEDGE_DIR) -> list:
+    if not os.path.isdir(knowledge_dir):
+        return []
+    return sorted(os.path.join(knowledge_dir, name) for name in os.listdir(knowledge_dir)
+                  if name.lower().endswith(DOCUMENT_SUFFIXES))
+
+
+def documents_fingerprint(paths) -> str:
+    """來源文件的名稱、大小與修改時間；任一文件新增、刪除或修改後指紋即改變。"""
+    parts = [f"v={INDEX_VERSION}"]
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def read_document(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def build_index(knowledge_dir: str = KNOWLEDGE_DIR, max_chars: int = MAX_CHUNK_CHARS) -> KnowledgeIndex:
+    paths = list_documents(knowledge_dir)
+    chunks = []
+    for path in paths:
+        chunks.extend(split_sections(read_document(path), os.path.basename(path), max_chars))
+    return KnowledgeIndex(chunks, documents_fingerprint(paths))
+
+
+def load_or_build(knowledge_dir: str = KNOWLEDGE_DIR, index_path: str = DEFAULT_INDEX_PATH,
+                  rebuild: bool = False) -> KnowledgeIndex:
+    """讀取已保存的索引；文件有變動（指紋不符）或指定 rebuild 時重新建立並保存。"""
+    fingerprint = documents_fingerprint(list_documents(knowledge_dir))
+    index = None if rebuild else KnowledgeIndex.load(index_path)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    start = time.perf_counter()
+    index = build_index(knowledge_dir)
+    try:
+        index.save(index_path)
+    except OSError as e:
+        logging.warning(f"寫入知識庫索引失敗: {e}")
+    logging.info(f"📚 知識庫索引已重建：{len(index)} 段，{time.perf_counter() - start:.3f} s")
+    return index
+
+
+def add_documents(paths, knowledge_dir: str = KNOWLEDGE_DIR) -> list:
+    """把手冊或保養文件複製到知識庫目錄，回傳複製後的路徑；下次 load_or_build 時自動重建索引。"""
+    os.makedirs(knowledge_dir, exist_ok=True)
+    added = []
+    for path in paths:
+        if not path.lower().endswith(DOCUMENT_SUFFIXES):
+            raise ValueError(f"僅支援 {'/'.join(DOCUMENT_SUFFIXES)} 文件：{path}")
+        target = os.path.join(knowledge_dir, os.path.basename(path))
+        shutil.copy2(path, target)
+        added.append(target)
+    return added
+
+
+def format_context(hits) -> str:
+    """把檢索結果組成放進 prompt 的知識段落（保留原標題與來源）。"""
+    return "\n\n".join(f"{chunk['text']}\n（來源：{chunk['source']}）" for _, chunk in hits)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="冷卻機知識庫檢索索引")
+    parser.add_argument("--knowledge-dir", default=KNOWLEDGE_DIR)
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_add = sub.add_parser("add", help="加入手冊或保養文件（.md / .txt）並重建索引")
+    p_add.add_argument("paths", nargs="+")
+    sub.add_parser("build", help="強制重建索引")
+    p_query = sub.add_parser("query", help="檢索並顯示 prompt 大小比較")
+    p_query.add_argument("text")
+    p_query.add_argument("--k", type=int, default=DEFAULT_TOP_K)
+    sub.add_parser("list", help="列出所有段落")
+    args = parser.parse_args()
+
+    if args.command == "add":
+        for path in add_documents(args.paths, args.knowledge_dir):
+            print(f"已加入 {path}")
+    index = load_or_build(args.knowledge_dir, args.index, rebuild=args.command == "build")
+
+    if args.command == "query":
+        hits = index.search(args.text, k=args.k)
+        for score, chunk in hits:
+            print(f"{score:7.3f}  {chunk['source']} / {chunk['title']}")
+        full = "\n\n".join(chunk["text"] for chunk in index.chunks)
+        print(f"prompt 知識段落約 {estimate_tokens(format_context(hits))} tokens"
+              f"（全部 {len(index)} 段約 {estimate_tokens(full)} tokens）")
+    elif args.command == "list":
+        for chunk in index.chunks:
+            print(f"{chunk['source']:<32} {chunk['title']:<24} ~{estimate_tokens(chunk['text'])} tokens")
+    else:
+        print(f"索引共 {len(index)} 段 → {args.index}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+延遲載入與啟動時間報告。
+
+Streamlit 每次互動都會重新執行 voice_app2.py，頂層的 import 決定了伺服器啟動與首次繪製的速度。
+optuna / scikit-learn / pandas / langchain 等較重的套件改為第一次用到時才載入：
+
+    from lazy_imports import lazy_module, timed_import
+
+    pd = lazy_module("pandas")              # 第一次存取屬性時才 import
+    optimizer = timed_import("temp_optimizer")
+
+每個延遲載入的模組都會記錄耗時（import_times()、指標 voice_lazy_import_seconds）。
+以 python -X importtime 量測某個模組完整的匯入成本（依頂層套件彙總）：
+
+    python lazy_imports.py report voice_app2 --top 20
+"""
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import importlib
+import threading
+import subprocess
+from collections import defaultdict
+
+from metrics import histogram
+
+_import_times = {}   # 模組名稱 -> 首次載入耗時（秒）
+_lock = threading.Lock()
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+def timed_import(name: str):
+    """import 並記錄首次載入耗時；已載入的模組直接回傳。"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _import_times.setdefault(name, elapsed)
+    histogram("voice_lazy_import_seconds", "延遲載入模組耗時", module=name).observe(elapsed)
+    logging.info(f"📦 延遲載入 {name}：{elapsed * 1000:.0f} ms")
+    return module
+
+
+class LazyModule:
+    """模組代理：第一次存取屬性時才透過 timed_import 載入。"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = timed_import(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def import_times() -> dict:
+    """回傳目前行程中已延遲載入的模組與耗時（秒），依耗時由大到小。"""
+    with _lock:
+        return dict(sorted(_import_times.items(), key=lambda item: -item[1]))
+
+
+# -----------------------------
+# -X importtime 報告
+# -----------------------------
+def parse_importtime(text: str):
+    """解析 -X importtime 的 stderr，回傳 [(模組, self 微秒, cumulative 微秒, 深度)]。"""
+    entries = []
+    for line in text.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def summarize_by_package(entries):
+    """
+    依頂層套件彙總 self 時間（每個子模組只算一次，總和等於整體匯入時間），
+    回傳 [(套件, 毫秒, 子模組數)]，依耗時由大到小。
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for name, self_us, _, _ in entries:
+        package = name.split(".")[0]
+        totals[package][0] += self_us
+        totals[package][1] += 1
+    return sorted(((package, us / 1000.0, count) for package, (us, count) in totals.items()),
+                  key=lambda row: -row[1])
+
+
+def measure_import(module: str, python: str = None) -> list:
+    """在全新的直譯器中 import module，回傳 parse_importtime 的結果。"""
+    env = dict(os.environ)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [here, env.get("PYTHONPATH")]))
+    proc = subprocess.run([python or sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"import {module} 失敗：\n" + "\n".join(errors[-10:]))
+    return parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模組匯入時間報告")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_report = sub.add_parser("report", help="以 -X importtime 量測匯入成本")
+    p_report.add_argument("modules", nargs="+", help="要量測的模組，例如 voice_app2 temp_optimizer")
+    p_report.add_argument("--top", type=int, default=15, help="列出耗時最多的前 N 個套件")
+    p_report.add_argument("--python", help="使用的直譯器（預設為目前的直譯器）")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        entries = measure_import(module, args.python)
+        rows = summarize_by_package(entries)
+        total_ms = sum(ms for _, ms, _ in rows)
+        print(f"\nimport {module}：共 {total_ms:.0f} ms，{len(entries)} 個模組")
+        print(f"{'套件':<28} {'毫秒':>9} {'比例':>7} {'模組數':>7}")
+        for package, ms, count in rows[:args.top]:
+            print(f"{package:<28} {ms:>9.1f} {ms / total_ms:>7.1%} {count:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+CoolerApp 的即時溫度趨勢圖（QPainter，不需額外套件）。
+
+資料直接取自擷取流程的 SampleRing（預先配置的 NumPy 環形緩衝區），繪圖與擷取頻率無關：
+  - 重繪由獨立的 QTimer 驅動，上限 max_fps；緩衝區沒有新資料且視窗未改變時不重繪
+  - 每條曲線依可見時間範圍做 min/max 分桶（每個像素欄一桶），縮放到數小時也只畫約 2 × 寬度個點
+  - 量測每次繪製耗時，平均耗時 × 幀率超過 cpu_budget（占單核比例）時自動降低幀率
+
+滑鼠滾輪縮放時間範圍（30 秒到緩衝區長度），雙擊回到預設範圍；永遠顯示到最新樣本。
+
+    from live_plot import LivePlotWidget
+    plot = LivePlotWidget()
+    plot.add_ring(self.sample_ring)
+
+多台裝置的示範（合成資料，標題列顯示幀率與繪製耗時）：
+    python live_plot.py demo --devices 8 --hours 6
+"""
+import sys
+import time
+import math
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+from PyQt5.QtCore import Qt, QTimer, QPointF, QRectF
+from PyQt5.QtGui import QColor, QPainter, QPen, QPolygonF
+from PyQt5.QtWidgets import QApplication, QWidget
+
+from metrics import histogram
+from sample_ring import SampleRing
+from temperature_store import CHANNELS, Sample
+
+CHANNEL_LABELS = {"sensor_liquid": "液溫", "sensor_reference": "參考", "set_temperature": "設定"}
+PALETTE = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f",
+           "#bcbd22", "#17becf")
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 48, 10, 22, 22
+
+
+def to_polygon(xy: np.ndarray) -> QPolygonF:
+    """(n, 2) float64 陣列轉為 QPolygonF；直接寫入 QPolygonF 的記憶體，不逐點建立 QPointF。"""
+    polygon = QPolygonF()
+    polygon.fill(QPointF(), len(xy))
+    buffer = polygon.data()
+    buffer.setsize(len(xy) * 2 * 8)
+    np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = xy
+    return polygon
+
+
+def envelope_xy(x: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """每桶依序輸出 (x, low) 與 (x, high)，連成的折線即為 min/max 包絡。"""
+    xy = np.empty((2 * len(x), 2))
+    xy[0::2, 0] = x
+    xy[1::2, 0] = x
+    xy[0::2, 1] = low
+    xy[1::2, 1] = high
+    return xy
+
+
+class LivePlotWidget(QWidget):
+    """以一或多個 SampleRing 為資料來源的即時趨勢圖。"""
+
+    def __init__(self, parent=None, span_s: float = 600.0, max_fps: float = 10.0,
+                 cpu_budget: float = 0.05, min_span_s: float = 30.0):
+        super().__init__(parent)
+        self.default_span_s = span_s
+        self.span_s = span_s
+        self.min_span_s = min_span_s
+        self.max_fps = max_fps
+        self.cpu_budget = cpu_budget
+        self.fps = max_fps
+        self.series = []             # [(標籤, ring, 通道索引, QPen)]
+        self.paint_seconds = 0.0     # 繪製耗時的 EWMA
+        self._seen = None
+        self.last_frame = None       # 最近一次繪製的點數、耗時與幀率
+        self.setMinimumHeight(180)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._tick)
+        self._timer.start(int(1000 / max_fps))
+
+    # ───────── 資料來源 ─────────
+    def add_ring(self, ring: SampleRing, label: str = "", channels=("sensor_liquid", "sensor_reference")):
+        for channel in channels:
+            color = QColor(PALETTE[len(self.series) % len(PALETTE)])
+            name = f"{label} {CHANNEL_LABELS.get(channel, channel)}".strip()
+            # 寬度 0 為 1 像素的 cosmetic pen，走 Qt 的快速線段繪製路徑（比寬度 1.2 快約 4 倍）
+            self.series.append((name, ring, CHANNELS.index(channel), QPen(color, 0)))
+        self._seen = None
+
+    def _rings(self):
+        rings = []
+        for _, ring, _, _ in self.series:
+            if all(ring is not seen for seen in rings):
+                rings.append(ring)
+        return rings
+
+    # ───────── 幀率控制 ─────────
+    def _tick(self):
+        state = (tuple(ring.version for ring in self._rings()), self.span_s, self.width(), self.height())
+        if state != self._seen:
+            self._seen = state
+            self.update()
+
+    def _adapt_fps(self, elapsed: float):
+        self.paint_seconds = elapsed if not self.paint_seconds else 0.8 * self.paint_seconds + 0.2 * elapsed
+        fps = max(1.0, min(self.max_fps, self.cpu_budget / max(self.paint_seconds, 1e-6)))
+        if abs(fps - self.fps) >= 0.5:
+            self.fps = fps
+            self._timer.setInterval(int(1000 / fps))
+
+    # ───────── 互動 ─────────
+    def max_span_s(self) -> float:
+        return max((ring.capacity / ring.sample_rate_hz for ring in self._rings()), default=1.0)
+
+    def wheelEvent(self, event):
+        factor = 1 / 1.5 if event.angleDelta().y() > 0 else 1.5
+        self.span_s = min(max(self.span_s * factor, self.min_span_s), max(self.max_span_s(), self.min_span_s))
+        self._tick()
+
+    def mouseDoubleClickEvent(self, event):
+        self.span_s = self.default_span_s
+        self._tick()
+
+    # ───────── 繪製 ─────────
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("white"))
+        plot = QRectF(MARGIN_LEFT, MARGIN_TOP, max(1, self.width() - MARGIN_LEFT - MARGIN_RIGHT),
+                      max(1, self.height() - MARGIN_TOP - MARGIN_BOTTOM))
+        painter.setPen(QPen(QColor("#999999"), 1))
+        painter.drawRect(plot)
+
+        latest = [ring.latest() for ring in self._rings()]
+        latest = [sample.timestamp for sample in latest if sample is not None]
+        if not latest:
+            painter.drawText(plot, Qt.AlignCenter, "尚無資料")
+            painter.end()
+            return
+        end = max(latest)
+        begin = end - timedelta(seconds=self.span_s)
+        t0, t1 = begin.timestamp(), end.timestamp()
+        buckets = max(1, int(plot.width()))
+
+        # 每個 ring 只降採樣一次，各通道共用
+        windows = {id(ring): ring.minmax(begin, end, buckets) for ring in self._rings()}
+        y_low, y_high = math.inf, -math.inf
+        for _, ring, index, _ in self.series:
+            _, low, high = windows[id(ring)]
+            if len(low):
+                y_low, y_high = min(y_low, float(low[:, index].min())), max(y_high, float(high[:, index].max()))
+        if not math.isfinite(y_low):
+            y_low, y_high = 0.0, 1.0
+        pad = max((y_high - y_low) * 0.05, 0.1)
+        y_low, y_high = y_low - pad, y_high + pad
+
+        x_scale = plot.width() / max(t1 - t0, 1e-9)
+        y_scale = plot.height() / (y_high - y_low)
+        self._draw_axes(painter, plot, t0, t1, y_low, y_high)
+
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        painter.setClipRect(plot)
+        points = 0
+        for _, ring, index, pen in self.series:
+            times, low, high = windows[id(ring)]
+            if not len(times):
+                continue
+            x = plot.left() + (times - t0) * x_scale
+            xy = envelope_xy(x, plot.bottom() - (low[:, index] - y_low) * y_scale,
+                             plot.bottom() - (high[:, index] - y_low) * y_scale)
+            painter.setPen(pen)
+            painter.drawPolyline(to_polygon(xy))
+            points += len(xy)
+        painter.setClipping(False)
+        self._draw_legend(painter, plot)
+        painter.end()
+
+        elapsed = time.perf_counter() - start
+        histogram("cooler_plot_paint_seconds", "即時趨勢圖每次繪製耗時",
+                  buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)).observe(elapsed)
+        self._adapt_fps(elapsed)
+        self.last_frame = {"points": points, "paint_ms": elapsed * 1000, "fps": self.fps}
+
+    def _draw_axes(self, painter, plot, t0, t1, y_low, y_high):
+        painter.setPen(QPen(QColor("#555555"), 1))
+        for i in range(5):
+            value = y_low + (y_high - y_low) * i / 4
+            y = plot.bottom() - plot.height() * i / 4
+            painter.drawText(QRectF(0, y - 8, MARGIN_LEFT - 4, 16), Qt.AlignRight | Qt.AlignVCenter, f"{value:.1f}")
+        fmt = "%H:%M:%S" if t1 - t0 < 3 * 3600 else "%H:%M"
+        for i in range(5):
+            t = t0 + (t1 - t0) * i / 4
+            x = plot.left() + plot.width() * i / 4
+            label = datetime.fromtimestamp(t).strftime(fmt)
+            painter.drawText(QRectF(x - 40, plot.bottom() + 2, 80, MARGIN_BOTTOM - 2), Qt.AlignCenter, label)
+
+    def _draw_legend(self, painter, plot):
+        x = plot.left() + 6
+        for name, _, _, pen in self.series[:12]:
+            painter.setPen(pen)
+            painter.drawLine(QPointF(x, 11), QPointF(x + 14, 11))
+            painter.setPen(QPen(QColor("#333333"), 1))
+            painter.drawText(QPointF(x + 18, 15), name)
+            x += 24 + painter.fontMetrics().horizontalAdvance(name)
+            if x > plot.right() - 60:
+                break
+
+
+# -----------------------------
+# 示範：多台裝置的合成資料
+# -----------------------------
+def _fill_synthetic(ring: SampleRing, hours: float, seed: int):
+    from cooler_simulator import ThermalModel
+
+    rng = random.Random(seed)
+    thermal = ThermalModel(phase=rng.uniform(0, 2 * math.pi))
+    now = time.time()
+    n = min(ring.capacity, int(hours * 3600))
+    for i in range(n):
+        t = now - (n - i)
+        thermal.advance(i, 1.0, rng)
+        ring.append(Sample(datetime.fromtimestamp(t), thermal.liquid, thermal.reference, thermal.setpoint))
+    return thermal, rng
+
+
+def main():
+    parser = argparse.ArgumentParser(description="即時趨勢圖示範")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_demo = sub.add_parser("demo", help="以合成資料顯示多台裝置的趨勢圖")
+    p_demo.add_argument("--devices", type=int, default=4)
+    p_demo.add_argument("--hours", type=float, default=6.0)
+    p_demo.add_argument("--poll-ms", type=int, default=1000, help="合成樣本的寫入間隔")
+    p_demo.add_argument("--max-fps", type=float, default=10.0)
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    plot = LivePlotWidget(span_s=args.hours * 3600, max_fps=args.max_fps)
+    devices = []
+    for i in range(args.devices):
+        ring = SampleRing.for_duration(args.hours)
+        thermal, rng = _fill_synthetic(ring, args.hours, seed=i)
+        plot.add_ring(ring, label=f"#{i}", channels=("sensor_liquid", "sensor_reference"))
+        devices.append((ring, thermal, rng))
+
+    elapsed = [0.0]
+
+    def poll():
+        elapsed[0] += args.poll_ms / 1000
+        for ring, thermal, rng in devices:
+            thermal.advance(elapsed[0], args.poll_ms / 1000, rng)
+            ring.append(Sample(datetime.now(), thermal.liquid, thermal.reference, thermal.setpoint))
+        frame = plot.last_frame
+        if frame:
+            plot.setWindowTitle(f"{args.devices} 台：{frame['points']} 點，繪製 {frame['paint_ms']:.1f} ms，"
+                                f"{frame['fps']:.1f} fps")
+
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    timer.start(args.poll_ms)
+    plot.resize(1000, 400)
+    plot.show()
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
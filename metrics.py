@@ -0,0 +1,281 @@
+"""
+輕量級效能指標：計數器與直方圖，開銷低到可以常駐開啟。
+
+    from metrics import timed, counter
+
+    with timed("cooler_modbus_read_seconds"):
+        values = client.read_input_registers(0x0004, 3)
+
+    @timed("cooler_optimizer_seconds")
+    def find_optimal_temp_offset(...): ...
+
+指標可透過 Prometheus 文字格式的 HTTP 端點（/metrics）或定期 JSON 檔匯出。
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 直方圖預設分桶（秒）：0.1 ms ~ 60 s，涵蓋 Modbus 往返到 LLM 呼叫
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Counter:
+    """單調遞增計數器。"""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """固定分桶直方圖，記錄次數、總和與各桶計數，可估計百分位數。"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float):
+        """以分桶內線性內插估計百分位數。"""
+        with self._lock:
+            counts, total, observed_max = list(self.counts), self.count, self.max
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else observed_max
+                upper = max(lower, min(upper, observed_max))
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return observed_max
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        key = (name, _label_key(labels))
+        metric = self._counters.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._counters.setdefault(key, Counter())
+                if help_text:
+                    self._help.setdefault(name, help_text)
+        return metric
+
+    def histogram(self, name: str, help_text: str = "", buckets=DEFAULT_BUCKETS, **labels) -> Histogram:
+        key = (name, _label_key(labels))
+        metric = self._histograms.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._histograms.setdefault(key, Histogram(buckets))
+                if help_text:
+                    self._help.setdefault(name, help_text)
+        return metric
+
+    # ───────── 匯出 ─────────
+    def render_prometheus(self) -> str:
+        """輸出 Prometheus text exposition format。"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        seen = set()
+        for (name, key), metric in counters:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(key)} {metric.value}")
+        for (name, key), metric in histograms:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            with metric._lock:
+                counts, total_sum, total_count = list(metric.counts), metric.sum, metric.count
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {total_count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total_sum}")
+            lines.append(f"{name}_count{_format_labels(key)} {total_count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """回傳 JSON 可序列化的摘要（直方圖附 p50/p90/p99 估計值）。"""
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = list(self._histograms.items())
+        result = {"timestamp": time.time(), "counters": {}, "histograms": {}}
+        for (name, key), metric in counters:
+            result["counters"][f"{name}{_format_labels(key)}"] = metric.value
+        for (name, key), metric in histograms:
+            result["histograms"][f"{name}{_format_labels(key)}"] = {
+                "count": metric.count,
+                "sum": metric.sum,
+                "max": metric.max,
+                "p50": metric.quantile(0.50),
+                "p90": metric.quantile(0.90),
+                "p99": metric.quantile(0.99),
+            }
+        return result
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help_text: str = "", **labels) -> Counter:
+    return REGISTRY.counter(name, help_text, **labels)
+
+
+def histogram(name: str, help_text: str = "", **labels) -> Histogram:
+    return REGISTRY.histogram(name, help_text, **labels)
+
+
+class timed:
+    """
+    以直方圖記錄耗時（秒），可作為 context manager 或裝飾器使用。
+    區塊內拋出例外時另外累加 <name 去除 _seconds>_errors_total 計數。
+    """
+
+    def __init__(self, name: str, help_text: str = "", **labels):
+        self.name = name
+        self.labels = labels
+        self._histogram = REGISTRY.histogram(name, help_text, **labels)
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._start)
+        if exc_type is not None:
+            REGISTRY.counter(self.name.replace("_seconds", "") + "_errors_total", **self.labels).inc()
+        return False
+
+    def __call__(self, fn):
+        histogram_ = self._histogram
+        name, labels = self.name, self.labels
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                REGISTRY.counter(name.replace("_seconds", "") + "_errors_total", **labels).inc()
+                raise
+            finally:
+                histogram_.observe(time.perf_counter() - start)
+        return wrapper
+
+
+# -----------------------------
+# 匯出端點
+# -----------------------------
+def start_http_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+    """啟動 /metrics（Prometheus 文字格式）與 /metrics.json 端點，回傳伺服器物件。"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+                content_type = "application/json"
+            elif self.path.startswith("/metrics"):
+                body = registry.render_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Metrics endpoint running on http://{host}:{port}/metrics")
+    return server
+
+
+def start_json_dump(path: str, interval: float = 60.0, registry: MetricsRegistry = REGISTRY):
+    """每 interval 秒將指標摘要以原子方式寫入 JSON 檔。"""
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(registry.snapshot(), f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logging.error(f"寫入指標 JSON 失敗: {e}")
+
+    threading.Thread(target=loop, name="metrics-dump", daemon=True).start()
+
+
+def start_exporters_from_env(default_port: int = None):
+    """
+    依環境變數啟動匯出：COOLER_METRICS_PORT（0 為停用，預設 default_port）、
+    COOLER_METRICS_DUMP（JSON 檔路徑）與 COOLER_METRICS_DUMP_INTERVAL（秒）。
+    """
+    port = int(os.environ.get("COOLER_METRICS_PORT", default_port or 0))
+    if port:
+        try:
+            start_http_server(port)
+        except OSError as e:
+            logging.error(f"Metrics endpoint 啟動失敗: {e}")
+    dump_path = os.environ.get("COOLER_METRICS_DUMP")
+    if dump_path:
+        start_json_dump(dump_path, float(os.environ.get("COOLER_METRICS_DUMP_INTERVAL", "60")))
@@ -0,0 +1,126 @@
+"""
+版本化的模型存放區。
+
+    models/
+        v0001/energy_model_poly_ridge.joblib
+        v0001/error_model_poly_ridge.joblib
+        v0001/meta.json
+        v0001/uncertainty_ensemble.joblib   # 選用，由 publish 的 extra_artifacts 寫入
+        v0002/...
+        current.json        # 指向目前使用的版本
+
+發佈時先完整寫好新版本目錄，最後才以 os.replace 原子性地更新 current.json，
+最佳化器讀到的永遠是一組完整的模型；沒有 current.json 時沿用工作目錄下原本的模型檔。
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+from joblib import dump, load
+
+MODEL_DIR = os.environ.get("COOLER_MODEL_DIR", "models")
+POINTER_FILE = "current.json"
+ENERGY_MODEL_FILE = "energy_model_poly_ridge.joblib"
+ERROR_MODEL_FILE = "error_model_poly_ridge.joblib"
+ENSEMBLE_FILE = "uncertainty_ensemble.joblib"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _atomic_write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def current_version(model_dir: str = None):
+    """回傳目前 current.json 的內容；尚未發佈過時回傳 None。"""
+    path = os.path.join(model_dir or MODEL_DIR, POINTER_FILE)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"讀取模型版本指標失敗: {e}")
+        return None
+
+
+def list_versions(model_dir: str = None):
+    model_dir = model_dir or MODEL_DIR
+    if not os.path.isdir(model_dir):
+        return []
+    return sorted(name for name in os.listdir(model_dir)
+                  if name.startswith("v") and name[1:].isdigit())
+
+
+def publish(energy_model, error_model, meta: dict = None, model_dir: str = None,
+            extra_artifacts: dict = None) -> str:
+    """
+    寫入新版本並原子性地切換 current.json，回傳版本名稱（例如 v0003）。
+    extra_artifacts 為 {檔名: 物件}，與模型一起寫進版本目錄（例如 ENSEMBLE_FILE 的預測區間集成），
+    切換前就已就緒，最佳化器不會讀到缺少集成的新版本。
+    """
+    model_dir = model_dir or MODEL_DIR
+    os.makedirs(model_dir, exist_ok=True)
+    versions = list_versions(model_dir)
+    number = int(versions[-1][1:]) + 1 if versions else 1
+    version = f"v{number:04d}"
+    version_dir = os.path.join(model_dir, version)
+    os.makedirs(version_dir)
+
+    dump(energy_model, os.path.join(version_dir, ENERGY_MODEL_FILE))
+    dump(error_model, os.path.join(version_dir, ERROR_MODEL_FILE))
+    for filename, artifact in (extra_artifacts or {}).items():
+        dump(artifact, os.path.join(version_dir, filename))
+    meta = dict(meta or {})
+    meta["artifacts"] = sorted(extra_artifacts or {})
+    meta.update(version=version, published_at=datetime.now().isoformat(timespec="seconds"))
+    _atomic_write_json(os.path.join(version_dir, "meta.json"), meta)
+
+    _atomic_write_json(os.path.join(model_dir, POINTER_FILE), {
+        "version": version,
+        "energy_model": os.path.join(version, ENERGY_MODEL_FILE),
+        "error_model": os.path.join(version, ERROR_MODEL_FILE),
+        "published_at": meta["published_at"],
+    })
+    logging.info(f"📦 已發佈模型版本 {version}")
+    return version
+
+
+def resolve_model_paths(energy_model_path: str = None, error_model_path: str = None,
+                        model_dir: str = None):
+    """
+    明確指定的路徑優先；否則使用 current.json 指向的版本，
+    再否則沿用工作目錄下原本的模型檔名。
+    """
+    if energy_model_path and error_model_path:
+        return energy_model_path, error_model_path
+    model_dir = model_dir or MODEL_DIR
+    pointer = current_version(model_dir)
+    if pointer:
+        energy_default = os.path.join(model_dir, pointer["energy_model"])
+        error_default = os.path.join(model_dir, pointer["error_model"])
+    else:
+        energy_default, error_default = ENERGY_MODEL_FILE, ERROR_MODEL_FILE
+    return energy_model_path or energy_default, error_model_path or error_default
+
+
+def load_model(path: str):
+    """以 (路徑, 修改時間) 快取載入的模型；檔案被覆寫時自動重新載入。"""
+    key = os.path.abspath(path)
+    mtime = os.path.getmtime(key)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    model = load(key)
+    with _cache_lock:
+        _cache[key] = (mtime, model)
+    return model
@@ -0,0 +1,238 @@
+"""
+NC 程式分析結果的內容定址快取。
+
+同一支 CAM 程式跨班別重複上傳時，解析與每個 RPM 的最佳化不必重跑：
+以「檔案內容 SHA-256 + 模型版本指紋 + 最佳化設定」為鍵，把完整的分析結果
+（各 RPM 時長、依程式順序的區段、最佳化結果與設定點計畫）存成 JSON，
+命中時只需計算一次雜湊。快取依最近使用時間（檔案 mtime）做 LRU，
+超過筆數或總大小上限時淘汰最舊的項目。
+
+    from nc_analysis_cache import analyze_nc_program
+    analysis = analyze_nc_program(content, find_optimal_temp_offset)
+
+    python nc_analysis_cache.py analyze program.txt
+    python nc_analysis_cache.py stats
+    python nc_analysis_cache.py clear
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict
+
+import model_store
+from metrics import counter, histogram
+from nc_program import parse_nc_segments
+from nc_executor import build_setpoint_plan
+
+# 分析結果格式或最佳化邏輯改變時遞增，讓舊的快取自動失效
+ANALYSIS_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get("NC_ANALYSIS_CACHE_DIR", os.path.join(".cache", "nc_analysis"))
+DEFAULT_MAX_ENTRIES = 200
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+def model_fingerprint(energy_model_path: str = None, error_model_path: str = None) -> str:
+    """目前使用的模型（與預測區間集成）的路徑、大小與修改時間；模型更新後指紋即改變。"""
+    paths = list(model_store.resolve_model_paths(energy_model_path, error_model_path))
+    paths.append(os.path.join(os.path.dirname(os.path.abspath(paths[0])), model_store.ENSEMBLE_FILE))
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{os.path.abspath(path)}|missing")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class NCAnalysisCache:
+    """以 JSON 檔存放的 LRU 快取；讀寫皆為原子操作，可由多個 Streamlit session 共用。"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content: bytes, model_fp: str, settings: dict = None) -> str:
+        digest = hashlib.sha256(f"v={ANALYSIS_VERSION};model={model_fp};".encode("utf-8"))
+        digest.update(json.dumps(settings or {}, sort_keys=True).encode("utf-8"))
+        digest.update(hashlib.sha256(content).digest())
+        return digest.hexdigest()[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                analysis = json.load(f)
+            os.utime(path)   # 更新最近使用時間
+        except FileNotFoundError:
+            counter("nc_analysis_cache_misses_total", "NC 分析快取未命中次數").inc()
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"讀取 NC 分析快取失敗，重新分析: {e}")
+            counter("nc_analysis_cache_misses_total", "NC 分析快取未命中次數").inc()
+            return None
+        counter("nc_analysis_cache_hits_total", "NC 分析快取命中次數").inc()
+        return _restore_keys(analysis)
+
+    def put(self, key: str, analysis: dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(analysis, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def _entries(self):
+        """回傳 [(mtime, size, path)]，由舊到新。"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self) -> int:
+        """淘汰最久未使用的項目直到符合筆數與大小上限，回傳淘汰筆數。"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        if removed:
+            counter("nc_analysis_cache_evictions_total", "NC 分析快取淘汰筆數").inc(removed)
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {"cache_dir": self.cache_dir, "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+    def clear(self) -> int:
+        entries = self._entries()
+        for _, _, path in entries:
+            os.remove(path)
+        return len(entries)
+
+
+def _restore_keys(analysis: dict) -> dict:
+    """JSON 物件的鍵一律是字串，把 RPM 鍵轉回 int。"""
+    for field in ("rpm_durations", "nc_parameters"):
+        analysis[field] = {int(rpm): value for rpm, value in analysis.get(field, {}).items()}
+    return analysis
+
+
+def analyze_nc_program(content, optimize_fn, *, cache: NCAnalysisCache = None,
+                       optimizer_settings: dict = None, model_fp: str = None, use_cache: bool = True) -> dict:
+    """
+    解析 NC 程式並對每個 RPM 執行 optimize_fn(rpm, hours, **optimizer_settings)，
+    回傳 dict(key, cached, rpm_durations, segments, nc_parameters, plan, analysis_seconds)。
+    content 可為 bytes 或 str；相同內容、模型版本與設定的結果直接從快取取回。
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    settings = dict(optimizer_settings or {})
+    cache = cache or NCAnalysisCache()
+    key = None
+    if use_cache:
+        key = cache.make_key(content, model_fp or model_fingerprint(), settings)
+        cached = cache.get(key)
+        if cached is not None:
+            cached["cached"] = True
+            logging.info(f"⚡ NC 分析快取命中 {key}")
+            return cached
+
+    start = time.perf_counter()
+    segments = parse_nc_segments(content.decode("utf-8"))
+    rpm_durations = defaultdict(float)
+    for segment in segments:
+        rpm_durations[segment["rpm"]] += segment["hours"]
+
+    nc_parameters = {}
+    for rpm, hours in rpm_durations.items():
+        explanation, best_offset = optimize_fn(rpm, hours, **settings)
+        nc_parameters[rpm] = {"hours": hours, "best_offset": best_offset, "explanation": explanation}
+    elapsed = time.perf_counter() - start
+    histogram("nc_analysis_seconds", "NC 程式解析與最佳化耗時（未命中快取）").observe(elapsed)
+
+    analysis = {
+        "key": key,
+        "cached": False,
+        "rpm_durations": dict(rpm_durations),
+        "segments": segments,
+        "nc_parameters": nc_parameters,
+        "plan": build_setpoint_plan(segments, nc_parameters),
+        "analysis_seconds": elapsed,
+    }
+    if use_cache:
+        try:
+            cache.put(key, analysis)
+        except OSError as e:
+            logging.warning(f"寫入 NC 分析快取失敗: {e}")
+    return analysis
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="NC 程式分析快取")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES)
+    parser.add_argument("--max-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 / 1024)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_analyze = sub.add_parser("analyze", help="分析 NC 程式（命中快取時直接取回）")
+    p_analyze.add_argument("path")
+    p_analyze.add_argument("--no-cache", action="store_true")
+    sub.add_parser("stats", help="顯示快取使用量")
+    sub.add_parser("clear", help="清除所有快取")
+    args = parser.parse_args()
+
+    cache = NCAnalysisCache(args.cache_dir, args.max_entries, int(args.max_mb * 1024 * 1024))
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif args.command == "clear":
+        print(f"已清除 {cache.clear()} 筆快取")
+    else:
+        def optimize(rpm, hours, **settings):
+            # 命中快取時不需要載入 optuna / scikit-learn
+            from temp_optimizer import find_optimal_temp_offset
+            return find_optimal_temp_offset(rpm, hours, **settings)
+
+        with open(args.path, "rb") as f:
+            content = f.read()
+        analysis = analyze_nc_program(content, optimize, cache=cache,
+                                      use_cache=not args.no_cache)
+        source = "快取" if analysis["cached"] else f"重新分析 {analysis['analysis_seconds']:.2f} s"
+        print(f"{len(analysis['segments'])} 個區段、{len(analysis['nc_parameters'])} 種轉速（{source}）")
+        for rpm, params in analysis["nc_parameters"].items():
+            print(f"  RPM {rpm}: {params['hours']:.2f} h → TempOffset {params['best_offset']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+from datetime import datetime
+
+# 執行器狀態
+PENDING = "pending"
+RUNNING = "running"
+PAUSED = "paused"
+ABORTED = "aborted"
+DONE = "done"
+
+
+def build_setpoint_plan(segments, nc_parameters):
+    """
+    將依程式順序排列的轉速區段（nc_program.parse_nc_segments）
+    與每個 RPM 的最佳化結果合併為設定點計畫。
+    """
+    plan = []
+    for segment in segments:
+        params = nc_parameters.get(segment["rpm"])
+        if params is None:
+            continue
+        plan.append({
+            "rpm": segment["rpm"],
+            "hours": segment["hours"],
+            "start_hours": segment["start_hours"],
+            "best_offset": params["best_offset"],
+            "explanation": params["explanation"],
+        })
+    return plan
+
+
+class NCAutoAdjustExecutor:
+    """
+    在背景執行緒依 NC 程式時間軸下發溫度偏差：
+    每個區段開始時呼叫 send_fn(rpm, offset)，並等待該區段的實際時長
+    （hours × 3600 × time_scale 秒）後才進入下一段。
+    支援暫停（凍結倒數）、繼續與中止；snapshot() 回傳可放入 session_state 的進度。
+    """
+
+    def __init__(self, plan, send_fn, time_scale: float = 1.0):
+        self.plan = list(plan)
+        self.send_fn = send_fn
+        self.time_scale = time_scale
+
+        self.state = PENDING
+        self.current_index = None
+        self.log = []
+        self._deadline = None           # 目前區段結束時間（monotonic）
+        self._paused_remaining = None   # 暫停時凍結的區段剩餘秒數
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # ───────── 控制 ─────────
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self.state = RUNNING
+            self._thread = threading.Thread(target=self._run, name="nc-auto-adjust", daemon=True)
+            self._thread.start()
+        logging.info(f"NC 自動調整開始，共 {len(self.plan)} 個區段")
+
+    def pause(self):
+        with self._cond:
+            if self.state == RUNNING:
+                self.state = PAUSED
+                if self._deadline is not None:
+                    self._paused_remaining = max(0.0, self._deadline - time.monotonic())
+                self._cond.notify_all()
+                logging.info("NC 自動調整已暫停")
+
+    def resume(self):
+        with self._cond:
+            if self.state == PAUSED:
+                self.state = RUNNING
+                self._cond.notify_all()
+                logging.info("NC 自動調整已繼續")
+
+    def abort(self):
+        with self._cond:
+            if self.state in (PENDING, RUNNING, PAUSED):
+                self.state = ABORTED
+                self._cond.notify_all()
+                logging.info("NC 自動調整已中止")
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (ABORTED, DONE)
+
+    # ───────── 執行緒 ─────────
+    def _remaining_s(self) -> float:
+        if self._paused_remaining is not None:
+            return self._paused_remaining
+        if self._deadline is None:
+            return 0.0
+        return max(0.0, self._deadline - time.monotonic())
+
+    def _wait_segment(self, duration_s: float) -> bool:
+        """等待區段時長；暫停期間不計時。回傳 False 代表已中止。"""
+        with self._cond:
+            self._deadline = time.monotonic() + duration_s
+            self._paused_remaining = None
+            while True:
+                if self.state == ABORTED:
+                    return False
+                if self.state == PAUSED:
+                    if self._paused_remaining is None:
+                        self._paused_remaining = self._remaining_s()
+                    self._cond.wait()
+                    continue
+                if self._paused_remaining is not None:
+                    # 繼續後以凍結的剩餘時間重新計算結束時間
+                    self._deadline = time.monotonic() + self._paused_remaining
+                    self._paused_remaining = None
+                remaining = self._remaining_s()
+                if remaining <= 0:
+                    self._deadline = None
+                    return True
+                self._cond.wait(timeout=remaining)
+
+    def _run(self):
+        for index, step in enumerate(self.plan):
+            with self._cond:
+                # 區段之間若處於暫停，先等待繼續
+                while self.state == PAUSED:
+                    self._cond.wait()
+                if self.state == ABORTED:
+                    return
+                self.current_index = index
+
+            try:
+                resp = self.send_fn(step["rpm"], step["best_offset"])
+            except Exception as e:
+                resp = f"❌ {e}"
+            with self._cond:
+                self.log.append({
+                    "time": datetime.now().strftime("%H:%M:%S"),
+                    "rpm": step["rpm"],
+                    "offset": step["best_offset"],
+                    "hours": step["hours"],
+                    "explanation": step["explanation"],
+                    "resp": resp,
+                })
+            logging.info(f"區段 {index + 1}/{len(self.plan)}：RPM {step['rpm']} → Offset={step['best_offset']}，回應：{resp}")
+
+            if not self._wait_segment(step["hours"] * 3600.0 * self.time_scale):
+                return
+
+        with self._cond:
+            if self.state == ABORTED:
+                return
+            self.state = DONE
+            self.current_index = None
+        logging.info("NC 自動調整全部區段完成")
+
+    # ───────── 進度 ─────────
+    def snapshot(self) -> dict:
+        """回傳目前進度的複本（狀態、目前區段、區段剩餘秒數、已完成比例與紀錄）。"""
+        with self._cond:
+            total_s = sum(step["hours"] for step in self.plan) * 3600.0 * self.time_scale
+            done_s = 0.0
+            if self.state == DONE:
+                done_s = total_s
+            elif self.current_index is not None:
+                done_s = sum(step["hours"] for step in self.plan[:self.current_index + 1]) \
+                    * 3600.0 * self.time_scale - self._remaining_s()
+            return {
+                "state": self.state,
+                "current_index": self.current_index,
+                "current_step": self.plan[self.current_index] if self.current_index is not None else None,
+                "step_remaining_s": self._remaining_s(),
+                "progress": (done_s / total_s) if total_s > 0 else (1.0 if self.state == DONE else 0.0),
+                "total_steps": len(self.plan),
+                "log": list(self.log),
+            }
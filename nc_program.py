@@ -0,0 +1,58 @@
+import re
+from collections import defaultdict
+
+_RPM_PATTERN = re.compile(r'\bS(\d+)', re.IGNORECASE)
+_DWELL_PATTERN = re.compile(r'G04\s+F(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+
+def _read_uploaded_text(uploaded_file) -> str:
+    # 為確保檔案指標在開頭，重新定位
+    uploaded_file.seek(0)
+    return uploaded_file.read().decode('utf-8')
+
+
+def parse_nc_segments(content: str):
+    """
+    依 NC 程式的實際順序解析轉速區段。
+    每個區段為 dict(rpm, hours, start_hours)：連續同轉速的延遲時間 (G04 Fxxxx.) 會合併，
+    start_hours 為該區段在程式時間軸上的起點（小時）。
+    """
+    segments = []
+    current_rpm = None
+    elapsed_hours = 0.0
+
+    for line in content.splitlines():
+        line = line.strip()
+        # 解析 RPM：尋找 S後接數字，如 S1200
+        rpm_match = _RPM_PATTERN.search(line)
+        if rpm_match:
+            current_rpm = int(rpm_match.group(1))
+        # 解析延遲時間：尋找 G04 Fxxxx.，單位為秒，轉換成小時
+        dwell_match = _DWELL_PATTERN.search(line)
+        if dwell_match and current_rpm is not None:
+            delay_hours = float(dwell_match.group(1)) / 3600.0
+            if segments and segments[-1]["rpm"] == current_rpm:
+                segments[-1]["hours"] += delay_hours
+            else:
+                segments.append({"rpm": current_rpm, "hours": delay_hours,
+                                 "start_hours": elapsed_hours})
+            elapsed_hours += delay_hours
+
+    return segments
+
+
+def parse_nc_code_file(uploaded_file):
+    """
+    從上傳的 txt 檔案讀取 NC code，
+    解析出每一行中的 RPM (Sxxxx) 與延遲時間指令 (G04 Fxxxx.)
+    將延遲時間（秒）轉換成小時後累計，回傳字典 (key: RPM, value: 小時數)
+    """
+    rpm_durations = defaultdict(float)
+    for segment in parse_nc_segments(_read_uploaded_text(uploaded_file)):
+        rpm_durations[segment["rpm"]] += segment["hours"]
+    return rpm_durations
+
+
+def parse_nc_timeline_file(uploaded_file):
+    """從上傳的 txt 檔案解析依程式順序排列的轉速區段，見 parse_nc_segments。"""
+    return parse_nc_segments(_read_uploaded_text(uploaded_file))
@@ -0,0 +1,398 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import histogram
+from profiling import profile_scope
+
+DEFAULT_OLLAMA_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+DEFAULT_MODEL_NAME = os.environ.get("OLLAMA_MODEL", "llama3.2")
+# 模型常駐時間；Ollama 預設 5 分鐘，閒置稍久就得重新載入
+DEFAULT_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# 允許 Ollama 常駐模型的記憶體上限（MB），未設定則不限制
+DEFAULT_MAX_RESIDENT_MB = os.environ.get("OLLAMA_MAX_RESIDENT_MB")
+
+
+def keep_alive_to_seconds(keep_alive):
+    """將 Ollama 的 keep_alive 參數（如 "30m"、"1h"、300、-1）換算為秒數；-1 代表永久常駐。"""
+    if keep_alive is None:
+        return 5 * 60
+    if isinstance(keep_alive, (int, float)):
+        return float(keep_alive)
+    text = str(keep_alive).strip().lower()
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    for suffix in ("ms", "s", "m", "h"):
+        if text.endswith(suffix):
+            return float(text[:-len(suffix)]) * units[suffix]
+    return float(text)
+
+
+class OllamaSessionManager:
+    """
+    管理本機 Ollama 模型的工作階段：
+    - 啟動時預熱模型（送出空 prompt 讓 Ollama 先把權重載入記憶體）
+    - 每次呼叫都帶上 keep_alive，讓模型在閒置期間維持常駐
+    - 依記憶體上限卸載其他常駐模型，或縮短本模型的 keep_alive
+    - 記錄冷啟動與熱呼叫延遲，供介面與 CLI 報告
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME,
+                 base_url: str = DEFAULT_OLLAMA_URL,
+                 keep_alive=DEFAULT_KEEP_ALIVE,
+                 max_resident_mb: float = None,
+                 temperature: float = 0,
+                 request_timeout: float = 120.0):
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.keep_alive = keep_alive
+        if max_resident_mb is None and DEFAULT_MAX_RESIDENT_MB:
+            max_resident_mb = float(DEFAULT_MAX_RESIDENT_MB)
+        self.max_resident_mb = max_resident_mb
+        self.temperature = temperature
+        self.request_timeout = request_timeout
+
+        self._lock = threading.Lock()
+        self._tool_model = None
+        self._chat_model = None
+        self._prewarm_thread = None
+        self._last_used = None
+        self.cold_start_s = None
+        self.invoke_latencies = {"cold": [], "warm": []}
+        self.prompt_evals = []   # [(prompt tokens, prompt eval 秒數)]，取自 Ollama 回應
+
+    # ───────── Ollama REST 呼叫 ─────────
+    def _request(self, path: str, payload: dict = None, timeout: float = None):
+        url = f"{self.base_url}{path}"
+        data = None
+        method = "GET"
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            method = "POST"
+        req = urllib.request.Request(url, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=timeout or self.request_timeout) as resp:
+            body = resp.read().decode("utf-8")
+        return json.loads(body) if body else {}
+
+    def resident_models(self):
+        """回傳目前常駐於 Ollama 的模型列表（/api/ps）。"""
+        try:
+            return self._request("/api/ps").get("models", [])
+        except Exception as e:
+            logging.warning(f"查詢 Ollama 常駐模型失敗: {e}")
+            return []
+
+    def unload(self, model_name: str = None):
+        """要求 Ollama 立即卸載指定模型（keep_alive=0）。"""
+        name = model_name or self.model_name
+        try:
+            self._request("/api/generate", {"model": name, "keep_alive": 0})
+            logging.info(f"已卸載 Ollama 模型: {name}")
+        except Exception as e:
+            logging.warning(f"卸載 Ollama 模型 {name} 失敗: {e}")
+
+    def _is_own_model(self, entry: dict) -> bool:
+        name = entry.get("name") or entry.get("model") or ""
+        return name == self.model_name or name.split(":")[0] == self.model_name.split(":")[0]
+
+    def enforce_memory_limit(self):
+        """
+        依 max_resident_mb 控制常駐記憶體：先卸載其他模型騰出空間，
+        若本模型單獨仍超過上限，則把 keep_alive 縮短為 1 分鐘，用完即釋放。
+        """
+        if not self.max_resident_mb:
+            return
+        models = self.resident_models()
+        limit_bytes = self.max_resident_mb * 1024 * 1024
+        total = sum(m.get("size", 0) for m in models)
+        if total <= limit_bytes:
+            return
+        for entry in models:
+            if not self._is_own_model(entry):
+                self.unload(entry.get("name") or entry.get("model"))
+                total -= entry.get("size", 0)
+        own_size = sum(m.get("size", 0) for m in models if self._is_own_model(m))
+        if own_size > limit_bytes:
+            logging.warning(
+                f"模型 {self.model_name} 佔用 {own_size / 1024 / 1024:.0f} MB，"
+                f"超過上限 {self.max_resident_mb:.0f} MB，keep_alive 改為 1m"
+            )
+            self.set_keep_alive("1m")
+
+    def set_keep_alive(self, keep_alive):
+        """
+        變更 keep_alive；已建立的 LangChain 模型在建立時就固定了 keep_alive，
+        因此一併捨棄，下次 tool_model()／chat_model() 會以新值重建。
+        """
+        with self._lock:
+            if keep_alive == self.keep_alive:
+                return
+            self.keep_alive = keep_alive
+            self._tool_model = None
+            self._chat_model = None
+        logging.info(f"Ollama keep_alive 改為 {keep_alive}，模型用戶端將重建")
+
+    # ───────── 預熱 ─────────
+    def prewarm(self):
+        """
+        送出空 prompt 讓 Ollama 載入模型權重並以 keep_alive 常駐。
+        第一次呼叫的耗時記為冷啟動延遲，緊接著再量一次熱延遲。
+        """
+        payload = {"model": self.model_name, "prompt": "", "keep_alive": self.keep_alive}
+        try:
+            start = time.perf_counter()
+            self._request("/api/generate", payload)
+            self.cold_start_s = time.perf_counter() - start
+            logging.info(f"Ollama 模型 {self.model_name} 預熱完成，冷啟動 {self.cold_start_s:.3f}s")
+
+            start = time.perf_counter()
+            self._request("/api/generate", payload)
+            self.invoke_latencies["warm"].append(time.perf_counter() - start)
+            self._last_used = time.monotonic()
+            self.enforce_memory_limit()
+            return True
+        except Exception as e:
+            logging.error(f"Ollama 模型預熱失敗: {e}")
+            return False
+
+    def prewarm_async(self):
+        """在背景執行緒預熱，避免阻塞 Streamlit 首次繪製。"""
+        with self._lock:
+            if self._prewarm_thread is not None:
+                return self._prewarm_thread
+            self._prewarm_thread = threading.Thread(target=self.prewarm, daemon=True)
+            self._prewarm_thread.start()
+            return self._prewarm_thread
+
+    # ───────── LangChain 模型 ─────────
+    def tool_model(self, tools):
+        """回傳綁定工具的 OllamaFunctions（同一工作階段只建立一次）。"""
+        with self._lock:
+            if self._tool_model is None:
+                from langchain_experimental.llms.ollama_functions import OllamaFunctions
+                model = OllamaFunctions(model=self.model_name, base_url=self.base_url,
+                                        format="json", temperature=self.temperature,
+                                        keep_alive=self.keep_alive)
+                self._tool_model = model.bind_tools(tools=tools)
+            return self._tool_model
+
+    def chat_model(self):
+        """回傳一般對話用的 ChatOllama（同一工作階段只建立一次）。"""
+        with self._lock:
+            if self._chat_model is None:
+                from langchain_ollama import ChatOllama
+                self._chat_model = ChatOllama(model=self.model_name, base_url=self.base_url,
+                                              temperature=self.temperature,
+                                              keep_alive=self.keep_alive)
+            return self._chat_model
+
+    def invoke(self, model, messages):
+        """呼叫模型並依距上次使用的閒置時間，將延遲歸類為冷或熱呼叫。"""
+        idle_limit = keep_alive_to_seconds(self.keep_alive)
+        cold = (self._last_used is None or
+                (idle_limit >= 0 and time.monotonic() - self._last_used > idle_limit))
+        start = time.perf_counter()
+        try:
+            with profile_scope("llm"):
+                result = model.invoke(messages)
+            self.record_prompt_eval(result)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            self.invoke_latencies["cold" if cold else "warm"].append(elapsed)
+            histogram("cooler_llm_invoke_seconds", "LLM 呼叫耗時",
+                      start="cold" if cold else "warm").observe(elapsed)
+            self._last_used = time.monotonic()
+            logging.info(f"LLM 呼叫耗時 {elapsed:.3f}s（{'冷' if cold else '熱'}）")
+
+    def record_prompt_eval(self, result):
+        """
+        從 Ollama 回應的 response_metadata 取出 prompt_eval_count 與 prompt_eval_duration（奈秒），
+        回傳 (tokens, 秒數)；沒有這些欄位（例如工具模型的回應）時回傳 None。
+        """
+        metadata = getattr(result, "response_metadata", None) or {}
+        tokens = metadata.get("prompt_eval_count")
+        if tokens is None:
+            return None
+        seconds = metadata.get("prompt_eval_duration", 0) / 1e9
+        self.prompt_evals.append((tokens, seconds))
+        histogram("cooler_llm_prompt_tokens", "LLM prompt token 數",
+                  buckets=(64, 128, 256, 512, 1024, 2048, 4096)).observe(tokens)
+        histogram("cooler_llm_prompt_eval_seconds", "LLM prompt eval 耗時").observe(seconds)
+        logging.info(f"prompt {tokens} tokens，prompt eval {seconds:.3f}s")
+        return tokens, seconds
+
+    # ───────── 報告 ─────────
+    def latency_report(self) -> dict:
+        """彙整冷啟動與熱呼叫延遲（秒）。"""
+        def summary(values, unit="s"):
+            if not values:
+                return {"count": 0}
+            ordered = sorted(values)
+            return {
+                "count": len(ordered),
+                f"mean_{unit}": sum(ordered) / len(ordered),
+                f"p50_{unit}": ordered[len(ordered) // 2],
+                f"max_{unit}": ordered[-1],
+            }
+
+        return {
+            "model": self.model_name,
+            "keep_alive": self.keep_alive,
+            "cold_start_s": self.cold_start_s,
+            "cold_invokes": summary(self.invoke_latencies["cold"]),
+            "warm_invokes": summary(self.invoke_latencies["warm"]),
+            "prompt_tokens": summary([tokens for tokens, _ in self.prompt_evals], unit="tokens"),
+            "prompt_eval": summary([seconds for _, seconds in self.prompt_evals]),
+        }
+
+
+# -----------------------------
+# 測試用：本機 Ollama 替身伺服器
+# -----------------------------
+class OllamaStandInServer:
+    """
+    模擬 Ollama REST API 的最小伺服器，供測試預熱與 keep_alive 行為。
+    首次載入模型會延遲 load_delay 秒，keep_alive 逾時後自動「卸載」。
+    支援 /api/generate、/api/chat、/api/ps、/api/tags。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 load_delay: float = 1.0, response_delay: float = 0.05,
+                 model_size_mb: float = 2048):
+        self.load_delay = load_delay
+        self.response_delay = response_delay
+        self.model_size = int(model_size_mb * 1024 * 1024)
+        self._loaded = {}  # model -> expires_at (monotonic，None 代表永久)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _touch(self, model: str, keep_alive):
+        """載入（必要時模擬延遲）並更新模型到期時間。"""
+        with self._lock:
+            now = time.monotonic()
+            expires = self._loaded.get(model, 0)
+            loaded = model in self._loaded and (expires is None or expires > now)
+        if not loaded:
+            time.sleep(self.load_delay)
+        seconds = keep_alive_to_seconds(keep_alive)
+        with self._lock:
+            if seconds == 0:
+                self._loaded.pop(model, None)
+            else:
+                self._loaded[model] = None if seconds < 0 else time.monotonic() + seconds
+
+    def _resident(self):
+        now = time.monotonic()
+        with self._lock:
+            return [name for name, exp in self._loaded.items() if exp is None or exp > now]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, payload: dict, status: int = 200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/ps":
+                    self._reply({"models": [
+                        {"name": m, "model": m, "size": server.model_size}
+                        for m in server._resident()
+                    ]})
+                elif self.path == "/api/tags":
+                    self._reply({"models": [{"name": m} for m in server._resident()]})
+                else:
+                    self._reply({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                model = payload.get("model", "")
+                keep_alive = payload.get("keep_alive", "5m")
+                if self.path not in ("/api/generate", "/api/chat"):
+                    self._reply({"error": "not found"}, status=404)
+                    return
+                if keep_alive_to_seconds(keep_alive) == 0 and not payload.get("prompt") \
+                        and not payload.get("messages"):
+                    server._touch(model, 0)
+                    self._reply({"model": model, "done": True, "done_reason": "unload"})
+                    return
+                server._touch(model, keep_alive)
+                if payload.get("prompt") or payload.get("messages"):
+                    time.sleep(server.response_delay)
+                if self.path == "/api/chat":
+                    self._reply({"model": model, "done": True,
+                                 "message": {"role": "assistant", "content": "{}"}})
+                else:
+                    self._reply({"model": model, "done": True, "response": ""})
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"Ollama 替身伺服器啟動於 {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預熱 Ollama 模型並回報冷啟動／熱呼叫延遲")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--base-url", default=DEFAULT_OLLAMA_URL)
+    parser.add_argument("--keep-alive", default=DEFAULT_KEEP_ALIVE)
+    parser.add_argument("--max-resident-mb", type=float, default=None)
+    parser.add_argument("--stand-in", action="store_true",
+                        help="改用本機替身伺服器（不需安裝 Ollama）")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    stand_in = OllamaStandInServer().start() if args.stand_in else None
+    try:
+        session = OllamaSessionManager(
+            model_name=args.model,
+            base_url=stand_in.url if stand_in else args.base_url,
+            keep_alive=args.keep_alive,
+            max_resident_mb=args.max_resident_mb,
+        )
+        ok = session.prewarm()
+        print(json.dumps(session.latency_report(), ensure_ascii=False, indent=2))
+        return 0 if ok else 1
+    finally:
+        if stand_in:
+            stand_in.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""
+以生產資料增量更新能耗／誤差模型。
+
+每個目標（CoolerPower、MachinePower、AvgError、MaxError）保存其多項式 Ridge
+擬合的充分統計量：樣本數、特徵與目標平均值、中心化的 XᵀX 與 Xᵀy（co-moment）。
+新資料以 Chan 的合併公式併入，每筆只需 O(p²)，不必保留或重跑全部歷史資料；
+由統計量即可還原與批次訓練相同的 PolynomialFeatures → StandardScaler → Ridge 管線。
+
+生產紀錄存放在 temperature_log.db 的 production_runs 資料表：每次加工的 RPM、時數、
+量測的功耗與誤差；TempOffset 未填時以該時段 temperature_log 的平均設定溫度補上。
+
+init 發佈的版本附帶以訓練資料建立的預測區間集成（uncertainty.py）；update 只有統計量、
+無法重新 bootstrap，因此沿用前一版本的集成，新生產紀錄的範圍需以 uncertainty.py build 重建後才納入。
+
+    python online_learning.py init --data Cooling_Machine_Data_EN.csv [--report validation_report.json]
+    python online_learning.py add-run --start "2025-01-01 08:00:00" --end "2025-01-01 10:00:00" \\
+        --rpm 6000 --hour 2 --cooler-power 2050 --machine-power 4300 --avg-error -5.1 --max-error -9.8
+    python online_learning.py update
+    python online_learning.py status
+"""
+import os
+import json
+import logging
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from joblib import dump, load
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.linear_model import Ridge
+
+import model_store
+import temperature_store
+import uncertainty
+from training_dataset import (
+    FEATURES, ENERGY_TARGETS, ERROR_TARGETS, TARGETS, BASELINE_PARAMS, load_and_preprocess,
+)
+
+STATE_FILE = "online_state.joblib"
+
+
+# -----------------------------
+# 充分統計量
+# -----------------------------
+class TargetStats:
+    """單一目標的多項式 Ridge 充分統計量。"""
+
+    def __init__(self, degree: int, alpha: float):
+        self.degree = degree
+        self.alpha = alpha
+        self._poly = PolynomialFeatures(degree=degree, include_bias=True).fit(
+            pd.DataFrame(np.zeros((1, len(FEATURES))), columns=FEATURES))
+        p = self._poly.n_output_features_
+        self.n = 0
+        self.mean_x = np.zeros(p)
+        self.mean_y = 0.0
+        self.m_xx = np.zeros((p, p))   # Σ (φ - φ̄)(φ - φ̄)ᵀ
+        self.m_xy = np.zeros(p)        # Σ (φ - φ̄)(y - ȳ)
+
+    def partial_fit(self, X: pd.DataFrame, y):
+        """以 Chan 合併公式併入一批資料。"""
+        phi = self._poly.transform(X[FEATURES])
+        y = np.asarray(y, dtype=float)
+        n_b = len(y)
+        if n_b == 0:
+            return self
+        mean_xb = phi.mean(axis=0)
+        mean_yb = y.mean()
+        centered = phi - mean_xb
+        m_xxb = centered.T @ centered
+        m_xyb = centered.T @ (y - mean_yb)
+
+        n_a = self.n
+        n = n_a + n_b
+        dx = mean_xb - self.mean_x
+        dy = mean_yb - self.mean_y
+        weight = n_a * n_b / n
+        self.m_xx += m_xxb + np.outer(dx, dx) * weight
+        self.m_xy += m_xyb + dx * dy * weight
+        self.mean_x += dx * n_b / n
+        self.mean_y += dy * n_b / n
+        self.n = n
+        return self
+
+    def to_pipeline(self):
+        """由統計量還原已擬合的 PolynomialFeatures → StandardScaler → Ridge 管線。"""
+        var = np.diag(self.m_xx) / self.n
+        scale = np.sqrt(var)
+        # 與 StandardScaler 相同：變異數近乎 0 的欄位（例如 bias）不縮放
+        scale[scale < 10 * np.finfo(float).eps * np.maximum(1.0, np.abs(self.mean_x))] = 1.0
+
+        scaler = StandardScaler()
+        scaler.mean_, scaler.var_, scaler.scale_ = self.mean_x.copy(), var, scale
+        scaler.n_samples_seen_ = self.n
+        scaler.n_features_in_ = len(scale)
+
+        # 標準化後的特徵已中心化：(D⁻¹ M_xx D⁻¹ + αI) w = D⁻¹ M_xy，截距即 ȳ
+        inv_scale = 1.0 / scale
+        gram = self.m_xx * np.outer(inv_scale, inv_scale)
+        coef = np.linalg.solve(gram + self.alpha * np.eye(len(scale)), self.m_xy * inv_scale)
+
+        ridge = Ridge(alpha=self.alpha)
+        ridge.coef_, ridge.intercept_ = coef, self.mean_y
+        ridge.n_features_in_ = len(scale)
+
+        return make_pipeline(self._poly, scaler, ridge)
+
+
+class OnlineModelState:
+    """所有目標的統計量，以及已併入的生產紀錄 id。"""
+
+    def __init__(self, params: dict):
+        self.targets = {t: TargetStats(params[t]["degree"], params[t]["alpha"]) for t in TARGETS}
+        self.ingested_run_ids = set()
+        self.history = []    # [(時間, 新增筆數, 發佈版本)]
+
+    @property
+    def n_samples(self) -> int:
+        return self.targets[TARGETS[0]].n
+
+    def partial_fit(self, df: pd.DataFrame):
+        for target, stats in self.targets.items():
+            stats.partial_fit(df, df[target])
+        return self
+
+    def build_models(self):
+        """組成與 training_dataset 相同介面的 (energy_model, error_model)。"""
+        return self._multioutput(ENERGY_TARGETS), self._multioutput(ERROR_TARGETS)
+
+    def _multioutput(self, targets):
+        estimators = [self.targets[t].to_pipeline() for t in targets]
+        model = MultiOutputRegressor(estimators[0])
+        model.estimators_ = estimators
+        model.n_features_in_ = len(FEATURES)
+        model.feature_names_in_ = np.array(FEATURES, dtype=object)
+        return model
+
+    def params(self) -> dict:
+        return {t: {"degree": s.degree, "alpha": s.alpha} for t, s in self.targets.items()}
+
+    # ───────── 存取 ─────────
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str):
+        return load(path)
+
+
+def load_search_params(report_path: str = None) -> dict:
+    """讀取 training_dataset --search 產生的最佳參數；未提供時用原本固定的設定。"""
+    if report_path:
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+        return {t: {"degree": report["targets"][t]["degree"], "alpha": report["targets"][t]["alpha"]}
+                for t in TARGETS}
+    return {t: {"degree": d, "alpha": a} for t, (d, a) in BASELINE_PARAMS.items()}
+
+
+# -----------------------------
+# 生產紀錄
+# -----------------------------
+def ensure_production_schema(conn):
+    """建立 production_runs 資料表（如果尚未存在的話）"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS production_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            rpm REAL NOT NULL,
+            hour REAL NOT NULL,
+            temp_offset REAL,
+            cooler_power REAL NOT NULL,
+            machine_power REAL NOT NULL,
+            avg_error REAL NOT NULL,
+            max_error REAL NOT NULL,
+            model_version TEXT
+        )
+    ''')
+    conn.commit()
+
+
+def add_production_run(conn, start_time: str, end_time: str, rpm: float, hour: float,
+                       cooler_power: float, machine_power: float, avg_error: float, max_error: float,
+                       temp_offset: float = None) -> int:
+    ensure_production_schema(conn)
+    cursor = conn.execute(
+        "INSERT INTO production_runs (start_time, end_time, rpm, hour, temp_offset, "
+        "cooler_power, machine_power, avg_error, max_error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (start_time, end_time, rpm, hour, temp_offset, cooler_power, machine_power, avg_error, max_error),
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def fetch_pending_runs(conn, exclude_ids=()):
+    """
+    取出尚未併入模型的生產紀錄，欄位名稱與訓練資料相同。
+    TempOffset 未填時以該時段 temperature_log 的平均設定溫度補上；
+    兩者都沒有的紀錄無法使用，另外回傳其 id。
+    """
+    ensure_production_schema(conn)
+    temperature_store.ensure_schema(conn)
+    df = pd.read_sql_query('''
+        SELECT r.id, r.rpm AS RPM, r.hour AS Hour,
+               COALESCE(r.temp_offset, (
+                   SELECT AVG(t.set_temperature) FROM temperature_log t
+                   WHERE t.timestamp >= r.start_time AND t.timestamp <= r.end_time
+               )) AS TempOffset,
+               r.cooler_power AS CoolerPower, r.machine_power AS MachinePower,
+               r.avg_error AS AvgError, r.max_error AS MaxError
+        FROM production_runs r
+        WHERE r.model_version IS NULL
+        ORDER BY r.id
+    ''', conn)
+    df = df[~df["id"].isin(list(exclude_ids))]
+    unusable = df[df["TempOffset"].isna()]
+    return df.dropna(subset=["TempOffset"]), unusable["id"].tolist()
+
+
+def update_from_production(state_path: str, db_path: str = None, model_dir: str = None):
+    """併入新的生產紀錄並發佈新版本模型；沒有新資料時回傳 None。"""
+    state = OnlineModelState.load(state_path)
+    conn = temperature_store.connect(db_path)
+    try:
+        runs, unusable = fetch_pending_runs(conn, state.ingested_run_ids)
+        if unusable:
+            logging.warning(f"⚠️ 生產紀錄缺少 TempOffset 且該時段無溫度記錄，略過: {unusable}")
+        if runs.empty:
+            logging.info("沒有新的生產紀錄")
+            return None
+
+        state.partial_fit(runs)
+        energy_model, error_model = state.build_models()
+        # 集成需要原始訓練資料才能重新抽樣；沿用前一版本的集成，確保新版本仍有信心檢查
+        previous_energy_path, _ = model_store.resolve_model_paths(model_dir=model_dir)
+        ensemble = uncertainty.load_ensemble(previous_energy_path)
+        artifacts = {model_store.ENSEMBLE_FILE: ensemble} if ensemble is not None else {}
+        if ensemble is not None:
+            logging.info("沿用前一版本的預測區間集成；新生產紀錄的範圍需執行 uncertainty.py build 後才納入")
+        version = model_store.publish(energy_model, error_model, {
+            "source": "online_update",
+            "n_samples": state.n_samples,
+            "new_runs": runs["id"].tolist(),
+            "params": state.params(),
+            "ensemble": "copied" if ensemble is not None else None,
+        }, model_dir=model_dir, extra_artifacts=artifacts)
+
+        # 先保存統計量再標記資料庫；中途中斷時 ingested_run_ids 可避免重複併入
+        state.ingested_run_ids.update(int(i) for i in runs["id"])
+        state.history.append((datetime.now().isoformat(timespec="seconds"), len(runs), version))
+        state.save(state_path)
+        conn.executemany("UPDATE production_runs SET model_version = ? WHERE id = ?",
+                         [(version, int(i)) for i in runs["id"]])
+        conn.commit()
+        logging.info(f"✅ 併入 {len(runs)} 筆生產紀錄（累計 {state.n_samples} 筆），發佈 {version}")
+        return version
+    finally:
+        conn.close()
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="以生產資料增量更新冷卻機模型")
+    parser.add_argument("--model-dir", default=model_store.MODEL_DIR)
+    parser.add_argument("--db", default=temperature_store.DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_init = sub.add_parser("init", help="以訓練資料建立初始統計量並發佈第一個版本")
+    p_init.add_argument("--data", nargs="+", required=True, help="訓練資料檔或目錄")
+    p_init.add_argument("--report", help="training_dataset --search 的 validation_report.json")
+    p_init.add_argument("--ensemble-members", type=int, default=uncertainty.DEFAULT_MEMBERS,
+                        help="同時建立的預測區間集成成員數；0 為不建立")
+
+    p_run = sub.add_parser("add-run", help="新增一筆生產紀錄")
+    p_run.add_argument("--start", required=True, help="YYYY-MM-DD HH:MM:SS")
+    p_run.add_argument("--end", required=True, help="YYYY-MM-DD HH:MM:SS")
+    p_run.add_argument("--rpm", type=float, required=True)
+    p_run.add_argument("--hour", type=float, required=True)
+    p_run.add_argument("--temp-offset", type=float, help="未提供時以該時段平均設定溫度計算")
+    for name in ("cooler-power", "machine-power", "avg-error", "max-error"):
+        p_run.add_argument(f"--{name}", type=float, required=True)
+
+    sub.add_parser("update", help="併入新的生產紀錄並發佈新版本")
+    sub.add_parser("status", help="顯示目前版本與統計量")
+    args = parser.parse_args()
+
+    state_path = os.path.join(args.model_dir, STATE_FILE)
+
+    if args.command == "init":
+        df = load_and_preprocess(args.data)
+        # 以模組名稱引用類別，避免以腳本執行時被 pickle 成 __main__.OnlineModelState
+        from online_learning import OnlineModelState as State
+        state = State(load_search_params(args.report)).partial_fit(df)
+        energy_model, error_model = state.build_models()
+        artifacts = {}
+        if args.ensemble_members > 0:
+            artifacts[model_store.ENSEMBLE_FILE] = uncertainty.BootstrapEnsemble(
+                state.params(), n_members=args.ensemble_members).fit(df)
+        version = model_store.publish(energy_model, error_model, {
+            "source": [os.path.basename(p) for p in args.data], "n_samples": state.n_samples, "params": state.params(),
+            "ensemble": "built" if artifacts else None,
+        }, model_dir=args.model_dir, extra_artifacts=artifacts)
+        state.history.append((datetime.now().isoformat(timespec="seconds"), len(df), version))
+        state.save(state_path)
+        print(f"已以 {len(df)} 筆訓練資料建立統計量並發佈 {version}")
+
+    elif args.command == "add-run":
+        conn = temperature_store.connect(args.db)
+        try:
+            run_id = add_production_run(
+                conn, args.start, args.end, args.rpm, args.hour, args.cooler_power,
+                args.machine_power, args.avg_error, args.max_error, args.temp_offset)
+        finally:
+            conn.close()
+        print(f"已新增生產紀錄 #{run_id}")
+
+    elif args.command == "update":
+        version = update_from_production(state_path, args.db, args.model_dir)
+        print(f"已發佈 {version}" if version else "沒有新的生產紀錄")
+
+    elif args.command == "status":
+        pointer = model_store.current_version(args.model_dir)
+        print(f"目前版本: {pointer['version'] if pointer else '（未發佈，使用工作目錄模型檔）'}")
+        if os.path.exists(state_path):
+            state = OnlineModelState.load(state_path)
+            print(f"累計樣本數: {state.n_samples}，已併入生產紀錄: {len(state.ingested_run_ids)} 筆")
+            for target, p in state.params().items():
+                print(f"  {target:<13} degree={p['degree']} alpha={p['alpha']}")
+            for when, count, version in state.history[-5:]:
+                print(f"  {when}  +{count} 筆 → {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+本機最佳化服務：獨佔模型，並把同時到達的請求合併成一次向量化的批次計算。
+
+各個 Streamlit session 與 NC 分析原本各自載入模型、各自跑 Optuna 搜尋。
+這裡由單一行程持有模型；幾毫秒內到達的 (rpm, hour) 請求會合併（相同參數只算一次），
+交給 temp_optimizer.find_optimal_temp_offsets_batch 以一次矩陣預測處理整批，
+因此併發負載下的吞吐量隨批次大小成長，而不是隨請求數線性增加耗時。
+
+    python optimizer_service.py serve --port 8765
+    python optimizer_service.py bench --concurrency 32 --requests 512
+
+HTTP 介面：
+    POST /optimize  {"rpm": 6000, "hour": 2}               → {"explanation", "offset", "confidence"}
+    POST /optimize  {"requests": [{"rpm": ..., "hour": ...}, ...]} → {"results": [...]}
+    GET  /health                                           → 批次統計
+
+voice_app2 設定 COOLER_OPTIMIZER_URL=http://127.0.0.1:8765 後改由此服務計算（無法連線時退回本機）。
+"""
+import json
+import time
+import queue
+import random
+import logging
+import argparse
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import counter, histogram
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+# 允許由請求指定的最佳化參數；其他欄位忽略
+OPTION_FIELDS = ("offset_min", "offset_max", "offset_step", "coverage", "max_relative_width")
+
+
+def parse_request(request) -> tuple:
+    """檢查單一請求並回傳 (rpm, hour, options)；格式錯誤時拋出 KeyError／ValueError／TypeError。"""
+    if not isinstance(request, dict):
+        raise TypeError("每個請求須為 JSON 物件")
+    options = {name: float(request[name]) for name in OPTION_FIELDS if request.get(name) is not None}
+    return float(request["rpm"]), float(request["hour"]), options
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128    # 併發請求較多時避免 listen backlog 溢位而被重設連線
+
+
+class RequestBatcher:
+    """
+    收集請求並分批交給 evaluate_fn(pairs, options) → 結果列表。
+    第一個請求到達後最多再等 max_wait_ms 或湊滿 max_batch；
+    相同 (rpm, hour, options) 的請求共用同一個計算結果，不同 options 分組計算。
+    """
+
+    def __init__(self, evaluate_fn, max_batch: int = DEFAULT_MAX_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.evaluate_fn = evaluate_fn
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self.stats = {"requests": 0, "batches": 0, "evaluated": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="optimizer-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, rpm: float, hour: float, options: dict = None) -> Future:
+        future = Future()
+        key = (float(rpm), float(hour), tuple(sorted((options or {}).items())))
+        self._queue.put((key, future))
+        return future
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)   # 處理完這批後再結束
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            groups = OrderedDict()      # options -> {(rpm, hour): [future, ...]}
+            for (rpm, hour, options), future in batch:
+                groups.setdefault(options, OrderedDict()).setdefault((rpm, hour), []).append(future)
+
+            for options, by_pair in groups.items():
+                pairs = list(by_pair)
+                try:
+                    results = self.evaluate_fn(pairs, dict(options))
+                except Exception as e:
+                    logging.error(f"批次最佳化失敗: {e}")
+                    for futures in by_pair.values():
+                        for future in futures:
+                            future.set_exception(e)
+                    continue
+                for futures, result in zip(by_pair.values(), results):
+                    for future in futures:
+                        future.set_result(result)
+                self.stats["evaluated"] += len(pairs)
+
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            histogram("cooler_optimizer_service_batch_size", "最佳化服務每批請求數",
+                      buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)).observe(len(batch))
+            counter("cooler_optimizer_service_requests_total", "最佳化服務請求數").inc(len(batch))
+
+
+class OptimizerService:
+    """持有模型的 HTTP 服務；serve_forever() 阻塞執行，start_in_thread() 供測試與基準使用。"""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 max_batch: int = DEFAULT_MAX_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 energy_model_path: str = None, error_model_path: str = None, request_timeout: float = 60.0):
+        from temp_optimizer import find_optimal_temp_offsets_batch
+
+        self._batch_fn = find_optimal_temp_offsets_batch
+        self.energy_model_path = energy_model_path
+        self.error_model_path = error_model_path
+        self.request_timeout = request_timeout
+        self.batcher = RequestBatcher(self.evaluate, max_batch=max_batch, max_wait_ms=max_wait_ms)
+        self.httpd = _HTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def evaluate(self, pairs, options):
+        return self._batch_fn(pairs, energy_model_path=self.energy_model_path,
+                              error_model_path=self.error_model_path, **options)
+
+    def warm_up(self):
+        """啟動時先載入模型與集成，第一個請求不必等待。"""
+        start = time.perf_counter()
+        self.evaluate([(6000.0, 1.0)], {})
+        logging.info(f"🔥 模型預熱完成 {time.perf_counter() - start:.2f} s")
+
+    def optimize(self, request: dict) -> dict:
+        return self.optimize_many([parse_request(request)])[0]
+
+    def optimize_many(self, parsed) -> list:
+        """送出已檢查的 [(rpm, hour, options)]，全部進入同一批次佇列後等待結果。"""
+        futures = [self.batcher.submit(rpm, hour, options) for rpm, hour, options in parsed]
+        return [{"explanation": explanation, "offset": offset, "confidence": confidence}
+                for explanation, offset, confidence in
+                (future.result(timeout=self.request_timeout) for future in futures)]
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, payload: dict, status: int = 200):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    stats = dict(service.batcher.stats)
+                    stats["mean_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+                    self._reply({"status": "ok", **stats})
+                else:
+                    self._reply({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                if self.path != "/optimize":
+                    self._reply({"error": "not found"}, status=404)
+                    return
+                # 先檢查請求內容：只有格式錯誤回 400，批次計算失敗屬於服務端錯誤，回 500
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    many = isinstance(payload, dict) and "requests" in payload
+                    items = payload["requests"] if many else [payload]
+                    if not isinstance(items, list):
+                        raise TypeError("requests 須為陣列")
+                    parsed = [parse_request(item) for item in items]
+                except (KeyError, ValueError, TypeError) as e:
+                    self._reply({"error": f"bad request: {e}"}, status=400)
+                    return
+                try:
+                    # 同一呼叫中的多個請求也一併送進批次
+                    results = service.optimize_many(parsed)
+                except Exception as e:
+                    logging.error(f"最佳化請求失敗: {e}")
+                    self._reply({"error": str(e)}, status=500)
+                    return
+                self._reply({"results": results} if many else results[0])
+
+        return Handler
+
+    def serve_forever(self):
+        self.batcher.start()
+        logging.info(f"🚀 最佳化服務啟動於 {self.url}")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.batcher.stop()
+
+    def start_in_thread(self):
+        self.batcher.start()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="optimizer-service", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.batcher.stop()
+
+
+# -----------------------------
+# 用戶端
+# -----------------------------
+def optimize_remote(rpm: float, hour: float, url: str, timeout: float = 30.0, **options):
+    """向最佳化服務請求，回傳 (explanation, best_offset, confidence)；連線失敗時拋出例外。"""
+    payload = {"rpm": rpm, "hour": hour, **{k: v for k, v in options.items() if k in OPTION_FIELDS}}
+    request = urllib.request.Request(f"{url.rstrip('/')}/optimize", data=json.dumps(payload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        result = json.loads(response.read().decode("utf-8"))
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result["explanation"], result["offset"], result["confidence"]
+
+
+def run_benchmark(url: str, concurrency: int, n_requests: int, seed: int = 0) -> dict:
+    """以 concurrency 個執行緒同時送出 n_requests 個隨機 (rpm, hour) 請求，回傳吞吐量與延遲。"""
+    rng = random.Random(seed)
+    requests = [(rng.choice([1500, 3000, 6000, 9000, 12000]), rng.choice([1.0, 1.5, 2.0]))
+                for _ in range(n_requests)]
+    latencies = []
+
+    def call(pair):
+        start = time.perf_counter()
+        optimize_remote(*pair, url=url)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, requests))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"requests": n_requests, "seconds": elapsed, "throughput_rps": n_requests / elapsed,
+            "p50_ms": latencies[len(latencies) // 2] * 1000,
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="溫度偏差最佳化服務（請求批次合併）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "bench"):
+        p = sub.add_parser(name)
+        p.add_argument("--host", default=DEFAULT_HOST)
+        p.add_argument("--port", type=int, default=DEFAULT_PORT)
+        p.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+        p.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+        p.add_argument("--energy-model")
+        p.add_argument("--error-model")
+    p_bench = sub.choices["bench"]
+    p_bench.add_argument("--url", help="對既有服務測試；未指定時在本行程分別以批次與不批次啟動服務比較")
+    p_bench.add_argument("--concurrency", type=int, default=32)
+    p_bench.add_argument("--requests", type=int, default=512)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        service = OptimizerService(args.host, args.port, args.max_batch, args.max_wait_ms,
+                                   args.energy_model, args.error_model)
+        service.warm_up()
+        service.serve_forever()
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.url:
+        runs = [("service", args.url, None)]
+    else:
+        runs = []
+        for label, max_batch in (("no batching", 1), (f"max_batch={args.max_batch}", args.max_batch)):
+            service = OptimizerService(args.host, 0, max_batch, args.max_wait_ms,
+                                       args.energy_model, args.error_model)
+            service.warm_up()
+            runs.append((label, service.start_in_thread().url, service))
+    print(f"{'模式':<16} {'請求/秒':>10} {'p50 ms':>9} {'p95 ms':>9} {'平均批次':>8}")
+    for label, url, service in runs:
+        result = run_benchmark(url, args.concurrency, args.requests)
+        stats = service.batcher.stats if service else {}
+        mean_batch = stats["requests"] / stats["batches"] if stats.get("batches") else float("nan")
+        print(f"{label:<16} {result['throughput_rps']:>10.1f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {mean_batch:>8.1f}")
+        if service:
+            service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+溫度偏差的多目標 Pareto front。
+
+find_optimal_temp_offset 以 weight_rules 的固定權重把總能耗、AvgError、MaxError
+合成單一分數；換一種取捨就得重跑搜尋。這裡對給定的 (rpm, hour) 一次批次預測
+所有候選 offset，保留非支配解（Pareto front）並快取，
+之後任何權重或限制條件（例如「MaxError ≤ 20 µm 下能耗最低」）都只是從快取中挑選。
+
+    from pareto import select_offset
+    explanation, offset = select_offset(6000, 2, constraints={"MaxError": 20}, minimize="TotalPower")
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from metrics import timed
+from model_store import resolve_model_paths, load_model
+from temp_optimizer import weight_rules
+
+# 三個目標皆取「越小越好」：總能耗、|AvgError|、|MaxError|
+OBJECTIVES = ("TotalPower", "AvgError", "MaxError")
+OBJECTIVE_UNITS = {"TotalPower": "W", "AvgError": "μm", "MaxError": "μm"}
+
+_CACHE_MAX = 128
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ParetoFront:
+    """某個 (rpm, hour) 下所有候選 offset 的預測值，以及其中的非支配解。"""
+
+    def __init__(self, rpm: float, hour: float, offsets, predictions: pd.DataFrame):
+        self.rpm = rpm
+        self.hour = hour
+        self.points = predictions.assign(TempOffset=offsets)
+        values = self.objective_matrix(self.points)
+        self.front_mask = non_dominated_mask(values)
+
+    @staticmethod
+    def objective_matrix(points: pd.DataFrame) -> np.ndarray:
+        return np.column_stack([points["TotalPower"], points["AvgError"].abs(), points["MaxError"].abs()])
+
+    @property
+    def front(self) -> pd.DataFrame:
+        """非支配解，依 TempOffset 排序。"""
+        return self.points[self.front_mask].sort_values("TempOffset")
+
+    def select(self, weights: dict = None, constraints: dict = None, minimize: str = None):
+        """
+        從 front 挑一個 offset：
+          constraints — 各目標的上限（誤差以絕對值比較），例如 {"MaxError": 20}
+          minimize    — 在限制內最小化單一目標，例如 "TotalPower"
+          weights     — 未指定 minimize 時以加權和挑選；皆未指定則使用 weight_rules 的預設權重
+        無可行解時回傳 None。
+        """
+        candidates = self.front
+        for name, limit in (constraints or {}).items():
+            if name not in OBJECTIVES:
+                raise ValueError(f"未知的目標: {name}（可用: {', '.join(OBJECTIVES)}）")
+            candidates = candidates[candidates[name].abs() <= limit]
+        if candidates.empty:
+            return None
+
+        if minimize:
+            if minimize not in OBJECTIVES:
+                raise ValueError(f"未知的目標: {minimize}（可用: {', '.join(OBJECTIVES)}）")
+            score = candidates[minimize].abs()
+        else:
+            if weights is None:
+                w_avg, w_pow, w_max = weight_rules(self.rpm, self.hour)
+                weights = {"TotalPower": w_pow, "AvgError": w_avg, "MaxError": w_max}
+            score = sum(weights.get(name, 0.0) * candidates[name].abs() for name in OBJECTIVES)
+        return candidates.loc[score.idxmin()]
+
+
+def non_dominated_mask(values: np.ndarray) -> np.ndarray:
+    """values 為 (n_points, n_objectives)，皆為越小越好；以廣播一次比較所有點對。"""
+    no_worse = (values[:, None, :] >= values[None, :, :]).all(axis=2)
+    better = (values[:, None, :] > values[None, :, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=1)
+    return ~dominated
+
+
+def _model_key(energy_model_path, error_model_path):
+    return tuple((os.path.abspath(p), os.path.getmtime(p)) for p in (energy_model_path, error_model_path))
+
+
+@timed("cooler_pareto_seconds", "Pareto front 計算耗時")
+def compute_pareto_front(rpm: float, hour: float, energy_model, error_model,
+                         offset_min: float = 2.5, offset_max: float = 8.5, offset_step: float = 0.1):
+    """一次批次預測所有候選 offset，回傳 ParetoFront。"""
+    offsets = np.round(np.arange(offset_min, offset_max + offset_step / 2, offset_step), 6)
+    X = pd.DataFrame({"RPM": float(rpm), "Hour": float(hour), "TempOffset": offsets})
+    energy = energy_model.predict(X)
+    error = error_model.predict(X)
+    predictions = pd.DataFrame({
+        "CoolerPower": energy[:, 0], "MachinePower": energy[:, 1],
+        "TotalPower": energy[:, 0] + energy[:, 1],
+        "AvgError": error[:, 0], "MaxError": error[:, 1],
+    })
+    return ParetoFront(rpm, hour, offsets, predictions)
+
+
+def get_pareto_front(rpm: float, hour: float, *, energy_model_path: str = None, error_model_path: str = None,
+                     offset_min: float = 2.5, offset_max: float = 8.5, offset_step: float = 0.1) -> ParetoFront:
+    """取得 (rpm, hour) 的 Pareto front；模型檔更新（路徑或修改時間改變）時自動重算。"""
+    energy_model_path, error_model_path = resolve_model_paths(energy_model_path, error_model_path)
+    key = (_model_key(energy_model_path, error_model_path), float(rpm), float(hour),
+           offset_min, offset_max, offset_step)
+    with _cache_lock:
+        front = _cache.get(key)
+        if front is not None:
+            _cache.move_to_end(key)
+            return front
+    front = compute_pareto_front(rpm, hour, load_model(energy_model_path), load_model(error_model_path),
+                                 offset_min, offset_max, offset_step)
+    with _cache_lock:
+        _cache[key] = front
+        while len(_cache) > _CACHE_MAX:
+            _cache.popitem(last=False)
+    return front
+
+
+def select_offset(rpm: float, hour: float, *, weights: dict = None, constraints: dict = None,
+                  minimize: str = None, **front_kwargs):
+    """
+    依權重或限制條件從（快取的）Pareto front 挑選 offset，回傳 (explanation, offset)；
+    無可行解時 offset 為 None，說明中列出各目標在 front 上可達到的範圍。
+    """
+    front = get_pareto_front(rpm, hour, **front_kwargs)
+    point = front.select(weights=weights, constraints=constraints, minimize=minimize)
+
+    condition = []
+    for name, limit in (constraints or {}).items():
+        condition.append(f"|{name}| ≤ {limit:g} {OBJECTIVE_UNITS[name]}")
+    if minimize:
+        condition.append(f"{minimize} 最小")
+    elif weights:
+        condition.append("自訂權重")
+    else:
+        condition.append("預設權重")
+    header = f"在 RPM={rpm:.0f}, Hour={hour:.2f} 小時、條件「{'，'.join(condition)}」下，\n"
+
+    if point is None:
+        ranges = "，".join(
+            f"{name} {front.front[name].abs().min():.2f}–{front.front[name].abs().max():.2f} {OBJECTIVE_UNITS[name]}"
+            for name in OBJECTIVES
+        )
+        return header + f"沒有符合條件的 TempOffset。Pareto front 上可達範圍：{ranges}。\n", None
+
+    offset = float(point["TempOffset"])
+    explanation = (
+        header +
+        f"建議 TempOffset = {offset:.1f} °C（Pareto front 共 {int(front.front_mask.sum())} 個非支配解）。\n"
+        f"預測 CoolerPower = {point['CoolerPower']:.2f} W，MachinePower = {point['MachinePower']:.2f} W，"
+        f"總能耗 = {point['TotalPower']:.2f} W。\n"
+        f"預測 AvgError = {point['AvgError']:.2f} μm，MaxError = {point['MaxError']:.2f} μm。\n"
+    )
+    return explanation, offset
@@ -0,0 +1,486 @@
+"""
+選用的效能剖析（profiling）工具：平常完全關閉，需要診斷「為什麼慢」時再開啟。
+
+以子系統為範圍收集資料（acquisition、optimizer、llm、ui）：
+
+    from profiling import profile_scope, profiled
+
+    with profile_scope("acquisition"):
+        self.read_temperature()
+
+    @profiled("optimizer")
+    def find_optimal_temp_offset(...): ...
+
+開啟方式（環境變數，兩個程式通用）：
+    COOLER_PROFILE=acquisition,optimizer   # 或 all
+    COOLER_PROFILE_MODE=sample             # sample（預設，取樣）或 cprofile（決定性）
+    COOLER_PROFILE_WINDOW=60               # 收集秒數，結束後自動寫檔並關閉
+    COOLER_PROFILE_INTERVAL_MS=5           # 取樣間隔
+    COOLER_PROFILE_DIR=profiles            # 輸出目錄
+
+cooler_app.py 另可用命令列參數：python cooler_app.py --profile acquisition --profile-window 120
+
+輸出：
+    sample 模式：每個子系統一份 .collapsed（Brendan Gregg collapsed stack 格式，
+                 可直接餵給 flamegraph.pl、speedscope、inferno）以及一份內建產生的 .svg 火焰圖
+    cprofile 模式：每個子系統一份 .prof（pstats / snakeviz 可開）
+
+關閉時 profile_scope() 只做一次集合成員檢查並回傳共用的空 context manager。
+"""
+import os
+import sys
+import time
+import atexit
+import logging
+import argparse
+import functools
+import threading
+from collections import Counter, defaultdict
+from html import escape
+
+SUBSYSTEMS = ("acquisition", "optimizer", "llm", "ui")
+DEFAULT_OUTPUT_DIR = "profiles"
+MAX_STACK_DEPTH = 128
+
+# 目前啟用的子系統；關閉時為空集合，profile_scope 只檢查這個集合
+_active = frozenset()
+_profiler = None
+
+
+class _NullScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+def profile_scope(subsystem: str):
+    """回傳子系統的剖析範圍（context manager）；未啟用時為零成本的空範圍。"""
+    if subsystem not in _active:
+        return _NULL_SCOPE
+    return _profiler.scope(subsystem)
+
+
+def profiled(subsystem: str):
+    """profile_scope 的裝飾器版本；是否啟用在每次呼叫時判斷。"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if subsystem not in _active:
+                return fn(*args, **kwargs)
+            with _profiler.scope(subsystem):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def is_enabled(subsystem: str = None) -> bool:
+    return bool(_active) if subsystem is None else subsystem in _active
+
+
+# -----------------------------
+# 取樣剖析器
+# -----------------------------
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}".replace(";", ",")
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _Scope:
+    __slots__ = ("profiler", "subsystem")
+
+    def __init__(self, profiler, subsystem):
+        self.profiler = profiler
+        self.subsystem = subsystem
+
+    def __enter__(self):
+        self.profiler._enter(self.subsystem)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._exit(self.subsystem)
+        return False
+
+
+class SamplingProfiler:
+    """
+    背景執行緒每 interval 秒以 sys._current_frames() 取樣，
+    只記錄目前位於剖析範圍內的執行緒，樣本歸到最內層的子系統。
+    被剖析的程式碼不需要任何 hook，因此額外開銷只落在取樣執行緒上。
+    """
+
+    mode = "sample"
+
+    def __init__(self, subsystems, output_dir=DEFAULT_OUTPUT_DIR, window_s=60.0, interval_s=0.005):
+        self.subsystems = frozenset(subsystems)
+        self.output_dir = output_dir
+        self.window_s = window_s
+        self.interval_s = interval_s
+        self._scopes = {}                       # thread id -> 子系統堆疊
+        self._samples = defaultdict(Counter)    # subsystem -> collapsed stack -> 次數
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._written = False
+
+    def scope(self, subsystem):
+        return _Scope(self, subsystem)
+
+    def _enter(self, subsystem):
+        self._scopes.setdefault(threading.get_ident(), []).append(subsystem)
+
+    def _exit(self, subsystem):
+        thread_id = threading.get_ident()
+        stack = self._scopes.get(thread_id)
+        if stack:
+            stack.pop()
+            if not stack:
+                self._scopes.pop(thread_id, None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.window_s
+        while not self._stop.wait(self.interval_s):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stack in list(self._scopes.items()):
+                    if not stack or thread_id == own_id:
+                        continue
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self._samples[stack[-1]][_collapse(frame)] += 1
+            if time.monotonic() >= deadline:
+                break
+        _stop_if_current(self)
+
+    def stop(self):
+        self._stop.set()
+
+    def write(self):
+        """寫出各子系統的 .collapsed 與 .svg，回傳檔案路徑列表。"""
+        with self._lock:
+            if self._written:
+                return []
+            self._written = True
+            samples = {name: Counter(counts) for name, counts in self._samples.items()}
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        paths = []
+        for subsystem, counts in samples.items():
+            if not counts:
+                continue
+            base = os.path.join(self.output_dir, f"{subsystem}-{os.getpid()}-{stamp}")
+            write_collapsed(counts, base + ".collapsed")
+            render_flamegraph_svg(counts, base + ".svg", title=f"{subsystem} ({sum(counts.values())} samples)")
+            paths += [base + ".collapsed", base + ".svg"]
+        return paths
+
+
+# -----------------------------
+# cProfile 剖析器
+# -----------------------------
+class CProfileProfiler:
+    """
+    以 cProfile 做決定性剖析，每個子系統一份 .prof。
+    Python 的 profiler 同時只能有一個在作用，因此同一時間只記錄一個範圍，
+    重疊（巢狀或其他執行緒同時進入）的範圍會被略過並計數；需要同時觀察多個子系統時請用 sample 模式。
+    """
+
+    mode = "cprofile"
+
+    def __init__(self, subsystems, output_dir=DEFAULT_OUTPUT_DIR, window_s=60.0, interval_s=None):
+        import cProfile
+        self.subsystems = frozenset(subsystems)
+        self.output_dir = output_dir
+        self.window_s = window_s
+        self._profiles = {name: cProfile.Profile() for name in self.subsystems}
+        self._busy = threading.Lock()
+        self._owner = None       # (thread id, subsystem) 正在記錄的範圍
+        self._nested = 0         # 同一執行緒在記錄中又進入的巢狀範圍數
+        self.skipped = Counter()
+        self._timer = None
+        self._written = False
+
+    def scope(self, subsystem):
+        return _Scope(self, subsystem)
+
+    def _enter(self, subsystem):
+        owner = self._owner
+        if owner is not None and owner[0] == threading.get_ident():
+            self._nested += 1    # 巢狀範圍併入外層的記錄
+            return
+        if self._busy.acquire(blocking=False):
+            try:
+                self._profiles[subsystem].enable()
+                self._owner = (threading.get_ident(), subsystem)
+            except ValueError:   # 另一個 profiler（例如偵錯器）正在作用
+                self._busy.release()
+                self.skipped[subsystem] += 1
+        else:
+            self.skipped[subsystem] += 1
+
+    def _exit(self, subsystem):
+        owner = self._owner
+        if owner is None or owner[0] != threading.get_ident():
+            return
+        if self._nested:
+            self._nested -= 1
+        else:
+            self._profiles[owner[1]].disable()
+            self._owner = None
+            self._busy.release()
+
+    def start(self):
+        self._timer = threading.Timer(self.window_s, _stop_if_current, args=(self,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+        if self._owner is not None:
+            self._profiles[self._owner[1]].disable()
+
+    def write(self):
+        import pstats
+        if self._written:
+            return []
+        self._written = True
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        paths = []
+        for subsystem, profile in self._profiles.items():
+            try:
+                stats = pstats.Stats(profile)
+            except TypeError:    # 該子系統沒有任何資料
+                continue
+            path = os.path.join(self.output_dir, f"{subsystem}-{os.getpid()}-{stamp}.prof")
+            stats.dump_stats(path)
+            paths.append(path)
+        if self.skipped:
+            logging.info(f"cProfile 重疊而略過的範圍: {dict(self.skipped)}")
+        return paths
+
+
+PROFILERS = {"sample": SamplingProfiler, "cprofile": CProfileProfiler}
+
+
+# -----------------------------
+# 啟用 / 停用
+# -----------------------------
+def start_profiling(subsystems, mode: str = "sample", window_s: float = 60.0,
+                    interval_ms: float = 5.0, output_dir: str = DEFAULT_OUTPUT_DIR):
+    """開始收集指定子系統，window_s 秒後自動寫檔並關閉。"""
+    global _active, _profiler
+    if _profiler is not None:
+        stop_profiling()
+    names = set(SUBSYSTEMS) if "all" in subsystems else set(subsystems)
+    unknown = names - set(SUBSYSTEMS)
+    if unknown:
+        raise ValueError(f"未知的子系統: {sorted(unknown)}（可用: {', '.join(SUBSYSTEMS)}, all）")
+    if mode not in PROFILERS:
+        raise ValueError(f"未知的剖析模式: {mode}（可用: {', '.join(PROFILERS)}）")
+    _profiler = PROFILERS[mode](names, output_dir=output_dir, window_s=window_s,
+                                interval_s=interval_ms / 1000.0)
+    _profiler.start()
+    _active = frozenset(names)
+    logging.info(f"🔬 剖析已開啟: {sorted(names)}，模式 {mode}，{window_s:.0f} 秒後輸出至 {output_dir}/")
+    return _profiler
+
+
+def stop_profiling():
+    """停止收集並寫出結果檔，回傳檔案路徑列表。"""
+    global _active, _profiler
+    profiler = _profiler
+    if profiler is None:
+        return []
+    _active = frozenset()
+    _profiler = None
+    profiler.stop()
+    try:
+        paths = profiler.write()
+    except Exception as e:
+        logging.error(f"寫出剖析結果失敗: {e}")
+        return []
+    for path in paths:
+        logging.info(f"🔬 剖析結果已寫出: {path}")
+    return paths
+
+
+def _stop_if_current(profiler):
+    """視窗到期時由剖析器自己呼叫；若已被手動停止或換成新的剖析器則不動作。"""
+    if _profiler is profiler:
+        stop_profiling()
+
+
+def start_profiling_from_env():
+    """依 COOLER_PROFILE* 環境變數啟用；未設定時不做任何事。"""
+    spec = os.environ.get("COOLER_PROFILE", "").strip()
+    if not spec or _profiler is not None:
+        return None
+    try:
+        return start_profiling(
+            [s.strip() for s in spec.split(",") if s.strip()],
+            mode=os.environ.get("COOLER_PROFILE_MODE", "sample"),
+            window_s=float(os.environ.get("COOLER_PROFILE_WINDOW", "60")),
+            interval_ms=float(os.environ.get("COOLER_PROFILE_INTERVAL_MS", "5")),
+            output_dir=os.environ.get("COOLER_PROFILE_DIR", DEFAULT_OUTPUT_DIR),
+        )
+    except ValueError as e:
+        logging.error(f"剖析設定錯誤: {e}")
+        return None
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """加入 --profile 等命令列參數（供各程式的 main 使用）。"""
+    parser.add_argument("--profile", metavar="SUBSYSTEMS",
+                        help=f"開啟剖析的子系統，逗號分隔（{', '.join(SUBSYSTEMS)}, all）")
+    parser.add_argument("--profile-mode", choices=sorted(PROFILERS), default="sample")
+    parser.add_argument("--profile-window", type=float, default=60.0, help="收集秒數")
+    parser.add_argument("--profile-interval-ms", type=float, default=5.0, help="取樣間隔（毫秒）")
+    parser.add_argument("--profile-dir", default=DEFAULT_OUTPUT_DIR)
+
+
+def start_profiling_from_args(args):
+    """依 add_profile_arguments 解析出的參數啟用；未指定 --profile 時改看環境變數。"""
+    if not getattr(args, "profile", None):
+        return start_profiling_from_env()
+    return start_profiling(
+        [s.strip() for s in args.profile.split(",") if s.strip()],
+        mode=args.profile_mode,
+        window_s=args.profile_window,
+        interval_ms=args.profile_interval_ms,
+        output_dir=args.profile_dir,
+    )
+
+
+# 程式提前結束時仍寫出已收集的資料
+atexit.register(stop_profiling)
+
+
+# -----------------------------
+# 輸出格式
+# -----------------------------
+def write_collapsed(counts, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in sorted(counts.items()):
+            f.write(f"{stack} {count}\n")
+
+
+def read_collapsed(path: str) -> Counter:
+    counts = Counter()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                counts[stack] += int(count)
+    return counts
+
+
+def render_flamegraph_svg(counts, path: str, title: str = "", width: int = 1200,
+                          frame_height: int = 16, min_width_px: float = 0.5):
+    """
+    以 collapsed stack 產生自足的 SVG 火焰圖（不需 flamegraph.pl），
+    寬度代表樣本比例，滑鼠停留可看完整函式名稱與樣本數。
+    """
+    root = {"children": {}, "count": 0}
+    for stack, count in counts.items():
+        node = root
+        node["count"] += count
+        for label in stack.split(";"):
+            node = node["children"].setdefault(label, {"children": {}, "count": 0})
+            node["count"] += count
+    total = root["count"] or 1
+    scale = width / total
+
+    rects = []
+    max_depth = 0
+
+    def walk(node, x, depth):
+        nonlocal max_depth
+        for label, child in sorted(node["children"].items()):
+            w = child["count"] * scale
+            if w >= min_width_px:
+                max_depth = max(max_depth, depth)
+                rects.append((label, x, depth, w, child["count"]))
+                walk(child, x, depth + 1)
+            x += w
+
+    walk(root, 0.0, 0)
+    header = 24
+    height = header + (max_depth + 1) * frame_height + 4
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="16" font-size="13">{escape(title)}</text>',
+    ]
+    for label, x, depth, w, count in rects:
+        y = height - (depth + 1) * frame_height
+        # 以函式名稱雜湊決定暖色系顏色，相同函式顏色一致
+        h = sum(label.encode("utf-8")) % 60
+        fill = f"rgb({205 + h % 50},{80 + h * 2},{40 + h % 30})"
+        text = escape(label)
+        parts.append(
+            f'<g><title>{text} ({count} samples, {count * 100 / total:.1f}%)</title>'
+            f'<rect x="{x:.2f}" y="{y}" width="{w:.2f}" height="{frame_height - 1}" fill="{fill}"/>'
+        )
+        max_chars = int(w / 7)
+        if max_chars >= 4:
+            shown = label if len(label) <= max_chars else label[:max_chars - 2] + ".."
+            parts.append(f'<text x="{x + 2:.2f}" y="{y + frame_height - 4}">{escape(shown)}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+
+
+def top_frames(counts, limit: int = 20):
+    """回傳 (self 樣本數, total 樣本數, 函式) 依 self 排序，供命令列快速檢視。"""
+    self_counts = Counter()
+    total_counts = Counter()
+    for stack, count in counts.items():
+        labels = stack.split(";")
+        self_counts[labels[-1]] += count
+        for label in set(labels):
+            total_counts[label] += count
+    return [(c, total_counts[label], label) for label, c in self_counts.most_common(limit)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="檢視 collapsed stack 剖析結果或轉成 SVG 火焰圖")
+    parser.add_argument("collapsed", help=".collapsed 檔案")
+    parser.add_argument("--svg", help="輸出 SVG 火焰圖路徑")
+    parser.add_argument("--top", type=int, default=20, help="列出 self 時間最多的前 N 個函式")
+    args = parser.parse_args()
+
+    counts = read_collapsed(args.collapsed)
+    total = sum(counts.values()) or 1
+    if args.svg:
+        render_flamegraph_svg(counts, args.svg, title=os.path.basename(args.collapsed))
+        print(f"已寫出 {args.svg}")
+    print(f"{'self%':>7} {'total%':>7}  function")
+    for self_count, total_count, label in top_frames(counts, args.top):
+        print(f"{self_count * 100 / total:7.1f} {total_count * 100 / total:7.1f}  {label}")
+
+
+if __name__ == "__main__":
+    main()
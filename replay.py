@@ -0,0 +1,261 @@
+"""
+temperature_log 歷史資料的加速重播。
+
+從既有的 temperature_log.db（或其封存檔，可多個，依時間合併）以 fetchmany 串流讀出樣本，
+送進與 cooler_app 相同的 SamplePipeline：近期樣本緩衝區、閉迴路控制器、高頻擷取、異常偵測，
+再加上 temperature_log 寫入。消費者看到的是樣本本身的時間戳，因此任意加速倍率下的行為
+都與現場一致；數個月的資料可在數分鐘內跑完，用於重現現場問題、比較控制器或偵測器的修改，
+以及量測各消費者的吞吐量。
+
+    python replay.py temperature_log.db --speed 1000
+    python replay.py archive/2025-01.db archive/2025-02.db --speed 0 --report-json before.json
+    python replay.py temperature_log.db --start "2025-02-01" --end "2025-02-08" --controller 5.0
+    python replay.py temperature_log.db --speed 60 --serve 9998     # socket 訂閱者可連線觀察
+
+--speed 0 代表不等待、全速重播。封存檔可以是 .db 或 CSV（欄位 timestamp, sensor_liquid,
+sensor_reference, set_temperature）。
+"""
+import csv
+import json
+import time
+import heapq
+import sqlite3
+import logging
+import argparse
+import threading
+import socketserver
+from collections import Counter
+from datetime import datetime
+
+import temperature_store
+import burst_capture
+import anomaly_detector
+from anomaly_detector import AnomalyMonitor
+from burst_capture import BurstCapture
+from sample_pipeline import SamplePipeline
+from sample_ring import SampleRing, handle_command as handle_sample_command
+from setpoint_controller import SetpointController
+from temperature_store import Sample
+
+FETCH_BATCH = 5000
+LOG_INTERVAL_S = 0.95   # 與 cooler_app 相同：以 1 Hz 計算的消費者只收約 1 Hz 的樣本
+
+
+# -----------------------------
+# 來源：以 fetchmany 串流，記憶體用量與資料量無關
+# -----------------------------
+def iter_db(path: str, start: str = None, end: str = None, batch: int = FETCH_BATCH):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        sql = "SELECT timestamp, sensor_liquid, sensor_reference, set_temperature FROM temperature_log"
+        clauses, params = [], []
+        if start:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        cursor = conn.execute(sql + " ORDER BY timestamp, id", params)
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            for ts, liquid, reference, setpoint in rows:
+                yield Sample(datetime.fromisoformat(ts), liquid, reference, setpoint)
+    finally:
+        conn.close()
+
+
+def iter_csv(path: str, start: str = None, end: str = None):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            ts = row["timestamp"]
+            if (start and ts < start) or (end and ts >= end):
+                continue
+            yield Sample(datetime.fromisoformat(ts), float(row["sensor_liquid"]),
+                         float(row["sensor_reference"]), float(row["set_temperature"]))
+
+
+def iter_sources(paths, start: str = None, end: str = None):
+    """多個來源依時間戳合併（各來源本身須依時間排序）。"""
+    sources = [iter_csv(p, start, end) if p.lower().endswith(".csv") else iter_db(p, start, end)
+               for p in paths]
+    if len(sources) == 1:
+        return sources[0]
+    return heapq.merge(*sources, key=lambda sample: sample.timestamp)
+
+
+# -----------------------------
+# 重播
+# -----------------------------
+class Replay:
+    """建立與 cooler_app 相同順序的消費者，並把寫入、高頻擷取與異常事件存到 output 資料庫。"""
+
+    def __init__(self, output: str = ":memory:", controller_feedforward: float = None,
+                 commit_every: int = 1000, detector_kwargs: dict = None):
+        self.conn = sqlite3.connect(output, check_same_thread=False)
+        temperature_store.ensure_schema(self.conn)
+        burst_capture.ensure_schema(self.conn)
+        anomaly_detector.ensure_schema(self.conn)
+        self.commit_every = commit_every
+        self._pending = []
+        self._now = None
+        self._last_setpoint = None
+        self.commands = []
+        self.bursts = 0
+        self.events = []
+
+        self.pipeline = SamplePipeline()
+        self.pipeline.add(self.write, "writer")
+        self.sample_ring = SampleRing.for_duration()
+        self.pipeline.add(self.sample_ring.append, "sample_ring", min_interval_s=LOG_INTERVAL_S)
+        self.controller = SetpointController(write_fn=self._record_command)
+        if controller_feedforward is not None:
+            self.controller.enable(controller_feedforward)
+        self.pipeline.add(self.controller.on_sample, "controller")
+        self.burst = BurstCapture(on_complete=self._save_burst)
+        self.pipeline.add(self._replay_setpoint_writes, "setpoint_writes")
+        self.pipeline.add(self.burst.on_sample, "burst")
+        self.anomaly = AnomalyMonitor(on_event=self._save_event, **(detector_kwargs or {}))
+        self.pipeline.add(self.anomaly.on_sample, "anomaly")
+
+    # ───────── 消費者 ─────────
+    def write(self, sample: Sample):
+        self._pending.append(sample)
+        if len(self._pending) >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            temperature_store.insert_samples(self.conn, self._pending)
+            self._pending.clear()
+
+    def _replay_setpoint_writes(self, sample: Sample):
+        # 現場的設定值寫入會呼叫 notify_setpoint；歷史資料中以設定溫度的變化還原
+        if sample.set_temperature != self._last_setpoint:
+            if self._last_setpoint is not None:
+                self.burst.notify_setpoint(sample.set_temperature, sample.timestamp)
+            self._last_setpoint = sample.set_temperature
+
+    def _record_command(self, value: float):
+        # 歷史資料不會因命令而改變：記錄控制器「會寫入」的值，並如同現場一樣通知高頻擷取
+        self.commands.append((self._now, value))
+        self.burst.notify_setpoint(value, self._now)
+
+    def _save_burst(self, burst):
+        burst_capture.save_burst(self.conn, burst)
+        self.bursts += 1
+
+    def _save_event(self, event):
+        anomaly_detector.save_event(self.conn, event)
+        self.events.append(event)
+
+    # ───────── 主迴圈 ─────────
+    def run(self, samples, speed: float = 1000.0, limit: int = None) -> dict:
+        """
+        依 speed 倍率送出樣本（樣本時間差 / speed 秒）；speed <= 0 時全速執行。
+        回傳重播統計與各消費者耗時。
+        """
+        first = last = None
+        wall_start = time.perf_counter()
+        max_lag = 0.0
+        count = 0
+        for sample in samples:
+            if first is None:
+                first = sample.timestamp
+            if speed > 0:
+                due = (sample.timestamp - first).total_seconds() / speed
+                ahead = due - (time.perf_counter() - wall_start)
+                if ahead > 0.001:
+                    time.sleep(ahead)
+                else:
+                    max_lag = max(max_lag, -ahead)
+            self._now = sample.timestamp
+            self.pipeline.dispatch(sample)
+            last = sample.timestamp
+            count += 1
+            if limit and count >= limit:
+                break
+        self.flush()
+        wall = time.perf_counter() - wall_start
+        span = (last - first).total_seconds() if count else 0.0
+        return {
+            "samples": count,
+            "first": first.isoformat(sep=" ") if first else None,
+            "last": last.isoformat(sep=" ") if last else None,
+            "span_s": span,
+            "wall_s": wall,
+            "speedup": span / wall if wall > 0 else None,
+            "samples_per_s": count / wall if wall > 0 else None,
+            "max_lag_s": max_lag,
+            "consumers": self.pipeline.report(),
+            "anomalies": dict(Counter(event.kind for event in self.events)),
+            "bursts": self.bursts,
+            "controller_writes": len(self.commands),
+        }
+
+    # ───────── socket：讓訂閱者與查詢工具連到重播中的流程 ─────────
+    def serve(self, port: int, host: str = "localhost"):
+        replay = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                message = self.request.recv(1024).decode("utf-8").strip()
+                if message.startswith("[AnomalySubscribe]"):
+                    replay.anomaly.subscribers.serve(self.request)
+                    return
+                if message.startswith("[Anomaly"):
+                    reply = anomaly_detector.handle_command(replay.anomaly, message)
+                elif message.startswith("[ControlStatus]"):
+                    reply = json.dumps(replay.controller.snapshot())
+                else:
+                    reply = handle_sample_command(replay.sample_ring, message)
+                self.request.sendall((reply or "Invalid command").encode("utf-8"))
+
+        server = socketserver.ThreadingTCPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"重播 socket 服務於 {host}:{port}")
+        return server
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR, format="%(message)s")
+    parser = argparse.ArgumentParser(description="temperature_log 歷史資料加速重播")
+    parser.add_argument("sources", nargs="+", help="temperature_log.db 或封存檔（.db / .csv），依時間合併")
+    parser.add_argument("--speed", type=float, default=1000.0, help="加速倍率；0 為全速")
+    parser.add_argument("--start", help="起始時間（含），例如 2025-02-01 或 2025-02-01 08:00:00")
+    parser.add_argument("--end", help="結束時間（不含）")
+    parser.add_argument("--limit", type=int, help="最多重播筆數")
+    parser.add_argument("--output", default=":memory:", help="寫入、高頻擷取與異常事件的輸出資料庫")
+    parser.add_argument("--controller", type=float, metavar="FEEDFORWARD",
+                        help="啟用閉迴路控制器並以此為前饋，記錄它會寫入的命令")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="重播期間提供 socket 指令服務")
+    parser.add_argument("--report-json", help="將統計與異常事件寫成 JSON（供比較不同版本）")
+    args = parser.parse_args()
+
+    replay = Replay(args.output, controller_feedforward=args.controller)
+    if args.serve:
+        replay.serve(args.serve)
+    result = replay.run(iter_sources(args.sources, args.start, args.end), args.speed, args.limit)
+
+    print(f"重播 {result['samples']} 筆（{result['first']} → {result['last']}），"
+          f"歷時 {result['wall_s']:.1f} s，{result['samples_per_s'] or 0:.0f} 筆/s，"
+          f"加速 {result['speedup'] or 0:.0f}×，最大落後 {result['max_lag_s']:.3f} s")
+    print(f"{'消費者':<12} {'µs/筆':>8} {'例外':>6}")
+    for name, stats in result["consumers"].items():
+        print(f"{name:<12} {stats['us_per_sample']:>8.1f} {stats['errors']:>6}")
+    print(f"異常事件 {result['anomalies'] or 0}，高頻擷取 {result['bursts']} 筆，"
+          f"控制器寫入 {result['controller_writes']} 次")
+    if args.report_json:
+        result["events"] = [event.to_dict() for event in replay.events]
+        result["commands"] = [(ts.isoformat(sep=" "), value) for ts, value in replay.commands]
+        with open(args.report_json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"報告 → {args.report_json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+擷取樣本的分派流程。
+
+cooler_app 每次讀到樣本（或 replay.py 重播歷史資料）都交給同一個 SamplePipeline，
+依註冊順序呼叫各消費者（近期樣本緩衝區、閉迴路控制、高頻擷取、異常偵測……）。
+單一消費者拋出例外只記錄錯誤，不影響其他消費者；每個消費者的累計耗時可用來找出瓶頸。
+
+高頻擷取期間樣本可達 20 Hz；以 min_interval_s 註冊的消費者依樣本時間戳節流，
+只收到間隔不短於 min_interval_s 的樣本（例如以 1 Hz 計算容量的近期樣本緩衝區）。
+"""
+import time
+import logging
+
+
+class SamplePipeline:
+    def __init__(self):
+        self.listeners = []    # [(名稱, 回呼, 最小間隔秒數)]
+        self.elapsed = {}      # 名稱 -> 累計耗時（秒）
+        self.errors = {}       # 名稱 -> 例外次數
+        self.dispatched = 0
+        self._last_times = {}  # 名稱 -> 上次送出樣本的時間戳（僅節流的消費者）
+
+    def add(self, listener, name: str = None, min_interval_s: float = 0.0):
+        name = name or getattr(listener, "__qualname__", repr(listener))
+        self.listeners.append((name, listener, min_interval_s))
+        self.elapsed.setdefault(name, 0.0)
+        self.errors.setdefault(name, 0)
+        return listener
+
+    def dispatch(self, sample):
+        self.dispatched += 1
+        for name, listener, min_interval_s in self.listeners:
+            if min_interval_s:
+                last = self._last_times.get(name)
+                if last is not None and (sample.timestamp - last).total_seconds() < min_interval_s:
+                    continue
+                self._last_times[name] = sample.timestamp
+            start = time.perf_counter()
+            try:
+                listener(sample)
+            except Exception as e:
+                self.errors[name] += 1
+                logging.error(f"樣本回呼 {name} 失敗: {e}")
+            self.elapsed[name] += time.perf_counter() - start
+
+    def report(self) -> dict:
+        """各消費者的平均每筆耗時（微秒）與例外次數。"""
+        n = max(self.dispatched, 1)
+        return {name: {"us_per_sample": self.elapsed[name] / n * 1e6, "errors": self.errors[name]}
+                for name, _, _ in self.listeners}
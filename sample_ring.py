@@ -0,0 +1,253 @@
+"""
+冷卻機服務內的近期樣本環形緩衝區。
+
+cooler_app 每次擷取的樣本除了寫入 SQLite，也放進固定大小的 NumPy 環形緩衝區
+（預設保留 6 小時，1 Hz 約 0.7 MB）。容量以 1 Hz 計算：與 temperature_log 相同，
+高頻擷取期間只送入約 1 Hz 的樣本（SamplePipeline 的 min_interval_s），20 Hz 資料只存在 burst 中。「現在」、「40 秒前」或最近幾分鐘的統計
+直接由記憶體回答（微秒等級），只有超出緩衝範圍的查詢才需要回到資料庫。
+
+socket 指令（回應皆為 JSON）：
+    [SampleLatest]                    → 最新樣本
+    [SampleNearest]: <秒數>           → 最接近「現在 − 秒數」的樣本；超出緩衝範圍時 found=false
+    [SampleWindow]: <秒數>            → 最近秒數內各通道的 count/min/max/mean
+    [SampleStats]                     → 緩衝區容量、筆數與最舊樣本時間
+
+    python sample_ring.py latest
+    python sample_ring.py nearest 40
+    python sample_ring.py window 600
+"""
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from temperature_store import CHANNELS, Sample
+
+DEFAULT_HOURS = float(os.environ.get("COOLER_RING_HOURS", "6"))
+DEFAULT_SAMPLE_RATE_HZ = 1.0
+SERVICE_ADDRESS = ("localhost", 9999)
+
+
+class SampleRing:
+    """固定容量的樣本環形緩衝區；append 與各查詢皆不配置與容量成正比的記憶體。"""
+
+    def __init__(self, capacity: int, sample_rate_hz: float = DEFAULT_SAMPLE_RATE_HZ):
+        if capacity <= 0:
+            raise ValueError("capacity 必須為正整數")
+        self.capacity = capacity
+        self.sample_rate_hz = sample_rate_hz   # 預期的送入頻率，用於換算可保留的時間長度
+        self._times = np.zeros(capacity, dtype=np.float64)             # epoch 秒
+        self._values = np.zeros((capacity, len(CHANNELS)), dtype=np.float64)
+        self._next = 0      # 下一個寫入位置
+        self._count = 0
+        self.version = 0    # 每次寫入遞增，讀取端可據此判斷是否有新資料
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_duration(cls, hours: float = DEFAULT_HOURS, sample_rate_hz: float = DEFAULT_SAMPLE_RATE_HZ):
+        """容量 = hours × 3600 × sample_rate_hz；送入的樣本頻率須不高於 sample_rate_hz 才能保留 hours 小時。"""
+        return cls(max(1, int(hours * 3600 * sample_rate_hz)), sample_rate_hz)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample: Sample):
+        """加入一筆樣本（時間須遞增；較舊的樣本會被忽略以維持排序）。"""
+        t = sample.timestamp.timestamp()
+        with self._lock:
+            if self._count and t < self._times[(self._next - 1) % self.capacity]:
+                return
+            self._times[self._next] = t
+            self._values[self._next] = sample[1:]
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self.version += 1
+
+    # ───────── 內部：依時間順序的兩段連續切片 ─────────
+    def _segments(self):
+        """回傳依時間順序排列的 [(起始實體索引, 結束實體索引)]，最多兩段。"""
+        if self._count < self.capacity:
+            return [(0, self._count)]
+        return [(self._next, self.capacity), (0, self._next)]
+
+    def _to_sample(self, index: int) -> Sample:
+        return Sample(datetime.fromtimestamp(self._times[index]), *self._values[index].tolist())
+
+    # ───────── 查詢 ─────────
+    def oldest_time(self):
+        with self._lock:
+            if not self._count:
+                return None
+            start, _ = self._segments()[0]
+            return datetime.fromtimestamp(self._times[start])
+
+    def latest(self):
+        with self._lock:
+            if not self._count:
+                return None
+            return self._to_sample((self._next - 1) % self.capacity)
+
+    def nearest(self, target: datetime, tolerance_s: float = 5.0):
+        """
+        回傳最接近 target 的樣本；target 早於緩衝區最舊樣本超過 tolerance_s 時回傳 None
+        （代表應改查資料庫）。
+        """
+        t = target.timestamp()
+        with self._lock:
+            if not self._count:
+                return None
+            segments = self._segments()
+            if t < self._times[segments[0][0]] - tolerance_s:
+                return None
+            best, best_diff = None, None
+            for start, end in segments:
+                times = self._times[start:end]
+                pos = int(np.searchsorted(times, t))
+                for candidate in (pos - 1, pos):
+                    if 0 <= candidate < len(times):
+                        diff = abs(times[candidate] - t)
+                        if best_diff is None or diff < best_diff:
+                            best, best_diff = start + candidate, diff
+            return self._to_sample(best)
+
+    def window(self, start: datetime, end: datetime = None) -> dict:
+        """回傳 [start, end] 內各通道的 count/min/max/mean；超出緩衝範圍的部分不計。"""
+        t0 = start.timestamp()
+        t1 = (end or datetime.now()).timestamp()
+        with self._lock:
+            chunks = []
+            for seg_start, seg_end in self._segments():
+                times = self._times[seg_start:seg_end]
+                lo, hi = np.searchsorted(times, t0, side="left"), np.searchsorted(times, t1, side="right")
+                if hi > lo:
+                    chunks.append((times[lo:hi], self._values[seg_start + lo:seg_start + hi]))
+            complete = bool(self._count and self._times[self._segments()[0][0]] <= t0)
+        result = {"count": sum(len(times) for times, _ in chunks), "complete": complete}
+        if not result["count"]:
+            return result
+        values = np.concatenate([v for _, v in chunks]) if len(chunks) > 1 else chunks[0][1]
+        result["first"] = datetime.fromtimestamp(chunks[0][0][0]).isoformat(timespec="seconds")
+        result["last"] = datetime.fromtimestamp(chunks[-1][0][-1]).isoformat(timespec="seconds")
+        for i, channel in enumerate(CHANNELS):
+            column = values[:, i]
+            result[channel] = {"min": float(column.min()), "max": float(column.max()),
+                               "mean": float(column.mean())}
+        return result
+
+    def minmax(self, start: datetime, end: datetime, buckets: int):
+        """
+        [start, end] 內的資料依時間等分為 buckets 桶，回傳 (times, low, high)：
+        times 為各非空桶第一筆樣本的 epoch 秒，low／high 為各通道的桶內最小值與最大值（形狀 (k, 通道數)）。
+        原始筆數不超過 2 × buckets 時不降採樣，low 與 high 皆為原始值。
+        """
+        t0, t1 = start.timestamp(), end.timestamp()
+        with self._lock:
+            times, values = [], []
+            for seg_start, seg_end in self._segments():
+                segment = self._times[seg_start:seg_end]
+                lo, hi = np.searchsorted(segment, t0, side="left"), np.searchsorted(segment, t1, side="right")
+                if hi > lo:
+                    times.append(segment[lo:hi])
+                    values.append(self._values[seg_start + lo:seg_start + hi])
+            if not times:
+                empty = np.empty((0, len(CHANNELS)))
+                return np.empty(0), empty, empty
+            times = np.concatenate(times) if len(times) > 1 else times[0].copy()
+            values = np.concatenate(values) if len(values) > 1 else values[0].copy()
+        if len(times) <= 2 * buckets:
+            return times, values, values
+        edges = np.searchsorted(times, np.linspace(t0, t1, buckets + 1)[:-1], side="left")
+        starts = np.unique(edges[edges < len(times)])
+        return (times[starts], np.minimum.reduceat(values, starts, axis=0),
+                np.maximum.reduceat(values, starts, axis=0))
+
+    def stats(self) -> dict:
+        oldest = self.oldest_time()
+        return {"capacity": self.capacity, "count": self._count,
+                "oldest": oldest.isoformat(timespec="seconds") if oldest else None,
+                "bytes": self._times.nbytes + self._values.nbytes}
+
+
+# -----------------------------
+# socket 指令（伺服器端與用戶端）
+# -----------------------------
+def sample_to_dict(sample: Sample) -> dict:
+    data = sample._asdict()
+    data["timestamp"] = sample.timestamp.isoformat(timespec="seconds")
+    return data
+
+
+def handle_command(ring: SampleRing, message: str):
+    """處理 [Sample*] 指令並回傳 JSON 字串；不是環形緩衝區的指令時回傳 None。"""
+    command, _, argument = message.partition(":")
+    command = command.strip()
+    if command == "[SampleLatest]":
+        sample = ring.latest()
+        result = {"found": sample is not None, **(sample_to_dict(sample) if sample else {})}
+    elif command == "[SampleNearest]":
+        target = datetime.fromtimestamp(time.time() - float(argument))
+        sample = ring.nearest(target)
+        result = {"found": sample is not None, "target": target.isoformat(timespec="seconds"),
+                  **(sample_to_dict(sample) if sample else {})}
+    elif command == "[SampleWindow]":
+        result = ring.window(datetime.fromtimestamp(time.time() - float(argument)))
+    elif command == "[SampleStats]":
+        result = ring.stats()
+    else:
+        return None
+    return json.dumps(result, ensure_ascii=False)
+
+
+def query_service(message: str, address=SERVICE_ADDRESS, timeout: float = 0.5):
+    """向 cooler_app 的 socket 服務送出指令並解析 JSON 回應；服務未啟動或逾時時回傳 None。"""
+    try:
+        with socket.create_connection(address, timeout=timeout) as sock:
+            sock.sendall(message.encode("utf-8"))
+            chunks = []
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                chunks.append(data)
+        return json.loads(b"".join(chunks).decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查詢 cooler_app 的近期樣本緩衝區")
+    parser.add_argument("--host", default=SERVICE_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=SERVICE_ADDRESS[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("latest")
+    p_nearest = sub.add_parser("nearest")
+    p_nearest.add_argument("seconds_ago", type=float)
+    p_window = sub.add_parser("window")
+    p_window.add_argument("seconds", type=float)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    message = {
+        "latest": "[SampleLatest]",
+        "nearest": f"[SampleNearest]: {getattr(args, 'seconds_ago', 0)}",
+        "window": f"[SampleWindow]: {getattr(args, 'seconds', 0)}",
+        "stats": "[SampleStats]",
+    }[args.command]
+    start = time.perf_counter()
+    result = query_service(message, (args.host, args.port))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if result is None:
+        print("無法連線到 cooler_app 的 socket 服務")
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"往返 {elapsed_ms:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
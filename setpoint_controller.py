@@ -0,0 +1,263 @@
+"""
+閉迴路設定值控制器：模型建議的 TempOffset 作為前饋，再依即時溫度回授修正。
+
+冷卻機以「參考溫度 − 設定值」為液溫目標，但加工熱負載與參考溫度漂移會讓實際溫差
+（參考 − 液溫）偏離設定值。控制器在每個擷取樣本（約 1 秒一次）做一次固定成本的計算：
+
+    溫差量測 d = EMA(參考 − 液溫)
+    誤差     e = 前饋 − d
+    命令     u = 前饋 + Kp·e + Ki·∫e dt
+
+並限制修正幅度、變化率（°C/s）與暫存器解析度（0.1 °C），命令改變時才寫入冷卻機。
+輸出飽和時停止積分（anti-windup）。模型最佳化（數百毫秒）不在控制迴圈內執行，
+前饋值由 socket 指令或 NC 執行器在需要時更新。
+
+離線模擬（不需硬體或網路，比較開迴路與閉迴路）：
+    python setpoint_controller.py simulate --feedforward 5 --load-bias 0.8 --duration 3600
+透過 cooler_simulator 的 Modbus TCP 實際連線測試：
+    python setpoint_controller.py simulate --modbus --time-scale 30 --duration 1800
+"""
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from metrics import counter, histogram
+from temperature_store import Sample, sample_from_registers
+
+
+class SetpointController:
+    """前饋 + 限速 PI 回授；on_sample 每次 O(1)。"""
+
+    def __init__(self, write_fn, kp: float = 0.6, ki: float = 0.01, max_correction: float = 3.0,
+                 max_rate_c_per_s: float = 0.05, command_min: float = 0.0, command_max: float = 15.0,
+                 resolution: float = 0.1, filter_alpha: float = 0.3, max_dt_s: float = 10.0):
+        self.write_fn = write_fn
+        self.kp = kp
+        self.ki = ki
+        self.max_correction = max_correction
+        self.max_rate_c_per_s = max_rate_c_per_s
+        self.command_min = command_min
+        self.command_max = command_max
+        self.resolution = resolution
+        self.filter_alpha = filter_alpha
+        self.max_dt_s = max_dt_s
+
+        self.enabled = False
+        self.feedforward = None
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self.integral = 0.0
+        self.filtered_diff = None
+        self.command = None          # 目前（限速後、未量化）的命令
+        self.written = None          # 最後一次寫入的量化值
+        self.last_error = None
+        self._last_time = None
+        self.ticks = 0
+        self.writes = 0
+
+    # ───────── 設定 ─────────
+    def set_feedforward(self, offset: float):
+        """更新前饋（通常為最佳化器建議的 TempOffset）；積分保留，讓修正量延續。"""
+        with self._lock:
+            self.feedforward = float(offset)
+        logging.info(f"🎯 控制器前饋 TempOffset = {offset}")
+
+    def enable(self, feedforward: float = None):
+        with self._lock:
+            if feedforward is not None:
+                self.feedforward = float(feedforward)
+            self._reset_state()
+            self.enabled = True
+        logging.info("🔁 閉迴路控制已啟用")
+
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+        logging.info("⏹️ 閉迴路控制已停用")
+
+    # ───────── 控制迴圈 ─────────
+    def on_sample(self, sample: Sample):
+        """擷取流程的樣本回呼；回傳本次寫入的命令（沒有寫入時為 None）。"""
+        with self._lock:
+            if not self.enabled or self.feedforward is None:
+                return None
+            start = time.perf_counter()
+            value = self._step(sample)
+            histogram("cooler_controller_tick_seconds", "閉迴路控制每次計算耗時").observe(
+                time.perf_counter() - start)
+        if value is not None:
+            self.write_fn(value)
+            counter("cooler_controller_writes_total", "閉迴路控制寫入設定值次數").inc()
+        return value
+
+    def _step(self, sample: Sample):
+        dt = 0.0 if self._last_time is None else (sample.timestamp - self._last_time).total_seconds()
+        dt = max(0.0, min(dt, self.max_dt_s))
+        self._last_time = sample.timestamp
+        self.ticks += 1
+
+        diff = sample.sensor_reference - sample.sensor_liquid
+        if self.filtered_diff is None:
+            self.filtered_diff = diff
+        else:
+            self.filtered_diff += self.filter_alpha * (diff - self.filtered_diff)
+
+        ff = self.feedforward
+        error = ff - self.filtered_diff
+        self.last_error = error
+
+        correction = self.kp * error + self.ki * (self.integral + error * dt)
+        saturated_high = correction > self.max_correction or ff + correction > self.command_max
+        saturated_low = correction < -self.max_correction or ff + correction < self.command_min
+        # 條件積分：輸出已飽和且誤差會讓它更飽和時不累積
+        if not ((saturated_high and error > 0) or (saturated_low and error < 0)):
+            self.integral += error * dt
+
+        correction = max(-self.max_correction, min(self.max_correction,
+                                                   self.kp * error + self.ki * self.integral))
+        target = max(self.command_min, min(self.command_max, ff + correction))
+
+        if self.command is None:
+            self.command = target
+        else:
+            step_limit = self.max_rate_c_per_s * dt
+            self.command += max(-step_limit, min(step_limit, target - self.command))
+
+        quantized = round(round(self.command / self.resolution) * self.resolution, 3)
+        if quantized == self.written:
+            return None
+        self.written = quantized
+        self.writes += 1
+        return quantized
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "feedforward": self.feedforward,
+                "command": self.written,
+                "filtered_diff": self.filtered_diff,
+                "error": self.last_error,
+                "integral": self.integral,
+                "ticks": self.ticks,
+                "writes": self.writes,
+            }
+
+
+# -----------------------------
+# 模擬測試
+# -----------------------------
+def simulate_offline(controller: SetpointController = None, feedforward: float = 5.0,
+                     duration_s: float = 3600.0, dt_s: float = 1.0, load_bias: float = 0.8,
+                     seed: int = 1, thermal_kwargs: dict = None) -> dict:
+    """
+    以 cooler_simulator.ThermalModel 直接步進（不經網路、不等待），
+    回傳溫差追蹤誤差統計；controller 為 None 時為開迴路（只寫一次前饋值）。
+    """
+    from cooler_simulator import ThermalModel
+
+    rng = random.Random(seed)
+    thermal = ThermalModel(setpoint=feedforward, load_bias=load_bias, phase=0.0, **(thermal_kwargs or {}))
+    commands = []
+
+    def write(value):
+        thermal.setpoint = value
+        commands.append(value)
+
+    if controller is not None:
+        controller.write_fn = write
+        controller.enable(feedforward)
+
+    start = datetime(2025, 1, 1)
+    errors = []
+    t = 0.0
+    while t < duration_s:
+        thermal.advance(t, dt_s, rng)
+        t += dt_s
+        sample = Sample(start + timedelta(seconds=t), thermal.liquid, thermal.reference, thermal.setpoint)
+        if controller is not None:
+            controller.on_sample(sample)
+        if t >= duration_s * 0.25:   # 略過起始暫態
+            errors.append(feedforward - (thermal.reference - thermal.liquid))
+
+    abs_errors = sorted(abs(e) for e in errors)
+    return {
+        "mode": "closed_loop" if controller is not None else "open_loop",
+        "mean_error_c": sum(errors) / len(errors),
+        "mean_abs_error_c": sum(abs_errors) / len(abs_errors),
+        "p95_abs_error_c": abs_errors[int(0.95 * (len(abs_errors) - 1))],
+        "writes": len(commands),
+        "final_command": thermal.setpoint,
+    }
+
+
+def simulate_modbus(feedforward: float, duration_s: float, time_scale: float, load_bias: float,
+                    interval_s: float = 1.0) -> dict:
+    """透過 cooler_simulator 的 Modbus TCP 伺服器，以實際讀寫暫存器的方式跑閉迴路。"""
+    from pyModbusTCP.client import ModbusClient
+    from cooler_simulator import CoolerSimulator, ThermalModel
+
+    simulator = CoolerSimulator(n_devices=1, time_scale=time_scale,
+                                thermal_factory=lambda: ThermalModel(setpoint=feedforward, load_bias=load_bias))
+    simulator.start_in_thread()
+    host, port = simulator.address(0)
+    client = ModbusClient(host=host, port=port, auto_open=True)
+    controller = SetpointController(lambda value: client.write_single_register(0x0001, int(round(value * 10))))
+    controller.enable(feedforward)
+    errors = []
+    base, t0 = datetime.now(), time.monotonic()
+    try:
+        deadline = t0 + duration_s / time_scale
+        while time.monotonic() < deadline:
+            values = client.read_input_registers(0x0004, 3)
+            if values:
+                # 樣本時間以模擬時間計，控制器的 dt 與變化率限制才與加速倍率一致
+                sim_time = base + timedelta(seconds=(time.monotonic() - t0) * time_scale)
+                sample = sample_from_registers(values, sim_time)
+                controller.on_sample(sample)
+                errors.append(feedforward - (sample.sensor_reference - sample.sensor_liquid))
+            time.sleep(interval_s / time_scale)
+    finally:
+        client.close()
+        simulator.stop_thread()
+    tail = [abs(e) for e in errors[len(errors) // 4:]] or [0.0]
+    return {"mode": "closed_loop_modbus", "samples": len(errors),
+            "mean_abs_error_c": sum(tail) / len(tail), **controller.snapshot()}
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="閉迴路設定值控制器模擬測試")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sim = sub.add_parser("simulate", help="與模擬冷卻機比較開迴路與閉迴路")
+    p_sim.add_argument("--feedforward", type=float, default=5.0, help="前饋 TempOffset（°C）")
+    p_sim.add_argument("--load-bias", type=float, default=0.8, help="熱負載造成的液溫穩態偏差（°C）")
+    p_sim.add_argument("--duration", type=float, default=3600.0, help="模擬秒數")
+    p_sim.add_argument("--kp", type=float, default=0.6)
+    p_sim.add_argument("--ki", type=float, default=0.01)
+    p_sim.add_argument("--modbus", action="store_true", help="改經由 cooler_simulator 的 Modbus TCP 連線")
+    p_sim.add_argument("--time-scale", type=float, default=30.0, help="--modbus 時的模擬加速倍率")
+    args = parser.parse_args()
+
+    if args.modbus:
+        result = simulate_modbus(args.feedforward, args.duration, args.time_scale, args.load_bias)
+        print(f"閉迴路（Modbus）：{result['samples']} 個樣本，平均 |溫差誤差| = {result['mean_abs_error_c']:.3f} °C，"
+              f"寫入 {result['writes']} 次，最終設定 {result['command']}")
+        return
+
+    open_loop = simulate_offline(None, args.feedforward, args.duration, load_bias=args.load_bias)
+    closed_loop = simulate_offline(SetpointController(None, kp=args.kp, ki=args.ki), args.feedforward,
+                                   args.duration, load_bias=args.load_bias)
+    print(f"{'模式':<12} {'平均誤差':>9} {'平均|誤差|':>10} {'p95|誤差|':>10} {'寫入':>6} {'最終設定':>8}")
+    for r in (open_loop, closed_loop):
+        print(f"{r['mode']:<12} {r['mean_error_c']:>9.3f} {r['mean_abs_error_c']:>10.3f} "
+              f"{r['p95_abs_error_c']:>10.3f} {r['writes']:>6} {r['final_command']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
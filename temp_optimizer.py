@@ -0,0 +1,349 @@
+from pathlib import Path
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import optuna
+from metrics import timed
+from model_store import resolve_model_paths, load_model
+from profiling import profiled
+from uncertainty import load_ensemble, DEFAULT_COVERAGE
+
+NO_ENSEMBLE_REASON = "模型版本沒有預測區間集成，未做信心檢查"
+
+# 高信心結果的快取：(模型路徑, rpm, hour) -> best_offset，供超出訓練範圍時就近沿用
+_CONFIDENT_OFFSETS = OrderedDict()
+_CONFIDENT_OFFSETS_MAX = 256
+
+
+def _remember_confident(key, offset):
+    _CONFIDENT_OFFSETS[key] = offset
+    _CONFIDENT_OFFSETS.move_to_end(key)
+    while len(_CONFIDENT_OFFSETS) > _CONFIDENT_OFFSETS_MAX:
+        _CONFIDENT_OFFSETS.popitem(last=False)
+
+
+def _nearest_confident(model_key, rpm, hour, ensemble):
+    """找出同一組模型下、在訓練範圍內距離最近的高信心結果（以各特徵的訓練範圍正規化距離）。"""
+    span = np.maximum(ensemble.feature_max_[:2] - ensemble.feature_min_[:2], 1e-9)
+    best = None
+    for (key_model, key_rpm, key_hour), offset in _CONFIDENT_OFFSETS.items():
+        if key_model != model_key:
+            continue
+        distance = np.hypot((key_rpm - rpm) / span[0], (key_hour - hour) / span[1])
+        if best is None or distance < best[0]:
+            best = (distance, key_rpm, key_hour, offset)
+    return best
+
+
+# ───────── 成本權重（find_optimal_temp_offset 與 pareto 共用） ─────────
+_MEDIAN_ABS_AVG_ERR = 6.922       # µm
+_MEDIAN_TOTAL_POWER = 4974.04     # W
+_MEDIAN_ABS_MAX_ERR = 11.059      # µm
+
+_W_AVG_BASE = 1 / _MEDIAN_ABS_AVG_ERR
+_W_PWR_BASE = 1 / _MEDIAN_TOTAL_POWER
+_W_MAX_BASE = 1 / _MEDIAN_ABS_MAX_ERR
+
+
+def weight_rules(rpm_val: float, hour_val: float):
+    """依轉速與運轉時間動態調整 (w_avg, w_pow, w_max)。"""
+    rpm_min, rpm_max = 1500, 12000
+    rpm_norm  = max(0.0, min(1.0, (rpm_val - rpm_min) / (rpm_max - rpm_min)))
+    hour_norm = max(0.0, min(1.0, hour_val / 8.0))
+
+    k_avg, k_max, k_pow, damp = 2.0, 1.0, 3.0, 0.01
+    w_avg = _W_AVG_BASE * (1 + k_avg * rpm_norm)
+    w_max = _W_MAX_BASE * (1 + k_max * rpm_norm)
+    w_pow = _W_PWR_BASE * (1 + k_pow * hour_norm) * (1 - damp * rpm_norm)
+    return w_avg, w_pow, w_max
+
+
+def offset_grid(offset_min: float, offset_max: float, offset_step: float) -> np.ndarray:
+    return np.round(np.arange(offset_min, offset_max + offset_step / 2, offset_step), 6)
+
+
+# 誤差接近 0 時相對寬度會被放大，分母至少取訓練資料的典型量級
+_INTERVAL_FLOORS = (("TotalPower", _MEDIAN_TOTAL_POWER * 0.1), ("AvgError", _MEDIAN_ABS_AVG_ERR),
+                    ("MaxError", _MEDIAN_ABS_MAX_ERR))
+
+
+def interval_summaries(ensemble, points, coverage: float):
+    """
+    points 為 [[rpm, hour, offset], ...]；一次預測所有點 × 集成成員，
+    回傳每點的 (預測區間, 相對寬度)。總能耗由各成員的兩項功耗相加後再取分位數。
+    """
+    members = ensemble.predict_distribution(np.asarray(points, dtype=float))
+    members["TotalPower"] = members["CoolerPower"] + members["MachinePower"]
+    tail = (1 - coverage) / 2 * 100
+    stats = {}
+    for name, _ in _INTERVAL_FLOORS:
+        lower, upper = np.percentile(members[name], [tail, 100 - tail], axis=1)
+        stats[name] = (members[name].mean(axis=1), lower, upper)
+    summaries = []
+    for i in range(len(points)):
+        intervals, widths = {}, {}
+        for name, floor in _INTERVAL_FLOORS:
+            mean, lower, upper = (float(v[i]) for v in stats[name])
+            intervals[name] = {"mean": mean, "lower": lower, "upper": upper}
+            widths[name] = float((upper - lower) / max(abs(mean), floor))
+        summaries.append((intervals, widths))
+    return summaries
+
+
+def conservative_offset_indices(ensemble, pairs, offsets, coverage: float) -> np.ndarray:
+    """對每組 (rpm, hour) 一次批次評估所有候選 offset × 集成成員，回傳成本上分位數最小的 offset 索引。"""
+    pairs = np.asarray(pairs, dtype=float).reshape(-1, 2)
+    n_offsets = len(offsets)
+    X_grid = np.column_stack([np.repeat(pairs[:, 0], n_offsets), np.repeat(pairs[:, 1], n_offsets),
+                              np.tile(offsets, len(pairs))])
+    members = ensemble.predict_distribution(X_grid)
+    weights = np.repeat(np.array([weight_rules(rpm, hour) for rpm, hour in pairs]), n_offsets, axis=0)
+    costs = (weights[:, [0]] * np.abs(members["AvgError"]) +
+             weights[:, [1]] * (members["CoolerPower"] + members["MachinePower"]) +
+             weights[:, [2]] * np.abs(members["MaxError"]))
+    upper = np.percentile(costs, coverage * 100, axis=1).reshape(len(pairs), n_offsets)
+    return upper.argmin(axis=1)
+
+
+def format_explanation(rpm: float, hour: float, best_offset: float, prediction, confidence: dict,
+                       coverage: float) -> str:
+    """prediction 為 (CoolerPower, MachinePower, AvgError, MaxError)。"""
+    c, m, a_err, m_err = prediction
+    w_avg, w_pow, w_max = weight_rules(rpm, hour)
+    explanation = (
+        f"在 RPM={rpm:.0f}, Hour={hour:.2f} 小時 的情境下，\n"
+        f"採用加權總分評估 (w_avg_err={w_avg:.5f}、w_power={w_pow:.6f}、w_max_err={w_max:.5f})，\n"
+        f"最佳 TempOffset = {best_offset:.1f} °C。\n"
+        f"預測 CoolerPower = {c:.2f} W，MachinePower = {m:.2f} W，"
+        f"總能耗 = {c + m:.2f} W。\n"
+        f"預測 AvgError = {a_err:.2f} μm，MaxError = {m_err:.2f} μm。\n"
+    )
+    if "intervals" in confidence:
+        iv = confidence["intervals"]
+        level_text = {"high": "高", "low": "低"}[confidence["level"]]
+        mode_text = {"optimized": "最佳化結果", "cached": "沿用快取結果", "conservative": "保守值"}[confidence["mode"]]
+        explanation += (
+            f"{coverage:.0%} 預測區間：總能耗 {iv['TotalPower']['lower']:.0f}–{iv['TotalPower']['upper']:.0f} W，"
+            f"AvgError {iv['AvgError']['lower']:.2f}–{iv['AvgError']['upper']:.2f} μm，"
+            f"MaxError {iv['MaxError']['lower']:.2f}–{iv['MaxError']['upper']:.2f} μm。\n"
+            f"預測信心：{level_text}（{mode_text}）"
+            + (f"，{'；'.join(confidence['reasons'])}" if confidence["reasons"] else "") + "。\n"
+        )
+    elif confidence.get("reasons"):
+        explanation += f"⚠️ {'；'.join(confidence['reasons'])}（點預測可能為外插）。\n"
+    return explanation
+
+
+@timed("cooler_optimizer_seconds", "find_optimal_temp_offset 執行時間")
+@profiled("optimizer")
+def find_optimal_temp_offset(
+    rpm: float,
+    hour: float,
+    *,
+    energy_model_path: str = None,
+    error_model_path: str  = None,
+    offset_min: float = 2.5,
+    offset_max: float = 8.5,
+    offset_step: float = 0.1,
+    n_trials: int = 60,
+    seed: int = 42,
+    coverage: float = DEFAULT_COVERAGE,
+    max_relative_width: float = 0.5,
+    return_confidence: bool = False,
+):
+    """
+    回傳 (explanation, best_offset)；return_confidence=True 時另回傳信心資訊 dict。
+    未指定模型路徑時使用 model_store 目前發佈的版本（沒有則為工作目錄下的模型檔）。
+
+    模型旁有 bootstrap 集成（uncertainty.py build）時會評估預測區間：
+    - RPM/Hour 超出訓練範圍：不跑 Optuna，改用最近的高信心結果，或集成成本上分位數最小的保守值
+    - 範圍內但區間過寬（相對寬度 > max_relative_width）：改用保守值
+    - 其餘：沿用 Optuna 結果並快取為高信心結果
+    """
+
+    # ───────── 1–2. 參數常數與動態權重：見模組層級的 weight_rules ─────────
+
+    # ───────── 3. 載入模型（快取） ─────────
+    energy_model_path, error_model_path = resolve_model_paths(energy_model_path, error_model_path)
+    energy_model = load_model(Path(energy_model_path))
+    error_model  = load_model(Path(error_model_path))
+    ensemble     = load_ensemble(energy_model_path)
+    model_key    = (str(energy_model_path), str(error_model_path))
+
+    # ───────── 4. 成本函式 ─────────
+    def cost_fn(offset: float):
+        X_df = pd.DataFrame([[rpm, hour, offset]],
+                            columns=["RPM", "Hour", "TempOffset"])
+        with timed("cooler_model_predict_seconds", "模型單次預測耗時", model="energy"):
+            c_power, m_power     = energy_model.predict(X_df)[0]
+        with timed("cooler_model_predict_seconds", "模型單次預測耗時", model="error"):
+            avg_err,  max_err    = error_model.predict(X_df)[0]
+        w_avg, w_pow, w_max      = weight_rules(rpm, hour)
+        total_power              = c_power + m_power
+        cost = (w_avg * abs(avg_err) +
+                w_pow * total_power +
+                w_max * abs(max_err))
+        return cost
+
+    def conservative_offset():
+        """一次批次評估所有候選 offset × 集成成員，取成本上分位數最小者。"""
+        offsets = offset_grid(offset_min, offset_max, offset_step)
+        return float(offsets[conservative_offset_indices(ensemble, [(rpm, hour)], offsets, coverage)[0]])
+
+    # ───────── 5. 信心檢查與 Optuna 最佳化 ─────────
+    confidence = {"level": "unknown", "mode": "optimized", "in_envelope": None,
+                  "reasons": [] if ensemble is not None else [NO_ENSEMBLE_REASON]}
+    run_search = True
+    if ensemble is not None:
+        in_envelope, reasons = ensemble.envelope_check([[rpm, hour, (offset_min + offset_max) / 2]])
+        confidence.update(in_envelope=bool(in_envelope[0]), reasons=reasons[0])
+        if not in_envelope[0]:
+            run_search = False
+            confidence["level"] = "low"
+            nearest = _nearest_confident(model_key, rpm, hour, ensemble)
+            if nearest is not None:
+                _, near_rpm, near_hour, best_offset = nearest
+                confidence["mode"] = "cached"
+                confidence["reasons"].append(f"沿用 RPM={near_rpm:.0f}, Hour={near_hour:g} 的高信心結果")
+            else:
+                best_offset = conservative_offset()
+                confidence["mode"] = "conservative"
+
+    if run_search:
+        sampler = optuna.samplers.TPESampler(seed=seed)
+        study   = optuna.create_study(direction="minimize", sampler=sampler)
+
+        def objective(trial):
+            offset = trial.suggest_float(
+                "temp_offset", offset_min, offset_max, step=offset_step
+            )
+            return cost_fn(offset)
+
+        study.optimize(objective, n_trials=n_trials, show_progress_bar=False)
+        best_offset = study.best_params["temp_offset"]
+
+    # ───────── 5b. 預測區間 ─────────
+    def interval_summary(offset: float):
+        """回傳 (預測區間, 相對寬度)。"""
+        return interval_summaries(ensemble, [[rpm, hour, offset]], coverage)[0]
+
+    if ensemble is not None:
+        confidence["intervals"], confidence["relative_width"] = interval_summary(best_offset)
+        if run_search:
+            if max(confidence["relative_width"].values()) > max_relative_width:
+                confidence["level"] = "low"
+                confidence["mode"] = "conservative"
+                confidence["reasons"].append("預測區間過寬")
+                best_offset = conservative_offset()
+                confidence["intervals"], confidence["relative_width"] = interval_summary(best_offset)
+            else:
+                confidence["level"] = "high"
+                _remember_confident((model_key, float(rpm), float(hour)), best_offset)
+
+    # ───────── 6. 取得最佳預測值 ─────────
+    X_best = pd.DataFrame([[rpm, hour, best_offset]],
+                          columns=["RPM", "Hour", "TempOffset"])
+    c, m   = energy_model.predict(X_best)[0]
+    a_err, m_err = error_model.predict(X_best)[0]
+
+    # ───────── 7. 組裝說明 ─────────
+    explanation = format_explanation(rpm, hour, best_offset, (c, m, a_err, m_err), confidence, coverage)
+
+    if return_confidence:
+        return explanation, best_offset, confidence
+    return explanation, best_offset
+
+
+@timed("cooler_optimizer_batch_seconds", "find_optimal_temp_offsets_batch 執行時間")
+@profiled("optimizer")
+def find_optimal_temp_offsets_batch(
+    requests,
+    *,
+    energy_model_path: str = None,
+    error_model_path: str  = None,
+    offset_min: float = 2.5,
+    offset_max: float = 8.5,
+    offset_step: float = 0.1,
+    coverage: float = DEFAULT_COVERAGE,
+    max_relative_width: float = 0.5,
+):
+    """
+    一次處理多組 (rpm, hour)，回傳 [(explanation, best_offset, confidence), ...]。
+    所有請求 × 全部候選 offset 合成一個矩陣，每個模型只預測一次並逐列取成本最小者
+    （與 Optuna 搜尋相同的 offset 網格，但完整窮舉）；信心判斷規則同 find_optimal_temp_offset。
+    """
+    pairs = np.asarray(requests, dtype=float).reshape(-1, 2)
+    if not len(pairs):
+        return []
+    energy_model_path, error_model_path = resolve_model_paths(energy_model_path, error_model_path)
+    energy_model = load_model(Path(energy_model_path))
+    error_model  = load_model(Path(error_model_path))
+    ensemble     = load_ensemble(energy_model_path)
+    model_key    = (str(energy_model_path), str(error_model_path))
+
+    # ───────── 1. 所有請求 × 候選 offset 一次預測 ─────────
+    offsets = offset_grid(offset_min, offset_max, offset_step)
+    n_offsets = len(offsets)
+    X = pd.DataFrame({"RPM": np.repeat(pairs[:, 0], n_offsets), "Hour": np.repeat(pairs[:, 1], n_offsets),
+                      "TempOffset": np.tile(offsets, len(pairs))})
+    with timed("cooler_model_predict_seconds", "模型單次預測耗時", model="energy_batch"):
+        energy = energy_model.predict(X)
+    with timed("cooler_model_predict_seconds", "模型單次預測耗時", model="error_batch"):
+        error = error_model.predict(X)
+    weights = np.repeat(np.array([weight_rules(rpm, hour) for rpm, hour in pairs]), n_offsets, axis=0)
+    costs = (weights[:, 0] * np.abs(error[:, 0]) +
+             weights[:, 1] * (energy[:, 0] + energy[:, 1]) +
+             weights[:, 2] * np.abs(error[:, 1]))
+    best_idx = costs.reshape(len(pairs), n_offsets).argmin(axis=1)
+    confidences = [{"level": "unknown", "mode": "optimized", "in_envelope": None,
+                    "reasons": [] if ensemble is not None else [NO_ENSEMBLE_REASON]}
+                   for _ in pairs]
+
+    # ───────── 2. 信心檢查：超出範圍或區間過寬改用保守值 ─────────
+    if ensemble is not None:
+        in_envelope, reasons = ensemble.envelope_check(
+            np.column_stack([pairs, np.full(len(pairs), (offset_min + offset_max) / 2)]))
+        inside = [i for i in range(len(pairs)) if in_envelope[i]]
+        conservative = []
+        # 先判斷範圍內的請求，同一批中的高信心結果也能供範圍外的請求沿用
+        summaries = (interval_summaries(ensemble, [[*pairs[i], offsets[best_idx[i]]] for i in inside], coverage)
+                     if inside else [])
+        for i, (_, widths) in zip(inside, summaries):
+            confidences[i]["in_envelope"] = True
+            if max(widths.values()) > max_relative_width:
+                confidences[i]["level"] = "low"
+                confidences[i]["reasons"].append("預測區間過寬")
+                conservative.append(i)
+            else:
+                confidences[i]["level"] = "high"
+                _remember_confident((model_key, float(pairs[i, 0]), float(pairs[i, 1])),
+                                    float(offsets[best_idx[i]]))
+        for i in range(len(pairs)):
+            if in_envelope[i]:
+                continue
+            confidences[i].update(level="low", in_envelope=False, reasons=reasons[i])
+            nearest = _nearest_confident(model_key, pairs[i, 0], pairs[i, 1], ensemble)
+            if nearest is not None:
+                _, near_rpm, near_hour, cached_offset = nearest
+                best_idx[i] = int(np.argmin(np.abs(offsets - cached_offset)))
+                confidences[i]["mode"] = "cached"
+                confidences[i]["reasons"].append(f"沿用 RPM={near_rpm:.0f}, Hour={near_hour:g} 的高信心結果")
+            else:
+                conservative.append(i)
+        if conservative:
+            best_idx[conservative] = conservative_offset_indices(ensemble, pairs[conservative], offsets, coverage)
+            for i in conservative:
+                confidences[i]["mode"] = "conservative"
+        summaries = interval_summaries(ensemble, [[*pair, offsets[j]] for pair, j in zip(pairs, best_idx)], coverage)
+        for confidence, (intervals, widths) in zip(confidences, summaries):
+            confidence["intervals"], confidence["relative_width"] = intervals, widths
+
+    # ───────── 3. 組裝結果 ─────────
+    results = []
+    for i, (rpm, hour) in enumerate(pairs):
+        row = i * n_offsets + best_idx[i]
+        best_offset = float(offsets[best_idx[i]])
+        prediction = (energy[row, 0], energy[row, 1], error[row, 0], error[row, 1])
+        explanation = format_explanation(rpm, hour, best_offset, prediction, confidences[i], coverage)
+        results.append((explanation, best_offset, confidences[i]))
+    return results
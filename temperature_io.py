@@ -0,0 +1,262 @@
+"""
+temperature_log 的批次匯出與匯入。
+
+匯出以 SQLite 游標逐批 fetchmany（預設每批 50,000 筆）讀取，每批寫完即丟棄，
+記憶體用量與資料表大小無關；匯入同樣逐批讀檔、以 executemany 寫入，整個檔案一個交易。
+
+支援格式（依副檔名判斷，或以 --format 指定）：
+    .csv / .csv.gz          欄位 timestamp, sensor_liquid, sensor_reference, set_temperature
+    .parquet / .pq          需要 pyarrow；timestamp 為 timestamp[s] 型別
+    .arrow / .feather / .ipc  Arrow IPC 檔案格式，需要 pyarrow
+
+    python temperature_io.py export backup.parquet --start 2025-01-01 --end 2025-02-01
+    python temperature_io.py export all.csv.gz
+    python temperature_io.py import backup.parquet --db restored.db
+    python temperature_io.py import field_export.arrow --after-latest   # 只匯入比資料庫最新一筆更新的資料
+
+    from temperature_io import export_log, import_log
+    export_log("temperature_log.db", "january.arrow", start="2025-01-01", end="2025-02-01")
+"""
+import os
+import csv
+import gzip
+import time
+import sqlite3
+import logging
+import argparse
+
+import temperature_store
+from temperature_store import CHANNELS, TIMESTAMP_FORMAT
+
+COLUMNS = ("timestamp",) + CHANNELS
+DEFAULT_BATCH_SIZE = 50_000
+FORMATS = {".csv": "csv", ".csv.gz": "csv", ".parquet": "parquet", ".pq": "parquet",
+           ".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow"}
+
+
+def detect_format(path: str) -> str:
+    lower = path.lower()
+    for ext in sorted(FORMATS, key=len, reverse=True):
+        if lower.endswith(ext):
+            return FORMATS[ext]
+    raise ValueError(f"無法由副檔名判斷格式：{path}（支援 {', '.join(FORMATS)}）")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("Parquet／Arrow 格式需要 pyarrow：pip install pyarrow") from None
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    return pa.schema([("timestamp", pa.timestamp("s"))] + [(name, pa.float64()) for name in CHANNELS])
+
+
+# -----------------------------
+# 讀取資料表：游標逐批 fetchmany
+# -----------------------------
+def iter_batches(conn, start: str = None, end: str = None, batch_size: int = DEFAULT_BATCH_SIZE):
+    """依時間順序逐批回傳 [(timestamp, sensor_liquid, sensor_reference, set_temperature)]。"""
+    sql = f"SELECT {', '.join(COLUMNS)} FROM temperature_log"
+    clauses, params = [], []
+    if start:
+        clauses.append("timestamp >= ?")
+        params.append(start)
+    if end:
+        clauses.append("timestamp < ?")
+        params.append(end)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    cursor = conn.execute(sql + " ORDER BY timestamp, id", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+# -----------------------------
+# 匯出
+# -----------------------------
+def _export_csv(batches, path: str) -> int:
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    rows = 0
+    with opener(path, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for batch in batches:
+            writer.writerows(batch)
+            rows += len(batch)
+    return rows
+
+
+def _to_record_batch(pa, schema, rows):
+    import pyarrow.compute as pc
+
+    columns = list(zip(*rows))
+    timestamps = pc.strptime(pa.array(columns[0], pa.string()), format=TIMESTAMP_FORMAT, unit="s")
+    arrays = [timestamps] + [pa.array(values, pa.float64()) for values in columns[1:]]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _export_arrow(batches, path: str, fmt: str) -> int:
+    pa = _require_pyarrow()
+    schema = _arrow_schema(pa)
+    rows = 0
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+        write = writer.write_batch
+    else:
+        writer = pa.ipc.new_file(path, schema)
+        write = writer.write_batch
+    try:
+        for batch in batches:
+            write(_to_record_batch(pa, schema, batch))
+            rows += len(batch)
+    finally:
+        writer.close()
+    return rows
+
+
+def export_log(db_path: str, out_path: str, fmt: str = None, start: str = None, end: str = None,
+               batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """把 temperature_log 的 [start, end) 匯出到檔案，回傳 rows／bytes／seconds。"""
+    fmt = fmt or detect_format(out_path)
+    begin = time.perf_counter()
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        batches = iter_batches(conn, start, end, batch_size)
+        rows = _export_csv(batches, out_path) if fmt == "csv" else _export_arrow(batches, out_path, fmt)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - begin
+    logging.info(f"匯出 {rows} 筆 → {out_path}（{elapsed:.2f} s）")
+    return {"rows": rows, "bytes": os.path.getsize(out_path), "seconds": elapsed, "format": fmt}
+
+
+# -----------------------------
+# 匯入
+# -----------------------------
+def _read_csv(path: str, batch_size: int):
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, "rt", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        if tuple(header) != COLUMNS:
+            raise ValueError(f"CSV 欄位應為 {', '.join(COLUMNS)}，實際為 {', '.join(header)}")
+        batch = []
+        for ts, liquid, reference, setpoint in reader:
+            batch.append((ts, float(liquid), float(reference), float(setpoint)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _from_record_batch(record_batch):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    timestamps = record_batch.column("timestamp")
+    if pa.types.is_timestamp(timestamps.type):
+        # Parquet 不支援秒精度，讀回為 timestamp[ms]；先轉回秒，strftime 才不會帶小數
+        timestamps = pc.strftime(timestamps.cast(pa.timestamp("s"), safe=False), format=TIMESTAMP_FORMAT)
+    columns = [timestamps.to_pylist()] + [record_batch.column(name).to_pylist() for name in CHANNELS]
+    return list(zip(*columns))
+
+
+def _read_arrow(path: str, fmt: str, batch_size: int):
+    pa = _require_pyarrow()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=list(COLUMNS)):
+            yield _from_record_batch(record_batch)
+        return
+    with pa.memory_map(path) as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            record_batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            source.seek(0)
+            record_batches = pa.ipc.open_stream(source)   # Arrow IPC 串流格式
+        for record_batch in record_batches:
+            for offset in range(0, record_batch.num_rows, batch_size):
+                yield _from_record_batch(record_batch.slice(offset, batch_size))
+
+
+def import_log(db_path: str, in_path: str, fmt: str = None, after_latest: bool = False,
+               batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """
+    把檔案匯入 temperature_log（逐批 executemany，整個檔案一個交易）。
+    after_latest=True 時略過時間不晚於資料庫最新一筆的資料，可重複匯入同一份現場匯出而不重複。
+    """
+    fmt = fmt or detect_format(in_path)
+    begin = time.perf_counter()
+    batches = _read_csv(in_path, batch_size) if fmt == "csv" else _read_arrow(in_path, fmt, batch_size)
+    conn = sqlite3.connect(db_path)
+    temperature_store.ensure_schema(conn)
+    latest = None
+    if after_latest:
+        latest = conn.execute("SELECT MAX(timestamp) FROM temperature_log").fetchone()[0]
+    imported = skipped = 0
+    try:
+        for batch in batches:
+            if latest is not None:
+                kept = [row for row in batch if row[0] > latest]
+                skipped += len(batch) - len(kept)
+                batch = kept
+            conn.executemany(
+                "INSERT INTO temperature_log (timestamp, sensor_liquid, sensor_reference, set_temperature) "
+                "VALUES (?, ?, ?, ?)", batch)
+            imported += len(batch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - begin
+    logging.info(f"匯入 {imported} 筆（略過 {skipped} 筆）← {in_path}（{elapsed:.2f} s）")
+    return {"rows": imported, "skipped": skipped, "seconds": elapsed, "format": fmt}
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    parser = argparse.ArgumentParser(description="temperature_log 批次匯出／匯入")
+    parser.add_argument("--db", default=temperature_store.DB_PATH)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="匯出為 CSV／Parquet／Arrow IPC")
+    p_export.add_argument("path")
+    p_export.add_argument("--format", choices=sorted(set(FORMATS.values())))
+    p_export.add_argument("--start", help="起始時間（含），例如 2025-01-01 或 2025-01-01 08:00:00")
+    p_export.add_argument("--end", help="結束時間（不含）")
+    p_import = sub.add_parser("import", help="由 CSV／Parquet／Arrow IPC 匯入")
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=sorted(set(FORMATS.values())))
+    p_import.add_argument("--after-latest", action="store_true", help="只匯入比資料庫最新一筆更新的資料")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            result = export_log(args.db, args.path, args.format, args.start, args.end, args.batch_size)
+            print(f"已匯出 {result['rows']} 筆 → {args.path}（{result['bytes'] / 1024 / 1024:.1f} MB，"
+                  f"{result['seconds']:.2f} s，{result['rows'] / max(result['seconds'], 1e-9):.0f} 筆/s）")
+        else:
+            result = import_log(args.db, args.path, args.format, args.after_latest, args.batch_size)
+            print(f"已匯入 {result['rows']} 筆（略過 {result['skipped']} 筆）← {args.path}"
+                  f"（{result['seconds']:.2f} s，{result['rows'] / max(result['seconds'], 1e-9):.0f} 筆/s）")
+    except (ValueError, RuntimeError, OSError, sqlite3.Error) as e:
+        print(f"失敗：{e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
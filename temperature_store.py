@@ -0,0 +1,233 @@
+import math
+import sqlite3
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+DB_PATH = 'temperature_log.db'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+CHANNELS = ("sensor_liquid", "sensor_reference", "set_temperature")
+
+# 一次擷取的溫度樣本（°C）；timestamp 為 datetime
+Sample = namedtuple("Sample", ("timestamp",) + CHANNELS)
+
+
+def sample_from_registers(values, timestamp: datetime = None) -> Sample:
+    """由 Modbus 輸入暫存器 0x0004–0x0006 的原始值換算成樣本（液溫／參考 ×100、設定 ×10）。"""
+    return Sample(timestamp or datetime.now(), values[0] / 100.0, values[1] / 100.0, values[2] / 10.0)
+
+
+def connect(db_path: str = None):
+    """建立 temperature_log 資料庫連線（允許跨執行緒使用）。"""
+    return sqlite3.connect(db_path or DB_PATH, check_same_thread=False)
+
+
+def ensure_schema(conn):
+    """建立 temperature_log 資料表與時間索引（如果尚未存在的話）"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS temperature_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            sensor_liquid REAL,
+            sensor_reference REAL,
+            set_temperature REAL
+        )
+    ''')
+    # 時間字串為 "YYYY-MM-DD HH:MM:SS"，字典序即時間序，可直接用索引做區間查詢
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_temperature_log_timestamp
+        ON temperature_log (timestamp)
+    ''')
+    conn.commit()
+
+
+def _format(ts: datetime) -> str:
+    return ts.strftime(TIMESTAMP_FORMAT)
+
+
+def insert_samples(conn, samples, commit: bool = True):
+    """批次寫入樣本（executemany）；commit=False 時由呼叫端決定提交時機。"""
+    conn.executemany(
+        "INSERT INTO temperature_log (timestamp, sensor_liquid, sensor_reference, set_temperature) "
+        "VALUES (?, ?, ?, ?)",
+        [(_format(s.timestamp), s.sensor_liquid, s.sensor_reference, s.set_temperature) for s in samples],
+    )
+    if commit:
+        conn.commit()
+
+
+def fetch_range_downsampled(conn, start: datetime, end: datetime, max_points: int = 2000):
+    """
+    取出 [start, end) 區間的溫度資料，並在資料庫端以 min/max 分桶降採樣：
+    每個時間桶輸出兩列（各通道的最小值與最大值），總列數不超過 max_points，
+    因此 30 天的視窗也只會傳回數千點，且保留尖峰。
+    區間內原始筆數不超過 max_points 時直接回傳原始資料。
+
+    回傳 (rows, last_id)：rows 為 (timestamp, sensor_liquid, sensor_reference, set_temperature)，
+    last_id 為查詢當下資料表最大的 id，可供 fetch_since 增量更新。
+    """
+    start_str, end_str = _format(start), _format(end)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(id) FROM temperature_log")
+    last_id = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT COUNT(*) FROM temperature_log WHERE timestamp >= ? AND timestamp < ?",
+        (start_str, end_str),
+    )
+    count = cursor.fetchone()[0]
+    if not count:
+        return [], last_id
+
+    if count <= max_points:
+        cursor.execute(
+            "SELECT timestamp, sensor_liquid, sensor_reference, set_temperature "
+            "FROM temperature_log WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp",
+            (start_str, end_str),
+        )
+        return cursor.fetchall(), last_id
+
+    n_buckets = max(1, max_points // 2 - 1)
+    span_s = max(1.0, (end - start).total_seconds())
+    bucket_s = max(1, math.ceil(span_s / n_buckets))
+    # SQLite 的 strftime('%s') 把時間字串視為 UTC，這裡以相同方式換算起點
+    start_epoch = int((start - datetime(1970, 1, 1)).total_seconds())
+
+    channel_aggs = ", ".join(f"MIN({c}), MAX({c})" for c in CHANNELS)
+    cursor.execute(
+        f"""
+        SELECT (CAST(strftime('%s', timestamp) AS INTEGER) - ?) / ? AS bucket, {channel_aggs}
+        FROM temperature_log
+        WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY bucket
+        ORDER BY bucket
+        """,
+        (start_epoch, bucket_s, start_str, end_str),
+    )
+
+    rows = []
+    for bucket, *aggs in cursor.fetchall():
+        bucket_start = start + timedelta(seconds=bucket * bucket_s)
+        mins = aggs[0::2]
+        maxs = aggs[1::2]
+        rows.append((_format(bucket_start), *mins))
+        rows.append((_format(bucket_start + timedelta(seconds=bucket_s / 2)), *maxs))
+    logging.info(f"降採樣 {count} 筆 → {len(rows)} 點（每桶 {bucket_s} 秒）")
+    return rows, last_id
+
+
+def fetch_since(conn, last_id: int, limit: int = 10000):
+    """取出 id 大於 last_id 的新資料，回傳 (rows, new_last_id)，供圖表增量附加。"""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, timestamp, sensor_liquid, sensor_reference, set_temperature "
+        "FROM temperature_log WHERE id > ? ORDER BY id LIMIT ?",
+        (last_id or 0, limit),
+    )
+    fetched = cursor.fetchall()
+    if not fetched:
+        return [], last_id
+    return [row[1:] for row in fetched], fetched[-1][0]
+
+
+def _fetch_from_service(total_seconds):
+    """向 cooler_app 的近期樣本緩衝區查詢；服務未啟動或超出緩衝範圍時回傳 None。"""
+    from sample_ring import query_service
+
+    if total_seconds is None:
+        reply = query_service("[SampleLatest]")
+    else:
+        reply = query_service(f"[SampleNearest]: {total_seconds}")
+    if not reply or not reply.get("found"):
+        return None
+    return reply
+
+
+def fetch_cooler_temperature(delta_seconds: int = None, delta_minutes: int = None, db_path: str = None,
+                             use_service: bool = True):
+    """
+    抓取最新溫度記錄。
+    若給定 delta_seconds（以秒計）或 delta_minutes（以分鐘計），
+    會抓取與當前時間前對應時間點最接近的記錄，
+    並回傳目前時間、目標時間與該筆資料的時間。
+    use_service=True 時先查 cooler_app 的記憶體緩衝區（見 sample_ring.py），
+    超出緩衝範圍或服務未啟動時才查資料庫。
+    """
+    try:
+        # 取得目前時間並記錄
+        now = datetime.now()
+        current_time_str = now.strftime("%Y-%m-%d %H:%M:%S")
+        logging.info(f"取得目前時間：{current_time_str}")
+
+        # 決定要回溯的秒數
+        if delta_minutes is not None:
+            total_seconds = delta_minutes * 60
+            target_time = now - timedelta(seconds=total_seconds)
+            unit, amount = "分鐘", delta_minutes
+        elif delta_seconds is not None:
+            total_seconds = delta_seconds
+            target_time = now - timedelta(seconds=total_seconds)
+            unit, amount = "秒鐘", delta_seconds
+        else:
+            total_seconds = None
+
+        target_info = ""
+        if total_seconds is not None:
+            target_time_str = target_time.strftime("%Y-%m-%d %H:%M:%S")
+            logging.info(f"目標時間計算：{target_time_str} (當前時間減 {amount}{unit})")
+            target_info = f"目標時間（{amount}{unit}前）：{target_time_str}\n"
+
+        if use_service:
+            reply = _fetch_from_service(total_seconds)
+            if reply is not None:
+                logging.info(f"由記憶體緩衝區取得記錄：{reply}")
+                record_time = reply["timestamp"].replace("T", " ")
+                return (
+                    f"記錄來源: 即時緩衝區, 時間={record_time}\n"
+                    f"目前時間：{current_time_str}\n"
+                    f"{target_info}"
+                    f"資料記錄時間：{record_time}\n"
+                    f"液態溫度={reply['sensor_liquid']}°C, 參考溫度={reply['sensor_reference']}°C, "
+                    f"設定溫度={reply['set_temperature']}°C"
+                )
+
+        # 建立資料庫連線
+        conn = connect(db_path)
+        logging.info("成功建立資料庫連線")
+        cursor = conn.cursor()
+
+        if total_seconds is not None:
+            query = """
+            SELECT *, ABS(strftime('%s', timestamp) - strftime('%s', ?)) AS diff
+            FROM temperature_log
+            ORDER BY diff ASC LIMIT 1;
+            """
+            logging.info(f"執行 SQL 查詢：{query.strip()}，參數：{target_time_str}")
+            cursor.execute(query, (target_time_str,))
+        else:
+            query = "SELECT * FROM temperature_log ORDER BY id DESC LIMIT 1;"
+            logging.info(f"執行 SQL 查詢：{query}")
+            cursor.execute(query)
+
+        row = cursor.fetchone()
+        logging.info(f"取得查詢結果：{row}")
+        conn.close()
+        logging.info("關閉資料庫連線")
+
+        if row:
+            record_time = row[1]  # 假設第2個欄位為 timestamp
+            result = (
+                f"記錄總數: ID={row[0]}, 時間={row[1]}\n"
+                f"目前時間：{current_time_str}\n"
+                f"{target_info}"
+                f"資料記錄時間：{record_time}\n"
+                f"液態溫度={row[2]}°C, 參考溫度={row[3]}°C, 設定溫度={row[4]}°C"
+            )
+            logging.info("成功取得記錄並生成結果字串")
+            return result
+        else:
+            logging.warning("查詢結果為空，資料庫中沒有記錄")
+            return f"目前時間：{current_time_str}\n資料庫中沒有記錄."
+    except Exception as e:
+        logging.error(f"Database error: {e}")
+        return f"資料庫錯誤: {e}"
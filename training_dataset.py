@@ -1,3 +1,12 @@
+import os
+import json
+import time
+import logging
+import argparse
+from math import comb
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import numpy as np
 
@@ -6,16 +15,20 @@ from sklearn.multioutput import MultiOutputRegressor
 from sklearn.pipeline import make_pipeline
 from sklearn.linear_model import Ridge
 from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import KFold, LeaveOneGroupOut
 
 from joblib import dump
 
+from data_ingestion import load_training_data
+
 
-def load_and_preprocess(path: str, sep: str = '\t') -> pd.DataFrame:
+def load_and_preprocess(path, sep: str = '\t', use_cache: bool = True) -> pd.DataFrame:
     """
-    載入並預處理資料：讀取 CSV，移除空值。
+    載入並預處理資料：path 可為單一檔案、目錄或多個路徑（CSV/TSV 與 Parquet），
+    依 data_ingestion 的 schema 驗證，排除空白列、未量測列與有問題的列。
     """
-    df = pd.read_csv(path, sep=sep)
-    df = df.dropna()
+    df, report = load_training_data(path, sep=sep, use_cache=use_cache)
+    logging.info(report.summary())
     return df
 
 
@@ -62,12 +75,250 @@ def evaluate_models(energy_model, error_model, X, y_energy, y_error):
     return mse_energy, mse_error
 
 
+# -----------------------------
+# 交叉驗證超參數搜尋
+# -----------------------------
+FEATURES = ['RPM', 'Hour', 'TempOffset']
+ENERGY_TARGETS = ['CoolerPower', 'MachinePower']
+ERROR_TARGETS = ['AvgError', 'MaxError']
+TARGETS = ENERGY_TARGETS + ERROR_TARGETS
+
+DEFAULT_DEGREES = list(range(1, 11))
+DEFAULT_ALPHAS = [0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0]
+
+# 原本固定的設定，報告中作為比較基準
+BASELINE_PARAMS = {
+    'CoolerPower': (10, 0.03), 'MachinePower': (10, 0.03),
+    'AvgError': (5, 0.1), 'MaxError': (5, 0.1),
+}
+
+# 工作行程共用的快取（由 _init_worker 設定一次，之後每個 fold 直接取用）
+_worker_cache = {}
+
+
+def poly_feature_count(n_features: int, degree: int) -> int:
+    """含 bias 的多項式特徵數 C(n + d, d)。"""
+    return comb(n_features + degree, degree)
+
+
+def build_poly_cache(X: pd.DataFrame, max_degree: int) -> np.ndarray:
+    """
+    只計算一次最高次數的多項式特徵矩陣。
+    PolynomialFeatures 依總次數由低到高排列，因此 d 次的特徵
+    就是前 C(n + d, d) 欄，較低次數直接切片即可，不必每個 fold 重算。
+    多項式展開是逐列運算、不需擬合，整份資料一起算不會洩漏驗證資料。
+    """
+    return PolynomialFeatures(degree=max_degree, include_bias=True).fit_transform(X.to_numpy(dtype=float))
+
+
+def make_cv_splits(df: pd.DataFrame, cv: str = 'kfold', n_splits: int = 5,
+                   group_by=('RPM',), seed: int = 42):
+    """回傳 [(train_idx, val_idx), ...]；cv 為 'kfold' 或 'logo'（leave-one-group-out）。"""
+    if cv == 'logo':
+        groups = df[list(group_by)].astype(str).agg('|'.join, axis=1)
+        return list(LeaveOneGroupOut().split(df, groups=groups))
+    n_splits = min(n_splits, len(df))
+    return list(KFold(n_splits=n_splits, shuffle=True, random_state=seed).split(df))
+
+
+def _init_worker(poly_cache, y, splits):
+    # 限制每個工作行程的 BLAS 執行緒，避免與行程池互相搶核心
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(1)
+    except ImportError:
+        pass
+    _worker_cache.update(poly=poly_cache, y=y, splits=splits)
+
+
+def _score_degree_fold(degree: int, fold: int, alphas):
+    """
+    單一工作單元：某次數在某 fold 上對所有 alpha 與所有目標的驗證 MSE。
+    Ridge 對多欄 y 各欄獨立求解，一次擬合即可同時得到四個目標的結果。
+    """
+    poly, y, splits = _worker_cache['poly'], _worker_cache['y'], _worker_cache['splits']
+    train_idx, val_idx = splits[fold]
+    n_cols = poly_feature_count(len(FEATURES), degree)
+    X_train = poly[train_idx, :n_cols]
+    X_val = poly[val_idx, :n_cols]
+
+    scaler = StandardScaler().fit(X_train)
+    X_train = scaler.transform(X_train)
+    X_val = scaler.transform(X_val)
+
+    results = []
+    for alpha in alphas:
+        ridge = Ridge(alpha=alpha).fit(X_train, y[train_idx])
+        mse = mean_squared_error(y[val_idx], ridge.predict(X_val), multioutput='raw_values')
+        results.append((alpha, mse.tolist()))
+    return degree, fold, results
+
+
+def grid_search_cv(df: pd.DataFrame, degrees=None, alphas=None, cv: str = 'kfold',
+                   n_splits: int = 5, group_by=('RPM',), n_jobs: int = None, seed: int = 42):
+    """
+    在行程池上對每個目標搜尋多項式次數與 Ridge alpha。
+    工作單元為 (degree, fold)，數量隨網格與 fold 成長，可隨核心數線性擴充。
+    回傳 dict：target -> {(degree, alpha): [各 fold 的 MSE]}，以及使用的 splits。
+    """
+    degrees = sorted(degrees or DEFAULT_DEGREES)
+    alphas = list(alphas or DEFAULT_ALPHAS)
+    splits = make_cv_splits(df, cv=cv, n_splits=n_splits, group_by=group_by, seed=seed)
+    poly_cache = build_poly_cache(df[FEATURES], max(degrees))
+    y = df[TARGETS].to_numpy(dtype=float)
+
+    scores = {target: {} for target in TARGETS}
+    tasks = [(degree, fold) for degree in degrees for fold in range(len(splits))]
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    def collect(degree, fold, results):
+        for alpha, mse in results:
+            for target, value in zip(TARGETS, mse):
+                scores[target].setdefault((degree, alpha), [None] * len(splits))[fold] = value
+
+    if n_jobs == 1:
+        _init_worker(poly_cache, y, splits)
+        for degree, fold in tasks:
+            collect(*_score_degree_fold(degree, fold, alphas))
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks)), initializer=_init_worker,
+                                 initargs=(poly_cache, y, splits)) as pool:
+            futures = [pool.submit(_score_degree_fold, degree, fold, alphas) for degree, fold in tasks]
+            for future in as_completed(futures):
+                collect(*future.result())
+    return scores, splits
+
+
+def select_best_params(scores):
+    """依平均驗證 MSE 為每個目標挑選最佳 (degree, alpha)。"""
+    best = {}
+    for target, grid in scores.items():
+        (degree, alpha), fold_mse = min(grid.items(), key=lambda item: np.mean(item[1]))
+        best[target] = {'degree': degree, 'alpha': alpha,
+                        'cv_mse': float(np.mean(fold_mse)), 'cv_mse_std': float(np.std(fold_mse))}
+    return best
+
+
+def make_target_pipeline(degree: int, alpha: float):
+    return make_pipeline(
+        PolynomialFeatures(degree=degree, include_bias=True),
+        StandardScaler(),
+        Ridge(alpha=alpha)
+    )
+
+
+def fit_multioutput(df: pd.DataFrame, targets, params) -> MultiOutputRegressor:
+    """
+    以各目標各自的最佳參數擬合，組成與原本相同介面的 MultiOutputRegressor
+    （predict 回傳各目標欄位），temp_optimizer 可直接載入使用。
+    """
+    X = df[FEATURES]
+    estimators = [make_target_pipeline(params[t]['degree'], params[t]['alpha']).fit(X, df[t])
+                  for t in targets]
+    model = MultiOutputRegressor(make_target_pipeline(params[targets[0]]['degree'],
+                                                      params[targets[0]]['alpha']))
+    model.estimators_ = estimators
+    model.n_features_in_ = len(FEATURES)
+    model.feature_names_in_ = np.array(FEATURES, dtype=object)
+    return model
+
+
+def build_validation_report(df, scores, best, splits, cv, group_by, energy_model, error_model):
+    """整理驗證報告：最佳參數、交叉驗證 MSE、與原本固定設定的比較、訓練集 MSE。"""
+    mse_energy, mse_error = evaluate_models(
+        energy_model, error_model, df[FEATURES], df[ENERGY_TARGETS], df[ERROR_TARGETS])
+    train_mse = dict(zip(TARGETS, [*mse_energy, *mse_error]))
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'n_samples': int(len(df)),
+        'cv': {'method': cv, 'n_folds': len(splits),
+               'group_by': list(group_by) if cv == 'logo' else None},
+        'targets': {},
+    }
+    for target in TARGETS:
+        entry = dict(best[target])
+        entry['train_mse'] = float(train_mse[target])
+        baseline = scores[target].get(BASELINE_PARAMS[target])
+        if baseline is not None:
+            entry['baseline'] = {'degree': BASELINE_PARAMS[target][0], 'alpha': BASELINE_PARAMS[target][1],
+                                 'cv_mse': float(np.mean(baseline))}
+        entry['grid'] = [
+            {'degree': degree, 'alpha': alpha, 'cv_mse': float(np.mean(fold_mse))}
+            for (degree, alpha), fold_mse in sorted(scores[target].items())
+        ]
+        report['targets'][target] = entry
+    return report
+
+
+def run_search(args):
+    """CLI：交叉驗證網格搜尋 → 以最佳參數重新擬合 → 輸出模型與驗證報告。"""
+    df = load_and_preprocess(args.data, use_cache=not args.no_cache)
+    group_by = tuple(g.strip() for g in args.group_by.split(','))
+
+    start = time.perf_counter()
+    scores, splits = grid_search_cv(
+        df, degrees=args.degrees, alphas=args.alphas, cv=args.cv,
+        n_splits=args.folds, group_by=group_by, n_jobs=args.jobs, seed=args.seed,
+    )
+    best = select_best_params(scores)
+    elapsed = time.perf_counter() - start
+
+    energy_model = fit_multioutput(df, ENERGY_TARGETS, best)
+    error_model = fit_multioutput(df, ERROR_TARGETS, best)
+
+    report = build_validation_report(df, scores, best, splits, args.cv, group_by, energy_model, error_model)
+    report['search_seconds'] = round(elapsed, 3)
+    report['n_jobs'] = args.jobs or os.cpu_count()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    dump(energy_model, os.path.join(args.output_dir, 'energy_model_poly_ridge.joblib'))
+    dump(error_model, os.path.join(args.output_dir, 'error_model_poly_ridge.joblib'))
+    report_path = os.path.join(args.output_dir, args.report)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"—— 交叉驗證（{args.cv}，{len(splits)} folds，{elapsed:.1f}s） ——")
+    for target in TARGETS:
+        entry = report['targets'][target]
+        line = (f"{target:<13} degree={entry['degree']:<2} alpha={entry['alpha']:<6g} "
+                f"CV MSE={entry['cv_mse']:.4f} ± {entry['cv_mse_std']:.4f}")
+        if 'baseline' in entry:
+            line += f"（原設定 {entry['baseline']['cv_mse']:.4f}）"
+        print(line)
+    print(f"模型與報告已寫入 {args.output_dir}（{report_path}）")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="訓練冷卻機能耗與誤差模型")
+    parser.add_argument('--data', nargs='+', default=["Cooling_Machine_Data_EN.csv"],
+                        help="訓練資料檔或目錄（tab 分隔文字檔或 Parquet），可多個")
+    parser.add_argument('--no-cache', action='store_true', help="不使用已解析的資料快取")
+    parser.add_argument('--search', action='store_true',
+                        help="以交叉驗證網格搜尋每個目標的多項式次數與 Ridge alpha")
+    parser.add_argument('--degrees', type=int, nargs='+', default=DEFAULT_DEGREES)
+    parser.add_argument('--alphas', type=float, nargs='+', default=DEFAULT_ALPHAS)
+    parser.add_argument('--cv', choices=['kfold', 'logo'], default='kfold',
+                        help="kfold 或 leave-one-group-out")
+    parser.add_argument('--folds', type=int, default=5, help="kfold 的 fold 數")
+    parser.add_argument('--group-by', default='RPM',
+                        help="logo 的分組欄位，逗號分隔（例如 RPM 或 RPM,Hour）")
+    parser.add_argument('--jobs', type=int, default=None, help="行程數（預設為全部核心）")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output-dir', default='.', help="模型與報告輸出目錄")
+    parser.add_argument('--report', default='validation_report.json')
+    return parser.parse_args()
+
+
 def main():
-    # 資料路徑
-    data_path = r"C:\Users\user\Desktop\python_data\Cooling_Machine_Data_EN.csv"
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args()
+    if args.search:
+        run_search(args)
+        return
 
     # 1. 載入與預處理
-    df = load_and_preprocess(data_path)
+    df = load_and_preprocess(args.data, use_cache=not args.no_cache)
 
     # 2. 訓練模型
     energy_model, error_model, X, y_energy, y_error = train_models(df)
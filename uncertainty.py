@@ -0,0 +1,186 @@
+"""
+模型預測的不確定性：bootstrap 集成的預測區間與訓練資料範圍（envelope）檢查。
+
+訓練資料只有 18 筆（RPM 1500/6000/12000、Hour 1/2），高次多項式在範圍外會嚴重外插。
+這裡以 bootstrap 重抽樣訓練 N 組與正式模型同結構的 PolynomialFeatures → StandardScaler → Ridge，
+並把每組的標準化與 Ridge 係數合併成一個等效的線性係數矩陣，
+任意多個 (RPM, Hour, TempOffset) 點 × 全部集成成員只需每個目標一次矩陣乘法。
+
+    python uncertainty.py build --data Cooling_Machine_Data_EN.csv --members 100
+
+online_learning.py 的 init 發佈版本時一併建立集成；update 沿用前一版本的集成（生產紀錄不保留原始資料，
+無法重新抽樣），新資料的範圍要在重新 build 後才會納入 envelope。
+"""
+import os
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+from joblib import dump
+from sklearn.preprocessing import PolynomialFeatures
+
+import model_store
+from training_dataset import (
+    FEATURES, ENERGY_TARGETS, ERROR_TARGETS, TARGETS, load_and_preprocess, make_target_pipeline,
+)
+
+# envelope 以外擴的比例（相對於各特徵的訓練範圍），例如 0.1 代表允許超出範圍 10%
+DEFAULT_ENVELOPE_MARGIN = 0.1
+DEFAULT_COVERAGE = 0.9
+DEFAULT_MEMBERS = 100
+
+_warned_missing = set()
+
+
+def params_from_models(energy_model, error_model) -> dict:
+    """從已訓練的 MultiOutputRegressor 取出每個目標的多項式次數與 alpha。"""
+    params = {}
+    for model, targets in ((energy_model, ENERGY_TARGETS), (error_model, ERROR_TARGETS)):
+        for target, pipeline in zip(targets, model.estimators_):
+            params[target] = {
+                "degree": pipeline.named_steps["polynomialfeatures"].degree,
+                "alpha": pipeline.named_steps["ridge"].alpha,
+            }
+    return params
+
+
+def _effective_coefficients(pipeline):
+    """把 StandardScaler + Ridge 合併成作用在多項式特徵上的 (係數, 截距)。"""
+    scaler = pipeline.named_steps["standardscaler"]
+    ridge = pipeline.named_steps["ridge"]
+    coef = ridge.coef_ / scaler.scale_
+    intercept = ridge.intercept_ - scaler.mean_ @ coef
+    return coef, intercept
+
+
+class BootstrapEnsemble:
+    """bootstrap 集成，提供向量化的預測分布、區間與 envelope 檢查。"""
+
+    def __init__(self, params: dict, n_members: int = 100, seed: int = 42,
+                 envelope_margin: float = DEFAULT_ENVELOPE_MARGIN):
+        self.params = params
+        self.n_members = n_members
+        self.seed = seed
+        self.envelope_margin = envelope_margin
+        self.coef_ = {}          # target -> (p, n_members)
+        self.intercept_ = {}     # target -> (n_members,)
+        self.feature_min_ = None
+        self.feature_max_ = None
+        self.n_samples_ = 0
+
+    def fit(self, df: pd.DataFrame):
+        rng = np.random.default_rng(self.seed)
+        X = df[FEATURES].reset_index(drop=True)
+        y = df[TARGETS].reset_index(drop=True)
+        n = len(df)
+        samples = [rng.integers(0, n, size=n) for _ in range(self.n_members)]
+
+        for target in TARGETS:
+            degree, alpha = self.params[target]["degree"], self.params[target]["alpha"]
+            coefs, intercepts = [], []
+            for idx in samples:
+                pipeline = make_target_pipeline(degree, alpha).fit(X.iloc[idx], y[target].iloc[idx])
+                coef, intercept = _effective_coefficients(pipeline)
+                coefs.append(coef)
+                intercepts.append(intercept)
+            self.coef_[target] = np.column_stack(coefs)
+            self.intercept_[target] = np.array(intercepts)
+
+        values = X.to_numpy(dtype=float)
+        self.feature_min_ = values.min(axis=0)
+        self.feature_max_ = values.max(axis=0)
+        self.n_samples_ = n
+        return self
+
+    # ───────── 預測 ─────────
+    def predict_distribution(self, X) -> dict:
+        """回傳 target -> (n_points, n_members) 的預測矩陣；每個次數的多項式特徵只算一次。"""
+        values = np.asarray(X[FEATURES] if isinstance(X, pd.DataFrame) else X, dtype=float)
+        poly_by_degree = {}
+        result = {}
+        for target in TARGETS:
+            degree = self.params[target]["degree"]
+            if degree not in poly_by_degree:
+                poly_by_degree[degree] = PolynomialFeatures(degree=degree, include_bias=True).fit_transform(values)
+            result[target] = poly_by_degree[degree] @ self.coef_[target] + self.intercept_[target]
+        return result
+
+    def predict_intervals(self, X, coverage: float = DEFAULT_COVERAGE) -> dict:
+        """回傳 target -> {mean, std, lower, upper}，每個皆為長度 n_points 的陣列。"""
+        tail = (1 - coverage) / 2 * 100
+        intervals = {}
+        for target, members in self.predict_distribution(X).items():
+            lower, upper = np.percentile(members, [tail, 100 - tail], axis=1)
+            intervals[target] = {"mean": members.mean(axis=1), "std": members.std(axis=1),
+                                 "lower": lower, "upper": upper}
+        return intervals
+
+    def envelope_check(self, X):
+        """
+        檢查每個點是否落在訓練資料範圍內（各特徵的 min/max 外擴 envelope_margin）。
+        回傳 (in_envelope 布林陣列, 每點超出範圍的說明列表)。
+        """
+        values = np.asarray(X[FEATURES] if isinstance(X, pd.DataFrame) else X, dtype=float)
+        span = np.maximum(self.feature_max_ - self.feature_min_, 1e-9)
+        low = self.feature_min_ - self.envelope_margin * span
+        high = self.feature_max_ + self.envelope_margin * span
+        outside = (values < low) | (values > high)
+        reasons = []
+        for row, flags in zip(values, outside):
+            reasons.append([
+                f"{name}={value:g} 不在訓練範圍 {lo:g}–{hi:g}"
+                for name, value, lo, hi, flag in zip(FEATURES, row, self.feature_min_, self.feature_max_, flags)
+                if flag
+            ])
+        return ~outside.any(axis=1), reasons
+
+
+def ensemble_path_for(energy_model_path: str) -> str:
+    """集成檔與能耗模型放在同一目錄。"""
+    return os.path.join(os.path.dirname(os.path.abspath(energy_model_path)), model_store.ENSEMBLE_FILE)
+
+
+def load_ensemble(energy_model_path: str):
+    """
+    載入與模型同目錄的集成；不存在時回傳 None（最佳化器改以點預測運作，不做信心檢查），
+    並對每個路徑記錄一次警告。
+    """
+    path = ensemble_path_for(energy_model_path)
+    if not os.path.exists(path):
+        if path not in _warned_missing:
+            _warned_missing.add(path)
+            logging.warning(f"⚠️ {os.path.dirname(path)} 沒有預測區間集成，最佳化結果不做信心檢查；"
+                            f"請執行 python uncertainty.py build --data <訓練資料>")
+        return None
+    return model_store.load_model(path)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description="建立預測區間用的 bootstrap 集成")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build")
+    p_build.add_argument("--data", nargs="+", default=["Cooling_Machine_Data_EN.csv"])
+    p_build.add_argument("--members", type=int, default=DEFAULT_MEMBERS)
+    p_build.add_argument("--seed", type=int, default=42)
+    p_build.add_argument("--margin", type=float, default=DEFAULT_ENVELOPE_MARGIN,
+                         help="envelope 外擴比例")
+    p_build.add_argument("--energy-model", help="依此模型的結構建立集成，並存在同一目錄（預設為目前版本）")
+    p_build.add_argument("--error-model")
+    args = parser.parse_args()
+
+    energy_path, error_path = model_store.resolve_model_paths(args.energy_model, args.error_model)
+    params = params_from_models(model_store.load_model(energy_path), model_store.load_model(error_path))
+    df = load_and_preprocess(args.data)
+    # 以模組名稱引用類別，避免以腳本執行時被 pickle 成 __main__.BootstrapEnsemble
+    from uncertainty import BootstrapEnsemble as Ensemble
+    ensemble = Ensemble(params, n_members=args.members, seed=args.seed,
+                        envelope_margin=args.margin).fit(df)
+    output = ensemble_path_for(energy_path)
+    dump(ensemble, output)
+    print(f"已建立 {args.members} 組 bootstrap 集成（{len(df)} 筆資料）→ {output}")
+
+
+if __name__ == "__main__":
+    main()
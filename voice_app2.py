@@ -1,23 +1,17 @@
 import streamlit as st
 import socket
 import logging
-import sqlite3
-from joblib import load
-from langchain_experimental.llms.ollama_functions import OllamaFunctions
-from langchain_ollama import ChatOllama
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import SystemMessage
+from ollama_session import OllamaSessionManager
 
 # 新增語音處理所需套件
-import subprocess
-from gtts import gTTS
-from playsound import playsound
 import os
-import speech_recognition as sr
+from audio_pipeline import AudioPipeline, PhraseAudioCache
+from chat_store import ChatHistory
+import temperature_store
+from metrics import start_exporters_from_env
+from profiling import profile_scope, profiled, start_profiling_from_env
+from lazy_imports import lazy_module, timed_import, import_times
 from datetime import datetime, timedelta
-import re
-from collections import defaultdict
-import time
 import threading
 
 # 配置 logging
@@ -26,252 +20,32 @@ logging.basicConfig(level=logging.INFO,
 
 
 # -----------------------------
-# 與資料庫或模型相關的函式（略，與原程式相同）
+# 與資料庫或模型相關的函式（見 temperature_store.py、temp_optimizer.py）
+# optuna / scikit-learn / pandas / langchain 延遲到第一次使用時才載入（見 lazy_imports.py）
 # -----------------------------
-def fetch_cooler_temperature(delta_seconds: int = None, delta_minutes: int = None):
-    """
-    從資料庫中抓取最新溫度記錄。
-    若給定 delta_seconds（以秒計）或 delta_minutes（以分鐘計），
-    會抓取與當前時間前對應時間點最接近的記錄，
-    並回傳目前時間、目標時間與該筆資料的時間。
-    """
-    try:
-        # 取得目前時間並記錄
-        now = datetime.now()
-        current_time_str = now.strftime("%Y-%m-%d %H:%M:%S")
-        logging.info(f"取得目前時間：{current_time_str}")
-
-        # 建立資料庫連線
-        conn = sqlite3.connect('temperature_log.db', check_same_thread=False)
-        logging.info("成功建立資料庫連線")
-        cursor = conn.cursor()
-
-        # 決定要回溯的秒數
-        if delta_minutes is not None:
-            total_seconds = delta_minutes * 60
-            target_time = now - timedelta(seconds=total_seconds)
-            unit, amount = "分鐘", delta_minutes
-        elif delta_seconds is not None:
-            total_seconds = delta_seconds
-            target_time = now - timedelta(seconds=total_seconds)
-            unit, amount = "秒鐘", delta_seconds
-        else:
-            total_seconds = None
-
-        target_info = ""
-        if total_seconds is not None:
-            target_time_str = target_time.strftime("%Y-%m-%d %H:%M:%S")
-            logging.info(f"目標時間計算：{target_time_str} (當前時間減 {amount}{unit})")
-            target_info = f"目標時間（{amount}{unit}前）：{target_time_str}\n"
-
-            query = """
-            SELECT *, ABS(strftime('%s', timestamp) - strftime('%s', ?)) AS diff
-            FROM temperature_log
-            ORDER BY diff ASC LIMIT 1;
-            """
-            logging.info(f"執行 SQL 查詢：{query.strip()}，參數：{target_time_str}")
-            cursor.execute(query, (target_time_str,))
-        else:
-            query = "SELECT * FROM temperature_log ORDER BY id DESC LIMIT 1;"
-            logging.info(f"執行 SQL 查詢：{query}")
-            cursor.execute(query)
-
-        row = cursor.fetchone()
-        logging.info(f"取得查詢結果：{row}")
-        conn.close()
-        logging.info("關閉資料庫連線")
-
-        if row:
-            record_time = row[1]  # 假設第2個欄位為 timestamp
-            result = (
-                f"記錄總數: ID={row[0]}, 時間={row[1]}\n"
-                f"目前時間：{current_time_str}\n"
-                f"{target_info}"
-                f"資料記錄時間：{record_time}\n"
-                f"液態溫度={row[2]}°C, 參考溫度={row[3]}°C, 設定溫度={row[4]}°C"
-            )
-            logging.info("成功取得記錄並生成結果字串")
-            return result
-        else:
-            logging.warning("查詢結果為空，資料庫中沒有記錄")
-            return f"目前時間：{current_time_str}\n資料庫中沒有記錄."
-    except Exception as e:
-        logging.error(f"Database error: {e}")
-        return f"資料庫錯誤: {e}"
-
-
-from joblib import load
-
-from pathlib import Path
-import numpy as np
-import pandas as pd
-from joblib import load
-import optuna
-
-def find_optimal_temp_offset(
-    rpm: float,
-    hour: float,
-    *,
-    energy_model_path: str = "energy_model_poly_ridge.joblib",
-    error_model_path: str  = "error_model_poly_ridge.joblib",
-    offset_min: float = 2.5,
-    offset_max: float = 8.5,
-    offset_step: float = 0.1,
-    n_trials: int = 60,
-    seed: int = 42,
-):
-    """回傳 (explanation, best_offset)"""
-
-    # ───────── 1. 參數常數 ─────────
-    _MEDIAN_ABS_AVG_ERR = 6.922       # µm
-    _MEDIAN_TOTAL_POWER = 4974.04     # W
-    _MEDIAN_ABS_MAX_ERR = 11.059      # µm
-
-    _W_AVG_BASE = 1 / _MEDIAN_ABS_AVG_ERR
-    _W_PWR_BASE = 1 / _MEDIAN_TOTAL_POWER
-    _W_MAX_BASE = 1 / _MEDIAN_ABS_MAX_ERR
-
-    # ───────── 2. 動態權重 ─────────
-    def weight_rules(rpm_val: float, hour_val: float):
-        rpm_min, rpm_max = 1500, 12000
-        rpm_norm  = max(0.0, min(1.0, (rpm_val - rpm_min) / (rpm_max - rpm_min)))
-        hour_norm = max(0.0, min(1.0, hour_val / 8.0))
-
-        k_avg, k_max, k_pow, damp = 2.0, 1.0, 3.0, 0.01
-        w_avg = _W_AVG_BASE * (1 + k_avg * rpm_norm)
-        w_max = _W_MAX_BASE * (1 + k_max * rpm_norm)
-        w_pow = _W_PWR_BASE * (1 + k_pow * hour_norm) * (1 - damp * rpm_norm)
-        return w_avg, w_pow, w_max
-
-    # ───────── 3. 載入模型（快取） ─────────
-    energy_model = load(Path(energy_model_path))
-    error_model  = load(Path(error_model_path))
-
-    # ───────── 4. 成本函式 ─────────
-    def cost_fn(offset: float):
-        X_df = pd.DataFrame([[rpm, hour, offset]],
-                            columns=["RPM", "Hour", "TempOffset"])
-        c_power, m_power         = energy_model.predict(X_df)[0]
-        avg_err,  max_err        = error_model.predict(X_df)[0]
-        w_avg, w_pow, w_max      = weight_rules(rpm, hour)
-        total_power              = c_power + m_power
-        cost = (w_avg * abs(avg_err) +
-                w_pow * total_power +
-                w_max * abs(max_err))
-        return cost
-
-    # ───────── 5. Optuna 最佳化 ─────────
-    sampler = optuna.samplers.TPESampler(seed=seed)
-    study   = optuna.create_study(direction="minimize", sampler=sampler)
-
-    def objective(trial):
-        offset = trial.suggest_float(
-            "temp_offset", offset_min, offset_max, step=offset_step
-        )
-        return cost_fn(offset)
-
-    study.optimize(objective, n_trials=n_trials, show_progress_bar=False)
-    best_offset = study.best_params["temp_offset"]
-
-    # ───────── 6. 取得最佳預測值 ─────────
-    X_best = pd.DataFrame([[rpm, hour, best_offset]],
-                          columns=["RPM", "Hour", "TempOffset"])
-    c, m   = energy_model.predict(X_best)[0]
-    a_err, m_err = error_model.predict(X_best)[0]
-    w_avg, w_pow, w_max = weight_rules(rpm, hour)
-
-    # ───────── 7. 組裝說明 ─────────
-    explanation = (
-        f"在 RPM={rpm:.0f}, Hour={hour:.2f} 小時 的情境下，\n"
-        f"採用加權總分評估 (w_avg_err={w_avg:.5f}、w_power={w_pow:.6f}、w_max_err={w_max:.5f})，\n"
-        f"最佳 TempOffset = {best_offset:.1f} °C。\n"
-        f"預測 CoolerPower = {c:.2f} W，MachinePower = {m:.2f} W，"
-        f"總能耗 = {c + m:.2f} W。\n"
-        f"預測 AvgError = {a_err:.2f} μm，MaxError = {m_err:.2f} μm。\n"
-    )
+from temperature_store import fetch_cooler_temperature
+pd = lazy_module("pandas")
 
-    return explanation, best_offset
 # -----------------------------
-# 新增：解析上傳 NC code 檔案內容
+# 新增：解析上傳 NC code 檔案內容（見 nc_program.py；分析結果快取見 nc_analysis_cache.py）
 # -----------------------------
-def parse_nc_code_file(uploaded_file):
-    """
-    從上傳的 txt 檔案讀取 NC code，
-    解析出每一行中的 RPM (Sxxxx) 與延遲時間指令 (G04 Fxxxx.)
-    將延遲時間（秒）轉換成小時後累計，回傳字典 (key: RPM, value: 小時數)
-    """
-    rpm_durations = defaultdict(float)
-    current_rpm = None
-    # 為確保檔案指標在開頭，重新定位
-    uploaded_file.seek(0)
-    content = uploaded_file.read().decode('utf-8')
-    lines = content.splitlines()
-
-    for line in lines:
-        line = line.strip()
-        # 解析 RPM：尋找 S後接數字，如 S1200
-        rpm_match = re.search(r'\bS(\d+)', line, re.IGNORECASE)
-        if rpm_match:
-            current_rpm = int(rpm_match.group(1))
-        # 解析延遲時間：尋找 G04 Fxxxx.，單位為秒，轉換成小時
-        dwell_match = re.search(r'G04\s+F(\d+(?:\.\d+)?)', line, re.IGNORECASE)
-        if dwell_match and current_rpm is not None:
-            delay_seconds = float(dwell_match.group(1))
-            delay_hours = delay_seconds / 3600.0
-            rpm_durations[current_rpm] += delay_hours
-
-    return rpm_durations
-from langchain.prompts import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate
-)
-
-# 先準備一個 prompt template，用於基礎知識取回後的追問
-follow_up_prompt = ChatPromptTemplate.from_messages([
-    SystemMessagePromptTemplate.from_template(
-        "以下是基礎知識：\n\n{basics}\n\n"
-        "請結合上述知識，針對使用者問題直接回答，**不要呼叫任何工具**。"
-    ),
-    HumanMessagePromptTemplate.from_template("{input}")
-])
+from nc_executor import NCAutoAdjustExecutor, build_setpoint_plan
+from nc_analysis_cache import analyze_nc_program
+import knowledge_index
 
 
 def get_cooling_machine_basics():
     """
     提供工具機用冷卻機的基本知識，包括工作原理、主要組件、操作參數與應用場景。
+    內容放在 knowledge/cooling_machine_basics.md，與其他手冊一起由 knowledge_index.py 建立檢索索引。
     """
-    content = """
-## 一、工作原理
-工具機冷卻機（Chiller）主要透過閉迴路的冷凍循環或液體循環，將機床主軸或切削區域產生的熱量帶走並排放到環境中。常見的冷凍循環包含四大步驟：
-1. **壓縮（Compression）**：壓縮機將低壓低溫的冷媒壓縮成高壓高溫的氣體。
-2. **冷凝（Condensation）**：高溫氣體經由冷凝器放熱，凝結成高壓液態冷媒，同時將熱量釋放到空氣或水側。
-3. **膨脹（Expansion）**：液態冷媒通過膨脹閥快速降壓、降溫，成為低溫低壓的液態或氣液混合物。
-4. **蒸發（Evaporation）**：冷媒在蒸發器內吸熱，蒸發成氣體，帶走水／油／乳化液中的熱量，完成冷卻循環。
-
-## 二、主要組件
-- **壓縮機 (Compressor)**：產生冷凍循環所需的壓力差，可選擇活塞式、螺桿式或渦旋式。
-- **冷凝器 (Condenser)**：以風冷或水冷方式，將壓縮後的高溫冷媒排熱；風冷體積小、安裝方便，水冷效率更高。
-- **膨脹閥 (Expansion Valve)**：精確控制冷媒流量，維持蒸發器內適當的壓力與溫度。
-- **蒸發器 (Evaporator)**：冷媒吸熱蒸發的場所，可分板式、殼管式或微通道式，直接與冷卻水或乳化液進行熱交換。
-- **循環泵浦 (Pump)**：驅動冷卻液／冷媒在機床與冷卻機之間循環；流量與壓力需依機床規格選配。
-- **儲液槽與過濾系統**：穩定液位、去除雜質，並在系統維護或循環故障時提供緩衝。
-- **控制系統**：溫度感測器（PT100、熱電偶）＋ PID 控制器，負責保持冷卻液出口溫度在設定值附近。
-
-## 三、主要操作參數
-- **設定冷卻出口溫度**：典型範圍在 15–25 °C，視切削條件與機台規格而定。
-- **流量 (Flow Rate)**：依加工熱量與管路損失，常見 5–20 L/min；保證各冷卻點均有足夠冷卻液。
-- **壓力 (Pressure)**：一般維持 0.2–0.5 MPa，確保冷卻液能有效到達所有冷卻通道。
-- **冷媒濃度或導熱油黏度**：若使用導熱油或乳化液，需定期檢測並調整濃度，以維持熱交換效能。
-- **循環泵轉速**：可透過變頻驅動器 (VFD) 動態調整，達到節能與穩定溫控的平衡。
-
-## 四、應用場景
-1. **高速銑削與精密磨削**：主軸因高速運轉產生大量熱能，需穩定主軸內部軸承與錐度間隙。
-2. **五軸複合加工**：多方向多開刀頭同步運轉，對冷卻均勻性與反應速度要求極高。
-3. **線切割與 EDM**：雖不直接與切削液接觸，但切削液溫度變化仍會影響機台結構與精度。
-4. **塑膠射出與模具冷卻**：模具溫度均勻性直接影響成形品質，需快速抽走模穴熱量。
-"""
-    return content
+    return knowledge_index.read_document(os.path.join(knowledge_index.KNOWLEDGE_DIR, "cooling_machine_basics.md"))
+
+
+@st.cache_resource(ttl=300)
+def get_knowledge_index():
+    """讀取（必要時重建）知識庫索引；每 5 分鐘重新檢查一次文件是否有更新"""
+    return knowledge_index.load_or_build()
 
 # -----------------------------
 # 定義 AI 模型與工具設定（略，與原程式相同）
@@ -295,6 +69,41 @@ tools = [
             "required": ["rpm", "hour"]
         }
     },
+    {
+        "name": "select_temp_offset_tradeoff",
+        "description": "依使用者指定的能耗／精度取捨（例如 MaxError 不超過 20 µm 下能耗最低）選擇溫度偏差",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "rpm": {
+                    "type": "integer",
+                    "description": "主軸轉速"
+                },
+                "hour": {
+                    "type": "integer",
+                    "description": "運轉時間（小時）"
+                },
+                "max_avg_error": {
+                    "type": "number",
+                    "description": "AvgError 絕對值上限（µm），不限制則省略"
+                },
+                "max_max_error": {
+                    "type": "number",
+                    "description": "MaxError 絕對值上限（µm），不限制則省略"
+                },
+                "max_total_power": {
+                    "type": "number",
+                    "description": "總能耗上限（W），不限制則省略"
+                },
+                "minimize": {
+                    "type": "string",
+                    "enum": ["TotalPower", "AvgError", "MaxError"],
+                    "description": "在限制內要最小化的目標，預設為總能耗"
+                }
+            },
+            "required": ["rpm", "hour"]
+        }
+    },
     {
         "name": "fetch_cooler_temperature",
         "description": "從冷卻系統中讀取目前的溫度資料或抓取指定相對時間之前的最新記錄",
@@ -320,30 +129,104 @@ tools = [
     }
 ]
 
-# 使用 OllamaFunctions 初始化 AI 模型
-model = OllamaFunctions(model="llama3.2", format="json", temperature=0)
-model = model.bind_tools(tools=tools)
+@st.cache_resource
+def start_metrics_exporters():
+    """啟動效能指標端點（每個 Streamlit 伺服器行程只執行一次）"""
+    start_exporters_from_env(default_port=9109)
+    return True
+
 
-plain_model = ChatOllama(model="llama3.2", temperature=0)
+@st.cache_resource
+def start_profiler():
+    """依 COOLER_PROFILE 環境變數開啟剖析（每個 Streamlit 伺服器行程只執行一次）"""
+    start_profiling_from_env()
+    return True
 
 
-prompt = ChatPromptTemplate.from_messages([
-    SystemMessage(content=( 
-        "你是一個提供幫助的 AI 助手。"
-        "如果使用者查詢涉及實際資料（例如冷卻系統溫度或冷卻系統最佳化），"
-        "你**必須**呼叫相應的函式並直接回傳結果。"
-        "請勿回傳 JSON，只需返回最終輸出結果。"
-        "若使用者查詢與工具無關，則請一般回答。"
-    )),
-    ("human", "{input}")
-])
+@st.cache_resource
+def get_optimizer():
+    """
+    第一次需要最佳化時才載入 temp_optimizer / pareto（optuna、scikit-learn），
+    並預先載入目前版本的模型（跨 rerun 快取）。
+    """
+    temp_optimizer = timed_import("temp_optimizer")
+    pareto = timed_import("pareto")
+    model_store = timed_import("model_store")
+    try:
+        for path in model_store.resolve_model_paths():
+            model_store.load_model(path)
+    except Exception as e:
+        logging.warning(f"預先載入模型失敗（將於最佳化時再試）: {e}")
+    return temp_optimizer, pareto
+
+
+# 設定後改由 optimizer_service.py 的獨立服務計算（共用模型、合併併發請求），無法連線時退回本機
+OPTIMIZER_SERVICE_URL = os.environ.get("COOLER_OPTIMIZER_URL")
+
+
+def find_optimal_temp_offset(rpm, hour, **kwargs):
+    if OPTIMIZER_SERVICE_URL:
+        try:
+            from optimizer_service import optimize_remote
+            explanation, best_offset, _ = optimize_remote(rpm, hour, url=OPTIMIZER_SERVICE_URL, **kwargs)
+            return explanation, best_offset
+        except Exception as e:
+            logging.warning(f"最佳化服務無法使用，改在本機計算: {e}")
+    temp_optimizer, _ = get_optimizer()
+    return temp_optimizer.find_optimal_temp_offset(rpm, hour, **kwargs)
+
+
+def select_offset(*args, **kwargs):
+    _, pareto = get_optimizer()
+    return pareto.select_offset(*args, **kwargs)
+
+
+@st.cache_resource
+def get_prompts():
+    """LLM 用的 prompt template；langchain 只在第一次查詢時載入"""
+    prompts = timed_import("langchain.prompts")
+    schema = timed_import("langchain.schema")
+    prompt = prompts.ChatPromptTemplate.from_messages([
+        schema.SystemMessage(content=(
+            "你是一個提供幫助的 AI 助手。"
+            "如果使用者查詢涉及實際資料（例如冷卻系統溫度或冷卻系統最佳化），"
+            "你**必須**呼叫相應的函式並直接回傳結果。"
+            "請勿回傳 JSON，只需返回最終輸出結果。"
+            "若使用者查詢與工具無關，則請一般回答。"
+        )),
+        ("human", "{input}")
+    ])
+    # 基礎知識取回後的追問
+    follow_up_prompt = prompts.ChatPromptTemplate.from_messages([
+        prompts.SystemMessagePromptTemplate.from_template(
+            "以下是基礎知識：\n\n{basics}\n\n"
+            "請結合上述知識，針對使用者問題直接回答，**不要呼叫任何工具**。"
+        ),
+        prompts.HumanMessagePromptTemplate.from_template("{input}")
+    ])
+    return prompt, follow_up_prompt
+
+
+@st.cache_resource
+def get_model_session():
+    """
+    建立跨 rerun 共用的 Ollama 工作階段（Streamlit 只會執行一次），
+    並在背景預熱 llama3.2，讓第一個查詢不必等待模型載入。
+    """
+    session = OllamaSessionManager(model_name="llama3.2", temperature=0)
+    session.prewarm_async()
+    return session
+
 
 def process_query(query):
     """根據使用者的查詢處理並回傳結果"""
     logging.info(f"Processing query: {query}")
     # 1. 先讓模型決定要不要呼叫工具
+    session = get_model_session()
+    prompt, follow_up_prompt = get_prompts()
+    model = session.tool_model(tools)
     formatted_prompt = prompt.format_messages(input=query)
-    result = model.invoke(formatted_prompt)
+    result = session.invoke(model, formatted_prompt)
     logging.info(f"Model result: {result}")
 
     # 如果有 tool_calls，處理它們
@@ -362,13 +245,33 @@ def process_query(query):
                 st.session_state.pending_offset = best
                 return explanation + "\n請問是否需要自動調整？請回覆 'yes' 或 'no'."
 
+            elif fn == "select_temp_offset_tradeoff":
+                constraints = {
+                    name: args[key]
+                    for key, name in (("max_avg_error", "AvgError"), ("max_max_error", "MaxError"),
+                                      ("max_total_power", "TotalPower"))
+                    if args.get(key) is not None
+                }
+                explanation, best = select_offset(
+                    args["rpm"], args["hour"], constraints=constraints,
+                    minimize=args.get("minimize") or "TotalPower",
+                )
+                if best is None:
+                    return explanation
+                st.session_state.pending_offset = best
+                return explanation + "\n請問是否需要自動調整？請回覆 'yes' 或 'no'."
+
             elif fn == "get_cooling_machine_basics":
-                basics = get_cooling_machine_basics()
+                # 只把與問題最相關的前 k 段知識放進 prompt（見 knowledge_index.py）
+                hits = get_knowledge_index().search(query, k=knowledge_index.DEFAULT_TOP_K)
+                basics = knowledge_index.format_context(hits) if hits else get_cooling_machine_basics()
+                logging.info(f"知識檢索 {len(hits)} 段：{[chunk['title'] for _, chunk in hits]}，"
+                             f"約 {knowledge_index.estimate_tokens(basics)} tokens")
                 follow_up_messages = follow_up_prompt.format_messages(
                     basics=basics,
                     input=query
                 )
-                follow_up_result = plain_model.invoke(follow_up_messages)
+                follow_up_result = session.invoke(session.chat_model(), follow_up_messages)
                 # 這時模型應該直接回 content，不再 tool_calls
                 return getattr(follow_up_result, "content", str(follow_up_result))
 
@@ -385,34 +288,80 @@ def process_query(query):
 # -----------------------------
 # 新增語音輸入與語音輸出工具
 # -----------------------------
+# 常用的確認／狀態語句，啟動時預先合成，播放時不需再等待 TTS
+COMMON_PHRASES = [
+    "已切換至 語音模式 🎤",
+    "已切換至 文字模式 ⌨️",
+    "🚫 自動調整已取消。",
+    "❓ 請回覆 'yes' 或 'no' 以確認是否自動調整。",
+    "🎉 所有轉速的自動調整操作已完成。",
+]
+
+
+@st.cache_resource
+def get_audio_pipeline():
+    """
+    建立跨 session 共用的背景語音管線。
+    引擎可由 VOICE_TTS_ENGINE（gtts / pyttsx3 / espeak）與
+    VOICE_STT_ENGINE（google / sphinx / whisper / vosk）切換為離線引擎。
+    """
+    pipeline = AudioPipeline(
+        tts_engine=os.environ.get("VOICE_TTS_ENGINE", "gtts"),
+        stt_engine=os.environ.get("VOICE_STT_ENGINE", "google"),
+        cache=PhraseAudioCache(cache_dir="audio_cache"),
+    )
+    pipeline.prefetch(COMMON_PHRASES)
+    return pipeline
+
+
 def record_audio():
-    """使用 speech_recognition 透過麥克風捕捉語音並轉換為文字"""
-    recognizer = sr.Recognizer()
-    mic = sr.Microphone()
-    with mic as source:
-        st.info("請開始說話...")
-        audio = recognizer.listen(source, phrase_time_limit=5)  # 限制錄音時間
+    """在背景執行緒透過麥克風錄音並辨識，立即回傳 Future（結果為文字或 None）"""
+    return get_audio_pipeline().listen(phrase_time_limit=5)  # 限制錄音時間
+
+
+def collect_recording(future):
+    """取出錄音結果；無法辨識或服務錯誤時寫入聊天記錄並回傳 None"""
     try:
-        text = recognizer.recognize_google(audio, language="zh-TW")
-        st.write(f"辨識結果：{text}")
-        return text
-    except sr.UnknownValueError:
-        st.error("無法辨識語音")
+        text = future.result()
+    except Exception as e:
+        st.session_state.chat_history.append(("系統", f"❌ 語音辨識服務錯誤: {e}"))
         return None
-    except sr.RequestError as e:
-        st.error(f"語音辨識服務錯誤: {e}")
+    if not text:
+        st.session_state.chat_history.append(("系統", "❌ 無法辨識語音"))
         return None
+    return text
+
+
+def _log_audio_error(future):
+    if future.exception() is not None:
+        logging.error(f"語音播放發生錯誤: {future.exception()}")
+
 
 def speak_text(text):
-    """使用 gTTS 將文字轉換為語音並播放"""
-    try:
-        tts = gTTS(text=text, lang='zh')
-        filename = "response.mp3"
-        tts.save(filename)
-        playsound(filename)
-        os.remove(filename)
-    except Exception as e:
-        st.error(f"語音播放發生錯誤: {e}")
+    """將文字交給背景語音管線合成並播放，不阻塞介面；重複語句直接使用快取音訊"""
+    future = get_audio_pipeline().speak(text)
+    future.add_done_callback(_log_audio_error)
+    return future
+
+
+@st.fragment(run_every=0.5)
+def voice_input_poller():
+    """定期檢查背景錄音是否完成，完成後送出查詢並重新執行整頁"""
+    future = st.session_state.get("stt_future")
+    if future is None:
+        return
+    if not future.done():
+        st.info("請開始說話...")
+        return
+    st.session_state.stt_future = None
+    user_text = collect_recording(future)
+    if user_text:
+        st.session_state.chat_history.append(("使用者", user_text))
+        response = process_query(user_text)
+        st.session_state.chat_history.append(("系統", response))
+        # 可選：語音播報 AI 回覆
+        # speak_text(response)
+    st.rerun()
 
 
 def send_offset(rpm, offset):
@@ -425,6 +374,171 @@ def send_offset(rpm, offset):
     return resp
 
 
+# -----------------------------
+# 聊天記錄渲染：只渲染最近的視窗，較早訊息按需載入
+# -----------------------------
+CHAT_RENDER_WINDOW = 30
+
+
+def render_chat_message(role, message):
+    with st.chat_message("user" if role == "使用者" else "assistant"):
+        st.markdown(message)
+
+
+def render_chat_history(history):
+    """
+    每次 rerun 只渲染最近 CHAT_RENDER_WINDOW 則訊息，渲染成本不隨對話長度成長；
+    使用者要求時才展開記憶體中較早的訊息，再往前則逐頁讀回磁碟封存。
+    """
+    window = st.session_state.setdefault("chat_window", CHAT_RENDER_WINDOW)
+    loaded_pages = st.session_state.setdefault("chat_loaded_pages", 0)
+    in_memory = history.in_memory_count
+
+    with st.container(height=500):
+        if window < in_memory:
+            if st.button("⬆️ 載入較早訊息", key="chat_load_more"):
+                st.session_state.chat_window += CHAT_RENDER_WINDOW
+                st.rerun()
+        elif loaded_pages < history.archived_pages:
+            if st.button("⬆️ 載入封存訊息", key="chat_load_archive"):
+                st.session_state.chat_loaded_pages += 1
+                st.rerun()
+
+        first_page = history.archived_pages - loaded_pages
+        for page_index in range(first_page, history.archived_pages):
+            for role, message in history.load_page(page_index):
+                render_chat_message(role, message)
+        for role, message in history.recent(window):
+            render_chat_message(role, message)
+
+
+# -----------------------------
+# 即時溫度趨勢圖：資料庫端降採樣＋增量附加
+# -----------------------------
+TREND_WINDOWS = {
+    "1 小時": timedelta(hours=1),
+    "24 小時": timedelta(days=1),
+    "7 天": timedelta(days=7),
+    "30 天": timedelta(days=30),
+}
+TREND_MAX_POINTS = 2000
+TREND_COLUMNS = ["timestamp", "液態溫度", "參考溫度", "設定溫度"]
+
+
+def load_temperature_trend(window_label):
+    """向資料庫要求整個視窗的降採樣結果（最多 TREND_MAX_POINTS 點）"""
+    end = datetime.now() + timedelta(seconds=1)
+    start = end - TREND_WINDOWS[window_label]
+    conn = temperature_store.connect()
+    try:
+        rows, last_id = temperature_store.fetch_range_downsampled(conn, start, end, TREND_MAX_POINTS)
+    finally:
+        conn.close()
+    st.session_state.temperature_trend = {"window": window_label, "rows": rows, "last_id": last_id}
+    return st.session_state.temperature_trend
+
+
+@st.fragment(run_every=2)
+@profiled("ui")
+def temperature_dashboard():
+    """
+    液態／參考／設定溫度趨勢圖。切換視窗時才完整查詢一次，
+    之後每次更新只取 id 大於上次的新資料附加，點數超出預算時再重新降採樣。
+    """
+    window_label = st.selectbox("時間範圍", list(TREND_WINDOWS), key="trend_window")
+    trend = st.session_state.get("temperature_trend")
+    try:
+        if trend is None or trend["window"] != window_label:
+            trend = load_temperature_trend(window_label)
+        else:
+            conn = temperature_store.connect()
+            try:
+                new_rows, trend["last_id"] = temperature_store.fetch_since(conn, trend["last_id"])
+            finally:
+                conn.close()
+            trend["rows"].extend(new_rows)
+            if len(trend["rows"]) > TREND_MAX_POINTS * 1.5:
+                trend = load_temperature_trend(window_label)
+    except Exception as e:
+        st.warning(f"無法讀取溫度資料：{e}")
+        return
+
+    if not trend["rows"]:
+        st.info("此時間範圍內沒有溫度記錄")
+        return
+    df = pd.DataFrame(trend["rows"], columns=TREND_COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    df = df[df["timestamp"] >= datetime.now() - TREND_WINDOWS[window_label]]
+    st.line_chart(df.set_index("timestamp"))
+
+
+# NC 區段時長的倍率；設為 0.001 等小數值可快速試跑整個計畫
+NC_TIME_SCALE = float(os.environ.get("NC_TIME_SCALE", "1.0"))
+
+
+def start_nc_auto_adjust(nc_parameters):
+    """依 NC 程式順序與區段時長建立執行器並在背景啟動；執行器存於 session_state 跨 rerun 延續"""
+    plan = st.session_state.get("nc_plan") or build_setpoint_plan(
+        [{"rpm": rpm, "hours": p["hours"], "start_hours": 0.0}
+         for rpm, p in nc_parameters.items()],
+        nc_parameters,
+    )
+    executor = NCAutoAdjustExecutor(plan, send_offset, time_scale=NC_TIME_SCALE)
+    st.session_state.nc_executor = executor
+    st.session_state.auto_started = True
+    executor.start()
+    return executor
+
+
+@st.fragment(run_every=1)
+def nc_auto_adjust_panel():
+    """顯示背景自動調整的進度與控制按鈕；只重繪本區塊，不會凍結整頁"""
+    executor = st.session_state.get("nc_executor")
+    if executor is None:
+        return
+    progress = executor.snapshot()
+    st.session_state.nc_progress = progress
+
+    state_labels = {"running": "▶️ 執行中", "paused": "⏸️ 已暫停",
+                    "aborted": "⏹️ 已中止", "done": "✅ 已完成", "pending": "等待中"}
+    st.markdown(f"**自動調整狀態：** {state_labels.get(progress['state'], progress['state'])}")
+    st.progress(min(1.0, progress["progress"]))
+    step = progress["current_step"]
+    if step is not None:
+        st.markdown(
+            f"目前區段 {progress['current_index'] + 1}/{progress['total_steps']}："
+            f"RPM {step['rpm']}，Offset={step['best_offset']}，"
+            f"剩餘 {progress['step_remaining_s']:.0f} 秒"
+        )
+
+    if not executor.finished:
+        col_pause, col_abort = st.columns(2)
+        with col_pause:
+            if progress["state"] == "paused":
+                if st.button("▶️ 繼續", key="nc_resume"):
+                    executor.resume()
+            elif st.button("⏸️ 暫停", key="nc_pause"):
+                executor.pause()
+        with col_abort:
+            if st.button("⏹️ 中止", key="nc_abort"):
+                executor.abort()
+
+    if progress["log"]:
+        st.markdown("### ✅ 已完成調整\n" +
+            "\n".join(
+                f"- `{e['time']}` RPM {e['rpm']} → Offset={e['offset']}（{e['hours']:.2f}h），說明：{e['explanation']}，回應：{e['resp']}"
+                for e in progress["log"]
+            ),
+            unsafe_allow_html=True
+        )
+    if progress["state"] == "done":
+        st.success("🎉 所有轉速的自動調整操作已完成。")
+    if executor.finished:
+        # 完成或中止後可直接以同一份計畫重新執行，不必重新上傳檔案
+        if st.button("🔁 重新執行", key="nc_restart"):
+            start_nc_auto_adjust(st.session_state.get("nc_parameters", {}))
+
+
 # -----------------------------
 # Streamlit 主程式 - 美化版（即時顯示修復）
 # -----------------------------
@@ -613,7 +727,7 @@ def main():
 
     # 初始化 session_state
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = ChatHistory()
     if "pending_offset" not in st.session_state:
         st.session_state.pending_offset = None
     if "voice_mode" not in st.session_state:
@@ -621,6 +735,12 @@ def main():
     if "needs_rerun" not in st.session_state:
         st.session_state.needs_rerun = False
 
+    start_metrics_exporters()
+    start_profiler()
+
+    # 啟動時即建立並預熱 LLM 工作階段（跨 rerun 快取）
+    model_session = get_model_session()
+
     # 使用列（columns）來分割介面
     col1, col2 = st.columns([2, 3])
 
@@ -648,28 +768,49 @@ def main():
         if uploaded_file is not None:
             if st.button("📊 讀取並分析 NC code", key="analyze_nc_button"):
                 try:
-                    rpm_durations = parse_nc_code_file(uploaded_file)
-                    nc_parameters = {}
-                    if rpm_durations:
-                        analysis_result = "🔍 NC code 解析結果：\n"
-                        for rpm, hours in rpm_durations.items():
-                            analysis_result += f"\n⚙️ RPM: {rpm} => 運作時間: {hours:.2f} 小時"
-                            explanation, best_offset = find_optimal_temp_offset(rpm, hours)
-                            nc_parameters[rpm] = {
-                                "hours": hours,
-                                "best_offset": best_offset,
-                                "explanation": explanation
-                            }
-                            analysis_result += f"\n🔧 最佳化結果：{explanation}\n"
+                    # 相同內容、模型版本與設定的程式直接取回先前的分析（見 nc_analysis_cache.py）
+                    analysis = analyze_nc_program(uploaded_file.getvalue(), find_optimal_temp_offset)
+                    nc_parameters = analysis["nc_parameters"]
+                    if nc_parameters:
+                        analysis_result = "🔍 NC code 解析結果" + ("（⚡ 快取）" if analysis["cached"] else "") + "：\n"
+                        for rpm, p in nc_parameters.items():
+                            analysis_result += f"\n⚙️ RPM: {rpm} => 運作時間: {p['hours']:.2f} 小時"
+                            analysis_result += f"\n🔧 最佳化結果：{p['explanation']}\n"
                     else:
                         analysis_result = "❌ 未能解析出任何 RPM 與運作時間資訊。"
                     st.session_state.chat_history.append(("使用者", "分析NC-CODE中"))
                     st.session_state.chat_history.append(("系統", analysis_result))
                     st.session_state.nc_parameters = nc_parameters
+                    st.session_state.nc_plan = analysis["plan"]
+                    # 新程式上傳後，中止並重置先前的自動調整
+                    if st.session_state.get("nc_executor") is not None:
+                        st.session_state.nc_executor.abort()
+                    st.session_state.nc_executor = None
+                    st.session_state.auto_started = False
                     st.session_state.needs_rerun = True
                 except Exception as e:
                     st.session_state.chat_history.append(("系統", f"❌ 檔案解析發生錯誤：{e}"))
                     st.session_state.needs_rerun = True
+
+        # 即時溫度趨勢
+        st.markdown("<h2 class='section-title'>📈 即時溫度趨勢</h2>", unsafe_allow_html=True)
+        temperature_dashboard()
+
+        # LLM 模型狀態：冷啟動與熱呼叫延遲、每次查詢的 prompt token 數與 prompt eval 耗時
+        with st.expander("🧠 LLM 模型狀態"):
+            st.json(model_session.latency_report())
+            if model_session.prompt_evals:
+                recent = model_session.prompt_evals[-10:]
+                st.table({"prompt tokens": [tokens for tokens, _ in recent],
+                          "prompt eval (ms)": [round(seconds * 1000, 1) for _, seconds in recent]})
+
+        # 延遲載入的模組與首次載入耗時（完整匯入成本：python lazy_imports.py report voice_app2）
+        with st.expander("⏱️ 模組載入耗時"):
+            loaded = import_times()
+            if loaded:
+                st.table({"模組": list(loaded), "首次載入 (ms)": [round(s * 1000, 1) for s in loaded.values()]})
+            else:
+                st.caption("尚未載入任何延遲模組")
         
     # 自動調整確認區塊
     nc_parameters = st.session_state.get("nc_parameters", {})
@@ -686,76 +827,34 @@ def main():
         # 初始化 state
         if "auto_started" not in st.session_state:
             st.session_state.auto_started = False
-        if "log" not in st.session_state:
-            st.session_state.log = []
 
-        # 啟動開關
+        # 啟動開關：依 NC 程式順序與區段時長在背景執行
         start = st.radio("是否進行自動調整？", ("否", "是")) == "是"
+        executor = st.session_state.get("nc_executor")
+        if not start and (executor is None or executor.finished):
+            # 切回「否」後可再次切到「是」重新執行（執行中的計畫不受影響，請用中止按鈕）
+            st.session_state.auto_started = False
         if start and not st.session_state.auto_started:
-            st.session_state.auto_started = True
-
-        # 真正的自動迴圈
-        if st.session_state.auto_started:
-            placeholder = st.empty()  # 留一個 container 即時更新 log
+            start_nc_auto_adjust(nc_parameters)
 
-            for rpm, p in nc_parameters.items():
-                # 呼叫 send_offset
-                try:
-                    print(rpm)
-                    resp = send_offset(rpm, p["best_offset"])
-                except Exception as e:
-                    resp = f"❌ {e}"
-
-                # 紀錄
-                now = datetime.now().strftime("%H:%M:%S")
-                st.session_state.log.append({
-                    "time": now,
-                    "rpm": rpm,
-                    "offset": p["best_offset"],
-                    "explanation": p["explanation"],
-                    "resp": resp
-                })
-
-                # 更新 log 顯示
-                placeholder.markdown("### ✅ 已完成調整\n" +
-                    "\n".join(
-                        f"- `{e['time']}` RPM {e['rpm']} → Offset={e['offset']}，說明：{e['explanation']}，回應：{e['resp']}"
-                        for e in st.session_state.log
-                    ),
-                    unsafe_allow_html=True
-                )
-                print("Time",p['hours'])
-                # 間隔 5 秒
-                time.sleep(5)
-
-            st.success("🎉 所有轉速的自動調整操作已完成。")
+        nc_auto_adjust_panel()
     # 右側欄位 - 聊天系統
     with col2:
         st.markdown("<div class='card'>", unsafe_allow_html=True)
         st.markdown("<h2 class='section-title'>系統對話</h2>", unsafe_allow_html=True)
         
         # 聊天記錄顯示區
-        chat_html = "<div class='chat-container'>"
-        for role, message in st.session_state.chat_history:
-            if role == "使用者":
-                chat_html += f"<div class='message user-message'>{message}</div><div class='clear'></div>"
-            else:
-                chat_html += f"<div class='message system-message'>{message}</div><div class='clear'></div>"
-        chat_html += "</div>"
-        st.markdown(chat_html, unsafe_allow_html=True)
+        render_chat_history(st.session_state.chat_history)
         
         # 根據是否為語音模式決定輸入方式
         if st.session_state.voice_mode:
             st.markdown("<h3 class='section-title'>🎤 語音輸入模式</h3>", unsafe_allow_html=True)
-            if st.button("🎙️ 開始錄音"):
-                user_text = record_audio()
-                if user_text:
-                    st.session_state.chat_history.append(("使用者", user_text))
-                    response = process_query(user_text)
-                    st.session_state.chat_history.append(("系統", response))
+            if st.session_state.get("stt_future") is None:
+                if st.button("🎙️ 開始錄音"):
+                    st.session_state.stt_future = record_audio()
                     st.session_state.needs_rerun = True  # 標記需要重新執行
-                    # 可選：語音播報 AI 回覆
-                    # speak_text(response)
+            else:
+                voice_input_poller()
         else:
             st.markdown("<h3 class='section-title'>⌨️ 文字輸入模式</h3>", unsafe_allow_html=True)
             with st.form("chat_form", clear_on_submit=True):  # 添加 clear_on_submit=True 提交後清空輸入框
@@ -804,4 +903,5 @@ def main():
         st.rerun()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    with profile_scope("ui"):
+        main()
\ No newline at end of file